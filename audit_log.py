@@ -0,0 +1,390 @@
+"""
+Append-only, tamper-evident audit log
+
+Records are appended to size-bounded segment files as one line each:
+
+    seq \\t timestamp_ms \\t subject \\t json \\t hash
+
+where hash = sha256(previous hash + everything before it on the line), so
+editing, dropping or reordering any record breaks the chain from that
+point on. append() only queues the record; a writer thread commits queued
+records in groups with a single write and fsync per group. Several
+processes may share a directory: commits are serialised with an exclusive
+file lock and each process catches up on the others' records before
+writing. A group whose write or fsync fails is cut off the segment again
+before it is retried, so a retry never leaves part of it in the chain
+twice. Segments are memory-mapped for reads and indexed in memory by
+subject (assessment or report ID) and, sparsely, by time.
+"""
+
+import bisect
+import collections
+import datetime
+import fcntl
+import hashlib
+import itertools
+import json
+import mmap
+import os
+import sys
+import threading
+import time
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+GENESIS_HASH = "0" * 64
+SEGMENT_SUFFIX = ".seg"
+LOCK_FILE = ".lock"
+UNSAFE_SUBJECT_CHARS = str.maketrans("\t\n\r", "   ")
+
+DEFAULT_SEGMENT_BYTES = 64 * 1024 * 1024
+# Time the writer waits for a group to fill before committing it
+DEFAULT_FLUSH_INTERVAL = 0.005
+# One sparse time index entry per this many records
+TIME_INDEX_STRIDE = 256
+
+
+class AuditChainError(Exception):
+    pass
+
+
+def record_hash(prev_hash: str, payload: bytes) -> str:
+    return hashlib.sha256(prev_hash.encode("ascii") + payload).hexdigest()
+
+
+def text_digest(text: str) -> str:
+    """Stands in for free text that must be provably unchanged but not kept in the log"""
+    return "sha256:" + hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def _split(line: bytes) -> Tuple[bytes, int, int, str, bytes, str]:
+    """(payload, seq, ts_ms, subject, json, hash) of one line without its newline"""
+    payload, _, digest = line.rpartition(b"\t")
+    seq, ts, subject, body = payload.split(b"\t", 3)
+    return payload, int(seq), int(ts), subject.decode("utf-8"), body, digest.decode("ascii")
+
+
+def _to_record(line: bytes) -> Dict[str, Any]:
+    _, seq, ts, subject, body, digest = _split(line)
+    return {
+        "seq": seq,
+        "timestamp": datetime.datetime.fromtimestamp(ts / 1000, tz=datetime.timezone.utc).isoformat(),
+        "subject": subject or None,
+        **json.loads(body),
+        "hash": digest,
+    }
+
+
+class _Segment:
+    def __init__(self, path: str, first_seq: int):
+        self.path = path
+        self.first_seq = first_seq
+        self.scanned = 0  # bytes indexed so far
+        self.first_ts: Optional[int] = None
+        self.last_ts: Optional[int] = None
+        self.time_index: List[Tuple[int, int]] = []  # (ts_ms, offset), every TIME_INDEX_STRIDE records
+        self._map: Optional[mmap.mmap] = None
+
+    def view(self) -> Optional[mmap.mmap]:
+        """Read-only map of the segment, re-mapped when the file has grown"""
+        size = os.path.getsize(self.path)
+        if self._map is not None and len(self._map) >= size:
+            return self._map
+        if size == 0:
+            return None
+        if self._map is not None:
+            self._map.close()
+        with open(self.path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ)
+        return self._map
+
+    def close(self) -> None:
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+
+
+class AuditLog:
+    def __init__(self, directory: str, segment_bytes: int = DEFAULT_SEGMENT_BYTES,
+                 flush_interval: float = DEFAULT_FLUSH_INTERVAL):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.flush_interval = flush_interval
+        os.makedirs(directory, exist_ok=True)
+
+        self._segments: List[_Segment] = []
+        self._by_subject: Dict[str, List[Tuple[int, int, int]]] = collections.defaultdict(list)
+        self._last_seq = 0
+        self._last_ts = 0
+        self._last_hash = GENESIS_HASH
+        self._index_lock = threading.RLock()
+
+        self._pending: collections.deque = collections.deque()
+        self._append_lock = threading.Lock()  # keeps tickets in queue order
+        self._tickets = itertools.count(1)
+        self._committed_ticket = 0
+        self._committed = threading.Condition()
+        self._wakeup = threading.Event()
+        self._closing = False
+        self.counters = {"appended": 0, "commits": 0, "committed": 0, "fsync_seconds": 0.0}
+
+        self._lock_fd = os.open(os.path.join(directory, LOCK_FILE), os.O_RDWR | os.O_CREAT, 0o644)
+        with self._file_lock():
+            self._recover_tail()
+            self._catch_up()
+        self._writer = threading.Thread(target=self._write_loop, name="audit-log-writer", daemon=True)
+        self._writer.start()
+
+    # Request path
+
+    def append(self, kind: str, subject: Optional[str], data: Dict[str, Any],
+               tenant: Optional[str] = None, actor: Optional[str] = None) -> int:
+        """Queue a record for the next group commit and return its ticket (see flush)"""
+        with self._append_lock:
+            ticket = next(self._tickets)
+            self._pending.append((ticket, kind, subject or "", tenant, actor, data))
+        self.counters["appended"] += 1
+        if not self._wakeup.is_set():
+            self._wakeup.set()
+        return ticket
+
+    def flush(self, ticket: Optional[int] = None, timeout: Optional[float] = None) -> bool:
+        """Wait until `ticket` (default: everything queued so far) is durable"""
+        if ticket is None:
+            with self._append_lock:
+                ticket = next(self._tickets) - 1
+        self._wakeup.set()
+        with self._committed:
+            return self._committed.wait_for(lambda: self._committed_ticket >= ticket, timeout)
+
+    def close(self) -> None:
+        self._closing = True
+        self._wakeup.set()
+        self._writer.join()
+        with self._index_lock:
+            for segment in self._segments:
+                segment.close()
+        os.close(self._lock_fd)
+
+    # Group commit
+
+    def _file_lock(self):
+        log = self
+
+        class _Locked:
+            def __enter__(self):
+                fcntl.flock(log._lock_fd, fcntl.LOCK_EX)
+
+            def __exit__(self, *exc):
+                fcntl.flock(log._lock_fd, fcntl.LOCK_UN)
+
+        return _Locked()
+
+    def _write_loop(self) -> None:
+        while True:
+            self._wakeup.wait()
+            if not self._closing:
+                time.sleep(self.flush_interval)
+            self._wakeup.clear()
+            batch = []
+            while self._pending:
+                batch.append(self._pending.popleft())
+            if batch:
+                try:
+                    self._commit(batch)
+                except Exception as e:
+                    print(f"Audit log commit failed, {len(batch)} records requeued: {e}", file=sys.stderr)
+                    self._pending.extendleft(reversed(batch))
+                    time.sleep(1.0)
+                    self._wakeup.set()
+                    continue
+            if self._closing and not self._pending:
+                return
+
+    def _commit(self, batch: List[tuple]) -> None:
+        with self._file_lock():
+            with self._index_lock:
+                self._catch_up()
+                seq, prev, ts = self._last_seq, self._last_hash, max(self._last_ts, int(time.time() * 1000))
+                segment = self._segments[-1] if self._segments else None
+
+            lines = []
+            for _, kind, subject, tenant, actor, data in batch:
+                seq += 1
+                body = json.dumps({"kind": kind, "tenant": tenant, "actor": actor, "data": data},
+                                  ensure_ascii=False, separators=(",", ":"), sort_keys=True, default=str)
+                payload = f"{seq}\t{ts}\t{subject.translate(UNSAFE_SUBJECT_CHARS)}\t{body}".encode("utf-8")
+                prev = record_hash(prev, payload)
+                lines.append(payload + b"\t" + prev.encode("ascii") + b"\n")
+            data = b"".join(lines)
+
+            if segment is None or os.path.getsize(segment.path) + len(data) > self.segment_bytes:
+                path = os.path.join(self.directory, f"{self._last_seq + 1:016d}{SEGMENT_SUFFIX}")
+            else:
+                path = segment.path
+
+            started = time.perf_counter()
+            fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                committed = os.fstat(fd).st_size
+                try:
+                    written = 0
+                    while written < len(data):
+                        written += os.write(fd, data[written:])
+                    os.fsync(fd)
+                except OSError:
+                    # Nothing of this group may stay behind for the retry to append again
+                    os.ftruncate(fd, committed)
+                    os.fsync(fd)
+                    raise
+            finally:
+                os.close(fd)
+            if path != getattr(segment, "path", None):
+                dir_fd = os.open(self.directory, os.O_RDONLY)
+                try:
+                    os.fsync(dir_fd)
+                finally:
+                    os.close(dir_fd)
+            self.counters["fsync_seconds"] += time.perf_counter() - started
+
+            with self._index_lock:
+                self._catch_up()
+
+        self.counters["commits"] += 1
+        self.counters["committed"] += len(batch)
+        with self._committed:
+            self._committed_ticket = max(self._committed_ticket, batch[-1][0])
+            self._committed.notify_all()
+
+    # Indexing
+
+    def _recover_tail(self) -> None:
+        """Drop a partially written last line left by a crash (called with the file lock held)"""
+        names = sorted(name for name in os.listdir(self.directory) if name.endswith(SEGMENT_SUFFIX))
+        if not names:
+            return
+        path = os.path.join(self.directory, names[-1])
+        with open(path, "rb+") as f:
+            data = f.read()
+            end = data.rfind(b"\n") + 1
+            if end != len(data):
+                f.truncate(end)
+                f.flush()
+                os.fsync(f.fileno())
+
+    def _catch_up(self) -> None:
+        """Index records appended (by any process) since the last scan"""
+        with self._index_lock:
+            known = {segment.path for segment in self._segments}
+            for name in sorted(os.listdir(self.directory)):
+                path = os.path.join(self.directory, name)
+                if name.endswith(SEGMENT_SUFFIX) and path not in known:
+                    self._segments.append(_Segment(path, int(name[:-len(SEGMENT_SUFFIX)])))
+
+            for number, segment in enumerate(self._segments):
+                view = segment.view()
+                if view is None or segment.scanned >= len(view):
+                    continue
+                offset = segment.scanned
+                while True:
+                    end = view.find(b"\n", offset)
+                    if end < 0:
+                        break  # incomplete line still being written
+                    _, seq, ts, subject, _, digest = _split(view[offset:end])
+                    if seq != self._last_seq + 1:
+                        raise AuditChainError(f"Expected record {self._last_seq + 1}, found {seq} in {segment.path}")
+                    if segment.first_ts is None:
+                        segment.first_ts = ts
+                    if (seq - segment.first_seq) % TIME_INDEX_STRIDE == 0:
+                        segment.time_index.append((ts, offset))
+                    segment.last_ts = ts
+                    if subject:
+                        self._by_subject[subject].append((number, offset, end - offset))
+                    self._last_seq, self._last_ts, self._last_hash = seq, ts, digest
+                    offset = end + 1
+                segment.scanned = offset
+
+    # Reads
+
+    def records_for(self, subject: str) -> List[Dict[str, Any]]:
+        with self._index_lock:
+            self._catch_up()
+            locations = list(self._by_subject.get(subject, ()))
+            return [_to_record(self._segments[number].view()[offset:offset + length])
+                    for number, offset, length in locations]
+
+    def _lines_between(self, start_ms: int, end_ms: int) -> Iterator[bytes]:
+        for segment in self._segments:
+            if segment.first_ts is None or segment.last_ts < start_ms or segment.first_ts >= end_ms:
+                continue
+            view = segment.view()
+            position = bisect.bisect_right(segment.time_index, (start_ms, -1)) - 1
+            offset = segment.time_index[max(position, 0)][1]
+            while offset < segment.scanned:
+                end = view.find(b"\n", offset)
+                line = view[offset:end]
+                offset = end + 1
+                ts = int(line.split(b"\t", 2)[1])
+                if ts >= end_ms:
+                    return
+                if ts >= start_ms:
+                    yield line
+
+    def range(self, start: Optional[datetime.datetime] = None, end: Optional[datetime.datetime] = None,
+              limit: int = 1000, tenant: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Records committed in [start, end), oldest first, optionally of one tenant only"""
+        start_ms = int(start.timestamp() * 1000) if start else 0
+        end_ms = int(end.timestamp() * 1000) if end else sys.maxsize
+        with self._index_lock:
+            self._catch_up()
+            records = (_to_record(line) for line in self._lines_between(start_ms, end_ms))
+            if tenant is not None:
+                records = (record for record in records if record["tenant"] == tenant)
+            return list(itertools.islice(records, limit))
+
+    def verify(self) -> Dict[str, Any]:
+        """Recompute the hash chain over every segment"""
+        prev, expected, count = GENESIS_HASH, 1, 0
+        with self._index_lock:
+            self._catch_up()
+            for segment in self._segments:
+                view = segment.view()
+                offset = 0
+                while view is not None and offset < segment.scanned:
+                    end = view.find(b"\n", offset)
+                    payload, seq, _, _, _, digest = _split(view[offset:end])
+                    if seq != expected or record_hash(prev, payload) != digest:
+                        return {"valid": False, "records": count, "first_invalid_seq": seq,
+                                "segment": os.path.basename(segment.path)}
+                    prev, expected, count = digest, expected + 1, count + 1
+                    offset = end + 1
+        return {"valid": True, "records": count, "head": prev}
+
+    def sample_index(self, count: int) -> Tuple[List[Tuple[str, List[Tuple[int, int, int]]]], int]:
+        """Up to `count` subject index entries spread over the index, and the number of subjects, for size estimates"""
+        with self._index_lock:
+            entries = list(self._by_subject.items())
+        return (entries[::max(1, len(entries) // count)][:count] if count > 0 else []), len(entries)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._index_lock:
+            return {
+                "segments": len(self._segments),
+                "records": self._last_seq,
+                "subjects": len(self._by_subject),
+                "pending": len(self._pending),
+                "head": self._last_hash,
+                **self.counters,
+            }
+
+
+if __name__ == "__main__":
+    # python audit_log.py verify <directory> | tail <directory> [count]
+    command, directory = sys.argv[1], sys.argv[2]
+    log = AuditLog(directory)
+    if command == "verify":
+        report = log.verify()
+        print(json.dumps(report, indent=2))
+        sys.exit(0 if report["valid"] else 1)
+    count = int(sys.argv[3]) if len(sys.argv) > 3 else 20
+    for record in log.range(limit=sys.maxsize)[-count:]:
+        print(json.dumps(record, ensure_ascii=False))
@@ -0,0 +1,140 @@
+"""
+Single-flight request coalescing with a stale-while-revalidate micro-cache
+
+Decorate async route handlers with @cache.coalesce(). Concurrent calls with
+the same route and normalised parameters share one in-flight computation;
+results are served fresh for `ttl` seconds and then stale for up to
+`stale_ttl` more while a single background refresh runs.
+
+The computation runs in a task owned by the cache, and every caller, the
+first one included, waits on it through asyncio.shield. So a disconnecting
+or cancelled caller never cancels it for the others. Each caller gets its
+own deep copy of the result, so a handler's caller can change what it got
+without changing what the cache serves next.
+"""
+
+import asyncio
+import copy
+import datetime
+import functools
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Set, Tuple
+
+
+def normalise_param(value: Any) -> Hashable:
+    """Hashable, order-independent form of a handler argument"""
+    if value is None or isinstance(value, (str, int, float, bool, datetime.date)):
+        return value
+    if isinstance(value, (list, tuple)):
+        return tuple(normalise_param(v) for v in value)
+    if isinstance(value, dict):
+        return tuple(sorted((k, normalise_param(v)) for k, v in value.items()))
+    # Tenants (and anything else carrying a partition key) are keyed by it
+    key = getattr(value, "key", None)
+    if isinstance(key, str):
+        return ("partition", key)
+    raise TypeError(f"Cannot use {type(value).__name__} in a coalescing key")
+
+
+class MicroCache:
+    def __init__(self, ttl: float = 1.0, stale_ttl: float = 5.0, max_entries: int = 2048):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+        self._background: Set[asyncio.Task] = set()
+        self.counters = {"hits": 0, "stale_hits": 0, "misses": 0, "coalesced": 0, "refreshes": 0, "errors": 0}
+
+    def _store(self, key: Hashable, value: Any) -> None:
+        self._entries[key] = (time.monotonic(), value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def _run(self, key: Hashable, compute: Callable[[], Awaitable[Any]]) -> Any:
+        try:
+            value = await compute()
+        except Exception:
+            self.counters["errors"] += 1
+            raise
+        self._store(key, value)
+        return value
+
+    def _start(self, key: Hashable, compute: Callable[[], Awaitable[Any]]) -> asyncio.Task:
+        task = asyncio.ensure_future(self._run(key, compute))
+        self._inflight[key] = task
+        self._background.add(task)
+
+        def done(task: asyncio.Task) -> None:
+            self._background.discard(task)
+            if self._inflight.get(key) is task:
+                del self._inflight[key]
+            if not task.cancelled():
+                # Mark retrieved so a failure no caller is waiting for does not log a warning
+                task.exception()
+
+        task.add_done_callback(done)
+        return task
+
+    def _refresh(self, key: Hashable, compute: Callable[[], Awaitable[Any]]) -> None:
+        if key in self._inflight:
+            return
+        self.counters["refreshes"] += 1
+        self._start(key, compute)  # on failure the stale value is served until it expires
+
+    async def get_or_compute(self, key: Hashable, compute: Callable[[], Awaitable[Any]]) -> Any:
+        entry = self._entries.get(key)
+        if entry is not None:
+            age = time.monotonic() - entry[0]
+            if age < self.ttl:
+                self.counters["hits"] += 1
+                return copy.deepcopy(entry[1])
+            if age < self.ttl + self.stale_ttl:
+                self.counters["stale_hits"] += 1
+                self._refresh(key, compute)
+                return copy.deepcopy(entry[1])
+
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            self.counters["coalesced"] += 1
+        else:
+            self.counters["misses"] += 1
+            inflight = self._start(key, compute)
+        return copy.deepcopy(await asyncio.shield(inflight))
+
+    def coalesce(self, name: Optional[str] = None):
+        """Decorator for async handlers; the key is the handler plus its normalised arguments"""
+        def decorator(func):
+            route = name or func.__qualname__
+
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                key = (route, normalise_param(args), normalise_param(kwargs))
+                return await self.get_or_compute(key, lambda: func(*args, **kwargs))
+
+            return wrapper
+        return decorator
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def evict_fraction(self, fraction: float) -> int:
+        """Drop the oldest share of entries, returning how many were removed"""
+        count = int(len(self._entries) * fraction)
+        for _ in range(count):
+            self._entries.popitem(last=False)
+        return count
+
+    def sample(self, count: int) -> List[Any]:
+        """Up to `count` cached values spread over the cache, for size estimates"""
+        values = [value for _, value in self._entries.values()]
+        return values[::max(1, len(values) // count)][:count] if count > 0 else []
+
+    def stats(self) -> Dict[str, Any]:
+        return {"entries": len(self._entries), "inflight": len(self._inflight),
+                "ttl": self.ttl, "stale_ttl": self.stale_ttl, **self.counters}
@@ -0,0 +1,273 @@
+"""
+Response compression and conditional GET middleware
+
+Pure ASGI so streaming responses are compressed chunk by chunk instead of
+being buffered. Every response of a compressible type carries
+Vary: Accept-Encoding, compressed or not, so shared caches never serve one
+encoding to a client that asked for another. Single-chunk GET responses get
+a weak ETag over the uncompressed body and are answered with 304 when
+If-None-Match matches. Fields holding the time the response was generated
+(VOLATILE_FIELDS) are left out of the ETag of a JSON body; otherwise every
+response that embeds one would get a new ETag and never match.
+brotli and zstd are used when their packages are installed; gzip is always
+available.
+"""
+
+import gzip
+import hashlib
+import json
+import zlib
+from typing import Dict, List, Optional, Tuple
+
+try:
+    import brotli
+except ImportError:  # optional dependency
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # optional dependency
+    zstandard = None
+
+# encoding: (level for normal bodies, level for large bodies)
+COMPRESSION_LEVELS = {
+    "br": (5, 3),
+    "zstd": (6, 3),
+    "gzip": (6, 4),
+}
+
+# Bodies above this size use the faster level from COMPRESSION_LEVELS
+LARGE_BODY_BYTES = 256 * 1024
+
+COMPRESSIBLE_TYPES = ("application/json", "text/", "application/javascript", "application/xml")
+
+# JSON fields stamped with the time a response was made, at any depth; not part of the ETag
+VOLATILE_FIELDS = ("timestamp", "last_updated", "generated_at")
+
+
+def available_encodings() -> List[str]:
+    encodings = []
+    if brotli is not None:
+        encodings.append("br")
+    if zstandard is not None:
+        encodings.append("zstd")
+    encodings.append("gzip")
+    return encodings
+
+
+def negotiate_encoding(accept_encoding: str, supported: List[str]) -> Optional[str]:
+    """Pick the supported encoding with the highest q-value, preferring server order on ties"""
+    weights: Dict[str, float] = {}
+    for part in accept_encoding.split(","):
+        token, _, params = part.strip().partition(";")
+        token = token.strip().lower()
+        if not token:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        weights[token] = q
+
+    best, best_q = None, 0.0
+    for encoding in supported:
+        q = weights.get(encoding, weights.get("*", 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+def make_etag(body: bytes) -> str:
+    return 'W/"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+
+
+def _strip(value, fields):
+    if isinstance(value, dict):
+        return {key: _strip(item, fields) for key, item in value.items() if key not in fields}
+    if isinstance(value, list):
+        return [_strip(item, fields) for item in value]
+    return value
+
+
+def body_etag(body: bytes, content_type: str, volatile_fields: Tuple[str, ...] = VOLATILE_FIELDS) -> str:
+    """make_etag of the body, or of a JSON body without its volatile fields"""
+    if not content_type.startswith("application/json"):
+        return make_etag(body)
+    if any(f'"{field}"'.encode("utf-8") in body for field in volatile_fields):
+        try:
+            document = json.loads(body)
+        except ValueError:
+            return make_etag(body)
+        stable = _strip(document, set(volatile_fields))
+        body = json.dumps(stable, sort_keys=True, separators=(",", ":")).encode("utf-8")
+    return make_etag(body)
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """Weak comparison as required for If-None-Match"""
+    if if_none_match.strip() == "*":
+        return True
+    opaque = etag[2:] if etag.startswith("W/") else etag
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == opaque:
+            return True
+    return False
+
+
+class _StreamCompressor:
+    def __init__(self, encoding: str, level: int):
+        self.encoding = encoding
+        if encoding == "br":
+            self._compressor = brotli.Compressor(quality=level)
+        elif encoding == "zstd":
+            self._compressor = zstandard.ZstdCompressor(level=level).compressobj()
+        else:
+            self._compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data: bytes) -> bytes:
+        """Compress and flush so each chunk reaches the client without waiting for the next"""
+        if self.encoding == "br":
+            return self._compressor.process(data) + self._compressor.flush()
+        if self.encoding == "zstd":
+            return self._compressor.compress(data) + self._compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+        return self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        if self.encoding == "br":
+            return self._compressor.finish()
+        return self._compressor.flush()
+
+
+def compress_body(body: bytes, encoding: str, level: int) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=level)
+    if encoding == "zstd":
+        return zstandard.ZstdCompressor(level=level).compress(body)
+    return gzip.compress(body, compresslevel=level, mtime=0)
+
+
+def _level(encoding: str, size: int) -> int:
+    normal, large = COMPRESSION_LEVELS[encoding]
+    return large if size > LARGE_BODY_BYTES else normal
+
+
+def _header(headers: List[Tuple[bytes, bytes]], name: bytes) -> Optional[bytes]:
+    for key, value in headers:
+        if key.lower() == name:
+            return value
+    return None
+
+
+def _without(headers: List[Tuple[bytes, bytes]], *names: bytes) -> List[Tuple[bytes, bytes]]:
+    return [(key, value) for key, value in headers if key.lower() not in names]
+
+
+def _vary_on_encoding(headers: List[Tuple[bytes, bytes]]) -> List[Tuple[bytes, bytes]]:
+    vary = (_header(headers, b"vary") or b"").decode("latin-1")
+    values = [value.strip().lower() for value in vary.split(",") if value.strip()]
+    if "accept-encoding" in values or "*" in values:
+        return headers
+    vary = vary + ", Accept-Encoding" if vary else "Accept-Encoding"
+    return _without(headers, b"vary") + [(b"vary", vary.encode("latin-1"))]
+
+
+class CompressionMiddleware:
+    def __init__(self, app, minimum_size: int = 1024, etags: bool = True,
+                 volatile_fields: Tuple[str, ...] = VOLATILE_FIELDS):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.etags = etags
+        self.volatile_fields = volatile_fields
+        self.encodings = available_encodings()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_headers = dict(scope["headers"])
+        encoding = negotiate_encoding(request_headers.get(b"accept-encoding", b"").decode("latin-1"), self.encodings)
+        if_none_match = request_headers.get(b"if-none-match", b"").decode("latin-1")
+        conditional = self.etags and scope["method"] == "GET"
+
+        start_message = None
+        compressor: Optional[_StreamCompressor] = None
+        passthrough = False
+
+        async def wrapped_send(message):
+            nonlocal start_message, compressor, passthrough
+
+            if message["type"] == "http.response.start":
+                start_message = message
+                return
+            if message["type"] != "http.response.body" or passthrough:
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+
+            if compressor is not None:
+                chunk = compressor.compress(body)
+                if not more_body:
+                    chunk += compressor.finish()
+                await send({"type": "http.response.body", "body": chunk, "more_body": more_body})
+                return
+
+            headers = list(start_message["headers"])
+            status_code = start_message["status"]
+            content_type = (_header(headers, b"content-type") or b"").decode("latin-1")
+            # The representation depends on Accept-Encoding whether or not this response ends up compressed
+            negotiable = (
+                status_code == 200
+                and _header(headers, b"content-encoding") is None
+                and content_type.startswith(COMPRESSIBLE_TYPES)
+            )
+            if negotiable:
+                headers = _vary_on_encoding(headers)
+            compressible = negotiable and encoding is not None
+
+            if not more_body:
+                # Whole body available: conditional GET, then one-shot compression
+                if conditional and status_code == 200:
+                    etag = ((_header(headers, b"etag") or b"").decode("latin-1")
+                            or body_etag(body, content_type, self.volatile_fields))
+                    headers = _without(headers, b"etag") + [(b"etag", etag.encode("latin-1"))]
+                    if if_none_match and etag_matches(if_none_match, etag):
+                        headers = _without(headers, b"content-length", b"content-type")
+                        await send({"type": "http.response.start", "status": 304, "headers": headers})
+                        await send({"type": "http.response.body", "body": b""})
+                        passthrough = True
+                        return
+                if compressible and len(body) >= self.minimum_size:
+                    body = compress_body(body, encoding, _level(encoding, len(body)))
+                    headers = _without(headers, b"content-length") + [
+                        (b"content-encoding", encoding.encode("latin-1")),
+                        (b"content-length", str(len(body)).encode("latin-1")),
+                    ]
+                await send({**start_message, "headers": headers})
+                await send({"type": "http.response.body", "body": body})
+                passthrough = True
+                return
+
+            # Streaming body: compress incrementally, length is unknown up front
+            if compressible:
+                compressor = _StreamCompressor(encoding, _level(encoding, LARGE_BODY_BYTES + 1))
+                headers = _without(headers, b"content-length") + [
+                    (b"content-encoding", encoding.encode("latin-1")),
+                ]
+                await send({**start_message, "headers": headers})
+                await send({"type": "http.response.body", "body": compressor.compress(body), "more_body": True})
+                return
+
+            await send({**start_message, "headers": headers})
+            passthrough = True
+            await send(message)
+
+        await self.app(scope, receive, wrapped_send)
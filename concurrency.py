@@ -0,0 +1,218 @@
+"""
+Adaptive concurrency limiting with priority load shedding
+
+The limit on in-flight requests follows observed latency. Every 100 ms the
+gradient tolerance * baseline / recent latency is computed, where the
+baseline is the minimum latency seen over the last 30 s window and recent
+latency is a moving average of the per-period mean. While the gradient is
+1 the service is not queueing and the limit grows by about sqrt(limit).
+Below 1 latency is building up and the limit shrinks in proportion.
+Server errors cut the limit multiplicatively.
+
+Routes are mapped to priority classes. Each class may fill a share of the
+limit and wait a bounded time for a slot. Critical routes (health checks,
+token refresh) are never queued or shed. Low-priority work gets no queue
+and is shed straight away with 503 and Retry-After once its share is used.
+"""
+
+import asyncio
+import collections
+import json
+import math
+import time
+from typing import Any, Callable, Dict, Optional, Sequence, Tuple
+
+CRITICAL, HIGH, NORMAL, LOW = 0, 1, 2, 3
+PRIORITY_NAMES = {CRITICAL: "critical", HIGH: "high", NORMAL: "normal", LOW: "low"}
+
+# priority: (share of the limit it may fill, seconds it may wait for a slot)
+PRIORITY_POLICY = {
+    HIGH: (1.0, 2.0),
+    NORMAL: (0.85, 0.5),
+    LOW: (0.5, 0.0),
+}
+
+
+class AdaptiveLimit:
+    def __init__(self, initial: int = 32, minimum: int = 4, maximum: int = 512, tolerance: float = 2.0,
+                 smoothing: float = 0.2, backoff: float = 0.9, update_interval: float = 0.1,
+                 baseline_window: float = 30.0):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.tolerance = tolerance
+        self.smoothing = smoothing
+        self.backoff = backoff
+        self.update_interval = update_interval
+        self.baseline_window = baseline_window
+        self.short_rtt: Optional[float] = None
+        self.min_rtt: Optional[float] = None
+        self._window_min = float("inf")
+        self._window_started = time.monotonic()
+        self._period_started = time.monotonic()
+        self._period_sum = 0.0
+        self._period_count = 0
+        self._period_inflight = 0
+
+    def on_sample(self, rtt: float, inflight: int) -> None:
+        # Baseline: minimum of the previous window, lowered at once by faster samples
+        now = time.monotonic()
+        self._window_min = min(self._window_min, rtt)
+        if self.min_rtt is None or rtt < self.min_rtt:
+            self.min_rtt = rtt
+        if now - self._window_started >= self.baseline_window:
+            self.min_rtt, self._window_min, self._window_started = self._window_min, float("inf"), now
+
+        self._period_sum += rtt
+        self._period_count += 1
+        self._period_inflight = max(self._period_inflight, inflight)
+        if now - self._period_started < self.update_interval:
+            return
+        average = self._period_sum / self._period_count
+        peak_inflight = self._period_inflight
+        self._period_started, self._period_sum, self._period_count, self._period_inflight = now, 0.0, 0, 0
+
+        self.short_rtt = average if self.short_rtt is None else self.short_rtt + (average - self.short_rtt) * 0.5
+        if peak_inflight < self.limit / 2:
+            return  # far from the limit, so latency is not caused by concurrency
+        gradient = max(0.5, min(1.0, self.tolerance * self.min_rtt / self.short_rtt))
+        target = self.limit * gradient + math.sqrt(self.limit)
+        self.limit = self.limit * (1 - self.smoothing) + target * self.smoothing
+        self.limit = max(self.minimum, min(self.maximum, self.limit))
+
+    def on_error(self) -> None:
+        self.limit = max(self.minimum, self.limit * self.backoff)
+
+
+class ConcurrencyLimiter:
+    def __init__(self, limit: Optional[AdaptiveLimit] = None):
+        self.limit = limit or AdaptiveLimit()
+        self.inflight = 0
+        self._waiters: Dict[int, collections.deque] = {priority: collections.deque() for priority in PRIORITY_POLICY}
+        self.counters = {name: {"admitted": 0, "queued": 0, "shed": 0} for name in PRIORITY_NAMES.values()}
+
+    def _capacity(self, priority: int) -> float:
+        return self.limit.limit * PRIORITY_POLICY[priority][0]
+
+    def _waiting_before(self, priority: int) -> bool:
+        return any(self._waiters[p] for p in PRIORITY_POLICY if p <= priority)
+
+    async def acquire(self, priority: int) -> bool:
+        """Take a slot, waiting up to the class's queue time; False means shed"""
+        counters = self.counters[PRIORITY_NAMES[priority]]
+        if priority == CRITICAL or (self.inflight < self._capacity(priority) and not self._waiting_before(priority)):
+            self.inflight += 1
+            counters["admitted"] += 1
+            return True
+
+        max_wait = PRIORITY_POLICY[priority][1]
+        if max_wait <= 0:
+            counters["shed"] += 1
+            return False
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters[priority].append(waiter)
+        counters["queued"] += 1
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), max_wait)
+        except asyncio.TimeoutError:
+            if waiter.done() and not waiter.cancelled():
+                counters["admitted"] += 1
+                return True  # granted just as the wait ran out
+            waiter.cancel()
+            self._waiters[priority].remove(waiter)
+            counters["shed"] += 1
+            return False
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self.release(None, 0)
+            waiter.cancel()
+            raise
+        counters["admitted"] += 1
+        return True
+
+    def release(self, rtt: Optional[float], status_code: int) -> None:
+        self.inflight -= 1
+        if status_code >= 500 and status_code != 503:
+            self.limit.on_error()
+        elif rtt is not None:
+            self.limit.on_sample(rtt, self.inflight + 1)
+        self._grant()
+
+    def _grant(self) -> None:
+        for priority in sorted(self._waiters):
+            waiters = self._waiters[priority]
+            while waiters and self.inflight < self._capacity(priority):
+                waiter = waiters.popleft()
+                if waiter.cancelled():
+                    continue
+                self.inflight += 1
+                waiter.set_result(None)
+            if waiters:
+                return  # keep lower classes behind a waiting higher class
+
+    def retry_after(self) -> int:
+        """Seconds a shed client should wait: roughly the time to drain the current load"""
+        rtt = self.limit.short_rtt or 1.0
+        return max(1, min(30, math.ceil(rtt * self.inflight / max(self.limit.limit, 1))))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "limit": round(self.limit.limit, 1),
+            "inflight": self.inflight,
+            "short_rtt_ms": round((self.limit.short_rtt or 0) * 1000, 2),
+            "min_rtt_ms": round((self.limit.min_rtt or 0) * 1000, 2),
+            "waiting": {PRIORITY_NAMES[p]: sum(not w.cancelled() for w in q) for p, q in self._waiters.items()},
+            "classes": self.counters,
+        }
+
+
+def route_classifier(rules: Sequence[Tuple[str, Optional[str], int]], default: int = NORMAL) -> Callable[[str, str], int]:
+    """Priority from the first (path prefix, method or None, priority) rule that matches"""
+    def classify(method: str, path: str) -> int:
+        for prefix, rule_method, priority in rules:
+            if path.startswith(prefix) and (rule_method is None or rule_method == method):
+                return priority
+        return default
+    return classify
+
+
+class ConcurrencyMiddleware:
+    def __init__(self, app, limiter: ConcurrencyLimiter, classify: Callable[[str, str], int]):
+        self.app = app
+        self.limiter = limiter
+        self.classify = classify
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] == "OPTIONS":
+            await self.app(scope, receive, send)
+            return
+
+        priority = self.classify(scope["method"], scope["path"])
+        if not await self.limiter.acquire(priority):
+            body = json.dumps({"detail": "Server is overloaded, please retry later"}).encode()
+            await send({"type": "http.response.start", "status": 503, "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", str(self.limiter.retry_after()).encode()),
+            ]})
+            await send({"type": "http.response.body", "body": body})
+            return
+
+        started = time.perf_counter()
+        status_code = 500
+        first_byte: Optional[float] = None
+
+        async def timed_send(message):
+            nonlocal status_code, first_byte
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                first_byte = time.perf_counter()
+            await send(message)
+
+        try:
+            await self.app(scope, receive, timed_send)
+        finally:
+            # Latency to the response head; streamed bodies would otherwise dominate
+            rtt = None if priority == CRITICAL or first_byte is None else first_byte - started
+            self.limiter.release(rtt, status_code)
@@ -0,0 +1,241 @@
+"""
+Precomputed quick check decision table
+
+Enumerates the finite QuickCheckRequest input space through the rules engine
+and materialises it as a compact, versioned artefact. Row indexes are
+mixed-radix over the fields below (last field varies fastest); set-valued
+fields contribute a bitmask over their values. Free-text descriptions are
+not part of the table: every row is evaluated with an empty description.
+A description carrying a high-risk or prohibited-practice signal (see
+description_signals.py) escalates the server's answer, so an offline
+lookup differs from the server whenever the description carries one. The
+artefact says so in "description_evaluated": false.
+"""
+
+import base64
+import hashlib
+import itertools
+import json
+import sys
+import threading
+import zlib
+from typing import Any, Dict, List, Optional, Tuple
+
+from description_signals import evaluate
+
+FORMAT_NAME = "judge-dredd-decision-table"
+FORMAT_VERSION = 1
+
+# Input domains accepted by decision_tree.json, in table order
+QUICK_CHECK_DOMAINS = [
+    {"name": "ai_system_type", "kind": "enum", "values": [
+        "generative_ai", "predictive_analytics", "computer_vision",
+        "nlp", "decision_support", "other"]},
+    {"name": "branch_sector", "kind": "enum", "values": [
+        "public_sector", "healthcare", "finance", "education",
+        "employment", "law_enforcement", "retail", "other"]},
+    {"name": "role", "kind": "enum", "values": [
+        "provider", "deployer", "importer", "distributor"]},
+    {"name": "handles_personal_data", "kind": "bool", "values": [False, True]},
+    {"name": "automated_decisions", "kind": "bool", "values": [False, True]},
+    {"name": "decision_type", "kind": "enum", "values": [
+        "monitoring", "recommendation", "automated_decision"]},
+    {"name": "decision_impact", "kind": "set", "values": [
+        "legal_effects", "financial", "employment"]},
+    {"name": "data_types", "kind": "set", "values": [
+        "basic_personal", "sensitive", "biometric", "criminal"]},
+]
+
+OUTCOME_FIELDS = ("risk_score", "risk_level", "decision", "compliance_status", "required_assessments")
+
+
+def _radix(field: Dict[str, Any]) -> int:
+    if field["kind"] == "set":
+        return 1 << len(field["values"])
+    return len(field["values"])
+
+
+def _field_options(field: Dict[str, Any]) -> List[Any]:
+    if field["kind"] != "set":
+        return list(field["values"])
+    values = field["values"]
+    return [[v for bit, v in enumerate(values) if mask & (1 << bit)] for mask in range(1 << len(values))]
+
+
+def ruleset_digest(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def ruleset_hash(decision_tree_path: str) -> str:
+    with open(decision_tree_path, "rb") as f:
+        return ruleset_digest(f.read())
+
+
+def table_etag(ruleset_digest: str, domains: List[Dict[str, Any]] = QUICK_CHECK_DOMAINS) -> str:
+    """ETag is derived from inputs only, so it is known before the table is built"""
+    fingerprint = json.dumps([FORMAT_VERSION, ruleset_digest, domains], sort_keys=True)
+    return '"' + hashlib.sha256(fingerprint.encode("utf-8")).hexdigest()[:32] + '"'
+
+
+def build_decision_table(engine, ruleset_digest: str,
+                         domains: List[Dict[str, Any]] = QUICK_CHECK_DOMAINS) -> Dict[str, Any]:
+    """Evaluate every input combination and return the serialisable artefact"""
+    names = [field["name"] for field in domains]
+    outcomes: List[Dict[str, Any]] = []
+    outcome_ids: Dict[Tuple, int] = {}
+    rows: List[int] = []
+
+    for combination in itertools.product(*(_field_options(field) for field in domains)):
+        user_responses = dict(zip(names, combination))
+        user_responses["description"] = ""
+        # Without a description there are no signals to escalate on
+        result, _ = evaluate(engine, None, user_responses)
+        outcome = tuple(
+            tuple(getattr(result, name)) if name == "required_assessments" else getattr(result, name)
+            for name in OUTCOME_FIELDS
+        )
+        outcome_id = outcome_ids.get(outcome)
+        if outcome_id is None:
+            outcome_id = outcome_ids[outcome] = len(outcomes)
+            outcomes.append({name: list(v) if isinstance(v, tuple) else v for name, v in zip(OUTCOME_FIELDS, outcome)})
+        rows.append(outcome_id)
+
+    width = 1 if len(outcomes) <= 0xFF else 2 if len(outcomes) <= 0xFFFF else 4
+    packed = b"".join(row.to_bytes(width, "little") for row in rows)
+
+    return {
+        "format": FORMAT_NAME,
+        "version": FORMAT_VERSION,
+        "ruleset_hash": ruleset_digest,
+        "etag": table_etag(ruleset_digest, domains),
+        "fields": domains,
+        "row_count": len(rows),
+        "outcomes": outcomes,
+        "outcome_width": width,
+        # Rows ignore the description; the server escalates on its signals
+        "description_evaluated": False,
+        "table": base64.b64encode(zlib.compress(packed, 9)).decode("ascii"),
+    }
+
+
+def row_index(table: Dict[str, Any], user_responses: Dict[str, Any]) -> Optional[int]:
+    """Mixed-radix row index for an input, or None if it falls outside the table"""
+    index = 0
+    for field in table["fields"]:
+        value = user_responses.get(field["name"])
+        values = field["values"]
+        if field["kind"] == "set":
+            digit = 0
+            for item in value or []:
+                if item not in values:
+                    return None
+                digit |= 1 << values.index(item)
+        else:
+            if field["kind"] == "bool":
+                value = bool(value)
+            if value not in values:
+                return None
+            digit = values.index(value)
+        index = index * _radix(field) + digit
+    return index
+
+
+def unpack_rows(table: Dict[str, Any]) -> List[int]:
+    packed = zlib.decompress(base64.b64decode(table["table"]))
+    width = table["outcome_width"]
+    return [int.from_bytes(packed[i:i + width], "little") for i in range(0, len(packed), width)]
+
+
+def lookup(table: Dict[str, Any], user_responses: Dict[str, Any],
+           rows: Optional[List[int]] = None) -> Optional[Dict[str, Any]]:
+    """Answer a quick check from the table, mirroring what a client would do offline"""
+    index = row_index(table, user_responses)
+    if index is None:
+        return None
+    if rows is None:
+        rows = unpack_rows(table)
+    return table["outcomes"][rows[index]]
+
+
+def diff_tables(old: Dict[str, Any], new: Dict[str, Any], limit: int = 50) -> Dict[str, Any]:
+    """Compare two tables over the same domains, listing changed rows"""
+    if old["fields"] != new["fields"]:
+        raise ValueError("Decision tables have different input domains")
+    old_rows, new_rows = unpack_rows(old), unpack_rows(new)
+    changed = []
+    for index, (a, b) in enumerate(zip(old_rows, new_rows)):
+        before, after = old["outcomes"][a], new["outcomes"][b]
+        if before != after:
+            changed.append({"row": index, "before": before, "after": after})
+    return {"changed_rows": len(changed), "examples": changed[:limit]}
+
+
+class DecisionTableCache:
+    """
+    Builds the table once per ruleset and keeps it for the process lifetime. The
+    engine and the hash of the ruleset it was loaded from are given together
+    (see use), so a table is never labelled with a ruleset it was not built from.
+    """
+
+    def __init__(self, engine, ruleset_digest: str):
+        self.engine = engine
+        self.ruleset_digest = ruleset_digest
+        self._lock = threading.Lock()
+        self._table: Optional[Dict[str, Any]] = None
+        self._body: Optional[bytes] = None
+
+    def use(self, engine, ruleset_digest: str) -> None:
+        """Build from this engine, loaded from the ruleset with this hash, from now on"""
+        with self._lock:
+            self.engine, self.ruleset_digest = engine, ruleset_digest
+
+    @property
+    def etag(self) -> str:
+        return table_etag(self.ruleset_digest)
+
+    def get(self) -> Tuple[Dict[str, Any], bytes]:
+        with self._lock:
+            if self._table is None or self._table["ruleset_hash"] != self.ruleset_digest:
+                self._table = build_decision_table(self.engine, self.ruleset_digest)
+                self._body = json.dumps(self._table, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+            return self._table, self._body
+
+    def size_bytes(self) -> int:
+        """Rough bytes held: the JSON body, and the parsed table, which holds about as much"""
+        body = self._body
+        return 2 * len(body) if body else 0
+
+    def built(self) -> Optional[Dict[str, Any]]:
+        """The table if it has been built, for snapshots"""
+        return self._table
+
+    def adopt(self, table: Dict[str, Any]) -> bool:
+        """Use a previously built table; rejected unless it was built for the current ruleset"""
+        with self._lock:
+            if table.get("version") != FORMAT_VERSION or table.get("ruleset_hash") != self.ruleset_digest:
+                return False
+            self._table = table
+            self._body = json.dumps(table, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        return True
+
+
+if __name__ == "__main__":
+    # python decision_table.py export <out.json> | verify <fixture.json>
+    from rules_engine import AIComplianceRulesEngine
+
+    command, path = sys.argv[1], sys.argv[2]
+    digest = ruleset_hash("decision_tree.json")
+    engine = AIComplianceRulesEngine("decision_tree.json")
+    if ruleset_hash("decision_tree.json") != digest:
+        sys.exit("decision_tree.json changed while the rules engine was loaded")
+    table = build_decision_table(engine, digest)
+    if command == "export":
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(table, f, ensure_ascii=False, separators=(",", ":"))
+        print(f"Wrote {table['row_count']} rows, {len(table['outcomes'])} distinct outcomes to {path}")
+    else:
+        with open(path, encoding="utf-8") as f:
+            fixture = json.load(f)
+        report = diff_tables(fixture, table)
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+        sys.exit(1 if report["changed_rows"] else 0)
@@ -0,0 +1,294 @@
+"""
+High-risk and prohibited-practice signals in free-text system descriptions
+
+Term lists for the AI Act's prohibited practices (article 5) and Annex III
+high-risk areas, in Danish and English, are compiled into one Aho-Corasick
+automaton when the ruleset is loaded. A description is scanned once,
+character by character, whatever the number of terms. A term ending in `*`
+is a stem and matches any inflection or compound ending ("ansigtsgenkend*"
+matches "ansigtsgenkendelsen"); `*` is only special at the end. Other terms
+must match whole words. Every term must start at a word boundary, so terms are
+compiled with the surrounding spaces of the normalised text, and the scan
+skips straight to the next space whenever no partial match is open.
+
+The ruleset may replace the built-in lists with a "description_signals"
+list of {"id", "category", "reference", "terms"} objects.
+
+evaluate() is the one place a rules engine result is combined with the
+signals. The engine evaluates the answers as usual, and the result of an
+escalated system is then raised to what its escalated classification
+guarantees (ESCALATED_RESULTS): a minimum risk score and decision, and
+the assessments that classification requires. Only the engine's public
+evaluate_system() is called, so this holds however the engine derives
+its own classification internally. Every evaluation path (assessments,
+re-scoring, what-if, the wizard and the decision table) goes through it.
+"""
+
+import copy
+import re
+import sys
+import time
+import unicodedata
+from typing import Any, Dict, List, Optional, Tuple
+
+# Classifications in increasing order of severity, as returned by the rules engine
+CLASSIFICATION_ORDER = ("minimal_risk", "limited_risk", "high_risk", "unacceptable")
+
+# Signal category -> lowest classification a system with that signal can get
+CATEGORY_FLOORS = {
+    "prohibited": "unacceptable",
+    "high_risk": "high_risk",
+}
+
+# Decisions in increasing order of severity
+DECISION_ORDER = ("GO", "BETINGET GO", "NO-GO")
+
+# What a result is raised to when the description escalates the classification. Scores use the risk
+# bands used throughout (70-100 high, 40-69 medium, 0-39 low).
+ESCALATED_RESULTS = {
+    "high_risk": {"risk_score": 70, "decision": "BETINGET GO", "required_assessments": ["FRIA"]},
+    "unacceptable": {"risk_score": 90, "decision": "NO-GO", "required_assessments": []},
+}
+
+# Matched terms reported per signal
+MAX_REPORTED_TERMS = 5
+
+DEFAULT_SIGNALS: List[Dict[str, Any]] = [
+    # Prohibited practices, article 5
+    {"id": "social_scoring", "category": "prohibited", "reference": "AI-forordningen art. 5, stk. 1, litra c",
+     "terms": ["social scoring", "social score*", "social credit*", "socialt pointsystem*", "social pointgiv*",
+               "borgerscore*", "adfærdsscore*"]},
+    {"id": "manipulation", "category": "prohibited", "reference": "AI-forordningen art. 5, stk. 1, litra a-b",
+     "terms": ["subliminal*", "underbevidst påvirk*", "underbevidste påvirk*", "manipulerende teknik*", "manipulative technique*",
+               "udnytte sårbarhed*", "exploit vulnerabilit*", "exploiting vulnerabilit*", "exploits vulnerabilit*"]},
+    {"id": "face_scraping", "category": "prohibited", "reference": "AI-forordningen art. 5, stk. 1, litra e",
+     "terms": ["face scraping", "scraping af ansigt*", "scraping facial image*", "scrape facial image*", "untargeted scraping"]},
+    {"id": "individual_crime_prediction", "category": "prohibited", "reference": "AI-forordningen art. 5, stk. 1, litra d",
+     "terms": ["kriminalitetsforudsig*", "forudsige kriminalitet", "forudsigelse af kriminalitet", "crime prediction",
+               "predictive policing", "predict criminal*", "predicting criminal*"]},
+    {"id": "realtime_remote_biometrics", "category": "prohibited", "reference": "AI-forordningen art. 5, stk. 1, litra h",
+     "terms": ["realtidsansigtsgenkend*", "live ansigtsgenkend*", "biometrisk fjernidentifikation i realtid",
+               "real-time remote biometric*", "real time remote biometric*", "live facial recognition"]},
+    {"id": "biometric_categorisation", "category": "prohibited", "reference": "AI-forordningen art. 5, stk. 1, litra g",
+     "terms": ["biometrisk kategoriser*", "biometric categori*"]},
+
+    # High-risk areas, Annex III
+    {"id": "biometric_identification", "category": "high_risk", "reference": "AI-forordningen bilag III, punkt 1",
+     "terms": ["ansigtsgenkend*", "ansigtsidentifik*", "biometrisk identifik*", "biometriske identifik*", "biometri*", "fingeraftryk*",
+               "stemmegenkend*", "følelsesgenkend*", "facial recognition", "face recognition", "biometric*",
+               "fingerprint*", "voice recognition", "emotion recognition"]},
+    {"id": "critical_infrastructure", "category": "high_risk", "reference": "AI-forordningen bilag III, punkt 2",
+     "terms": ["kritisk infrastruktur", "kritiske infrastruktur*", "elnet*", "elforsyning*", "vandforsyning*",
+               "fjernvarme*", "gasforsyning*", "vejtrafik*", "critical infrastructure", "power grid*",
+               "water supply", "electricity supply", "road traffic"]},
+    {"id": "education", "category": "high_risk", "reference": "AI-forordningen bilag III, punkt 3",
+     "terms": ["eksamen*", "eksamens*", "karaktergiv*", "bedømmelse af studerende", "bedømmelse af elever",
+               "optagelse på uddannels*", "eksamensovervåg*", "exam proctoring", "student assessment*",
+               "grading", "admission to education"]},
+    {"id": "employment", "category": "high_risk", "reference": "AI-forordningen bilag III, punkt 4",
+     "terms": ["rekruttering*", "rekrutter*", "ansættelse*", "jobansøg*", "ansøgere", "kandidatscreening*",
+               "cv-screening*", "medarbejderovervåg*", "afskedig*", "forfremmelse*", "arbejdsopgavefordeling*",
+               "recruit*", "hiring", "job applica*", "candidate screening", "cv screening", "employee monitoring",
+               "termination of employment", "promotion decision*"]},
+    {"id": "essential_services", "category": "high_risk", "reference": "AI-forordningen bilag III, punkt 5",
+     "terms": ["kreditvurder*", "kreditværdig*", "kreditscor*", "lånansøg*", "offentlige ydelser",
+               "sociale ydelser", "kontanthjælp*", "boligstøtte*", "førtidspension*", "sygeforsikring*",
+               "livsforsikring*", "nødopkald*", "alarmcentral*", "visitering af patienter", "credit scor*",
+               "creditworth*", "loan applica*", "public benefit*", "social benefit*", "welfare benefit*",
+               "life insurance", "health insurance", "emergency call*", "emergency triage"]},
+    {"id": "law_enforcement", "category": "high_risk", "reference": "AI-forordningen bilag III, punkt 6",
+     "terms": ["politi", "politiet", "politiets", "politimæssig*", "efterforskning*", "bevisvurdering*",
+               "recidivrisiko*", "gentagelsesrisiko*", "law enforcement", "police", "criminal investigation*",
+               "reoffending", "recidivism"]},
+    {"id": "migration_border", "category": "high_risk", "reference": "AI-forordningen bilag III, punkt 7",
+     "terms": ["asyl", "asylansøg*", "asylsag*", "visumansøg*", "grænsekontrol*", "opholdstilladelse*",
+               "udlændingesag*", "asylum", "visa applica*", "border control", "residence permit*"]},
+    {"id": "justice_democracy", "category": "high_risk", "reference": "AI-forordningen bilag III, punkt 8",
+     "terms": ["domstol*", "retsafgørelse*", "dommere", "retssag*", "vælgeradfærd*", "valgkamp*",
+               "court decision*", "judicial", "judges", "voting behavio*", "election campaign*"]},
+]
+
+_NON_WORD = re.compile(r"[\W_]+", re.UNICODE)
+
+
+def normalise(text: str) -> str:
+    """Casefolded text with every run of non-word characters turned into one space"""
+    text = unicodedata.normalize("NFKC", text or "").casefold()
+    return " " + _NON_WORD.sub(" ", text).strip() + " "
+
+
+class DescriptionAnalyzer:
+    def __init__(self, signals: List[Dict[str, Any]]):
+        self.signals = signals
+        # Per state: character -> next state, for every character used by any term (a DFA)
+        self._delta: List[Dict[str, int]] = [{}]
+        # Per state: (signal index, term) of the terms ending there
+        self._outputs: List[List[Tuple[int, str]]] = [[]]
+        self.term_count = 0
+
+        for signal_index, signal in enumerate(signals):
+            for raw in signal["terms"]:
+                term = normalise(raw.rstrip("*")).strip()
+                if not term:
+                    continue
+                # A leading space anchors the term to a word start, a trailing one to a word end
+                pattern = f" {term}" if raw.endswith("*") else f" {term} "
+                self._add(pattern, (signal_index, term))
+        self._link()
+
+    @classmethod
+    def from_ruleset(cls, tree: Dict[str, Any]) -> "DescriptionAnalyzer":
+        return cls(tree.get("description_signals") or DEFAULT_SIGNALS)
+
+    def _add(self, term: str, output: Tuple[int, str]) -> None:
+        state = 0
+        for ch in term:
+            following = self._delta[state].get(ch)
+            if following is None:
+                following = len(self._delta)
+                self._delta[state][ch] = following
+                self._delta.append({})
+                self._outputs.append([])
+            state = following
+        self._outputs[state].append(output)
+        self.term_count += 1
+
+    def _link(self) -> None:
+        """Add failure links, then fold them into the transitions so scanning never backtracks"""
+        trie = [dict(edges) for edges in self._delta]
+        alphabet = {ch for edges in trie for ch in edges}
+        fail = [0] * len(trie)
+        order = []
+        queue = list(trie[0].values())
+        while queue:
+            order.extend(queue)
+            next_queue = []
+            for state in queue:
+                for ch, child in trie[state].items():
+                    f = fail[state]
+                    while f and ch not in trie[f]:
+                        f = fail[f]
+                    fail[child] = trie[f].get(ch, 0) if trie[f].get(ch, 0) != child else 0
+                    self._outputs[child] = self._outputs[child] + self._outputs[fail[child]]
+                    next_queue.append(child)
+            queue = next_queue
+
+        # Breadth-first order guarantees a failure state's transitions are complete before use
+        self._delta[0] = dict(trie[0])
+        for state in order:
+            delta = self._delta[fail[state]]
+            self._delta[state] = {ch: trie[state][ch] if ch in trie[state] else delta[ch]
+                                  for ch in alphabet if ch in trie[state] or ch in delta}
+
+    def scan(self, text: str) -> List[Dict[str, Any]]:
+        """Signals found in `text`, with the terms that matched and how often"""
+        text = normalise(text)
+        delta, outputs = self._delta, self._outputs
+        hits: Dict[int, Dict[str, int]] = {}
+        state, i, n = 0, 0, len(text)
+        while i < n:
+            if not state:
+                # Every pattern starts with a space, so nothing can match before the next one
+                i = text.find(" ", i)
+                if i < 0:
+                    break
+            state = delta[state].get(text[i], 0)
+            if outputs[state]:
+                for signal_index, term in outputs[state]:
+                    terms = hits.setdefault(signal_index, {})
+                    terms[term] = terms.get(term, 0) + 1
+            i += 1
+        found = []
+        for signal_index, terms in sorted(hits.items()):
+            signal = self.signals[signal_index]
+            found.append({
+                "id": signal["id"],
+                "category": signal["category"],
+                "reference": signal.get("reference"),
+                "terms": sorted(terms, key=lambda term: -terms[term])[:MAX_REPORTED_TERMS],
+                "matches": sum(terms.values()),
+            })
+        return found
+
+    def stats(self) -> Dict[str, Any]:
+        return {"signals": len(self.signals), "terms": self.term_count, "states": len(self._delta)}
+
+
+def classification_floor(signals: List[Dict[str, Any]]) -> Optional[str]:
+    floors = [CATEGORY_FLOORS[s["category"]] for s in signals if s["category"] in CATEGORY_FLOORS]
+    return max(floors, key=CLASSIFICATION_ORDER.index) if floors else None
+
+
+def escalate(classification: str, signals: List[Dict[str, Any]]) -> str:
+    """The engine's classification, raised to the floor implied by the description's signals"""
+    floor = classification_floor(signals)
+    if floor is None or classification not in CLASSIFICATION_ORDER:
+        return classification
+    return max(classification, floor, key=CLASSIFICATION_ORDER.index)
+
+
+def classify(engine, analyzer: Optional[DescriptionAnalyzer],
+             user_responses: Dict[str, Any]) -> Tuple[str, str, List[Dict[str, Any]]]:
+    """(engine classification, classification raised by the description's signals, the signals)"""
+    signals = analyzer.scan(user_responses.get("description") or "") if analyzer is not None else []
+    classification = engine._classify_ai_system(user_responses)
+    return classification, escalate(classification, signals), signals
+
+
+def _risk_level(score: int, like: str) -> str:
+    """The risk level of a score, in the same case as the engine's level `like`"""
+    level = "high" if score >= 70 else "medium" if score >= 40 else "low"
+    return level.upper() if like.isupper() else level.capitalize() if like[:1].isupper() else level
+
+
+def escalate_result(result, engine_classification: str, classification: str):
+    """A copy of the engine's `result` raised to the minimums of the escalated `classification`"""
+    floor = ESCALATED_RESULTS.get(classification)
+    result = copy.copy(result)
+    result.assessment_details = {**result.assessment_details, "escalated_from": engine_classification}
+    if floor is None:
+        return result
+    if result.risk_score < floor["risk_score"]:
+        result.risk_score = floor["risk_score"]
+        result.risk_level = _risk_level(floor["risk_score"], result.risk_level)
+    if result.decision in DECISION_ORDER and DECISION_ORDER.index(result.decision) < DECISION_ORDER.index(floor["decision"]):
+        result.decision = floor["decision"]
+    missing = [name for name in floor["required_assessments"] if name not in result.required_assessments]
+    if missing:
+        result.required_assessments = list(result.required_assessments) + missing
+    return result
+
+
+def evaluate(engine, analyzer: Optional[DescriptionAnalyzer], user_responses: Dict[str, Any]):
+    """(result, classification) of the rules engine, with the result raised to an escalated classification"""
+    engine_classification, classification, signals = classify(engine, analyzer, user_responses)
+    result = engine.evaluate_system(user_responses)
+    if classification != engine_classification:
+        result = escalate_result(result, engine_classification, classification)
+    if signals:
+        result = copy.copy(result)
+        result.assessment_details = {**result.assessment_details, "description_signals": signals}
+    return result, classification
+
+
+if __name__ == "__main__":
+    # python description_signals.py [kilobytes] [repeats]  - scanning throughput benchmark
+    size = int(sys.argv[1]) * 1024 if len(sys.argv) > 1 else 10 * 1024
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+
+    started = time.perf_counter()
+    analyzer = DescriptionAnalyzer(DEFAULT_SIGNALS)
+    compile_ms = (time.perf_counter() - started) * 1000
+
+    filler = ("Systemet understøtter sagsbehandlere i kommunen med at prioritere henvendelser og "
+              "udarbejde udkast til svar. Modellen er trænet på historiske sager og evalueres løbende. ")
+    text = (filler * (size // len(filler) + 1))[:size - 80] + " Løsningen anvender ansigtsgenkendelse ved rekruttering."
+
+    started = time.perf_counter()
+    for _ in range(repeats):
+        signals = analyzer.scan(text)
+    elapsed = time.perf_counter() - started
+    print(f"{analyzer.stats()} compiled in {compile_ms:.1f} ms")
+    print(f"{len(text)} chars: {elapsed / repeats * 1000:.3f} ms per scan, "
+          f"{len(text) * repeats / elapsed / 1e6:.1f} MB/s")
+    print([signal["id"] for signal in signals])
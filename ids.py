@@ -0,0 +1,208 @@
+"""
+Collision-free, time-sortable IDs
+
+Snowflake-style 64-bit integers: 42 bits of milliseconds since ID_EPOCH,
+10 bits of node (worker) ID and 12 bits of per-millisecond sequence. They
+are rendered as 13 fixed-width Crockford base32 characters, so string
+order equals numeric order equals creation order. This lets the stores use
+IDs as clustered keys and answer time-range queries with key-range scans.
+
+Two workers with the same node ID could mint the same ID in the same
+millisecond, so node IDs are not derived from anything that can collide.
+A worker leases one through the shared state backend: every start takes
+the next number from a claim sequence (an atomic add, so concurrent
+starts get different numbers). The node is that number modulo 1024,
+skipping nodes whose lease is still held by a live worker. Taking and
+renewing a lease are compare-and-sets on the lease record, so a worker
+whose lease expired and was taken over finds out on its next renewal.
+It then leases a new node, and it mints no IDs while its lease is
+overdue or lost. JUDGE_DREDD_NODE_ID overrides the lease.
+"""
+
+import datetime
+import os
+import secrets
+import socket
+import threading
+import time
+import zlib
+from typing import Optional, Tuple
+
+ID_EPOCH = datetime.datetime(2025, 1, 1, tzinfo=datetime.timezone.utc)
+_EPOCH_MS = int(ID_EPOCH.timestamp() * 1000)
+
+TIMESTAMP_BITS = 42
+NODE_BITS = 10
+SEQUENCE_BITS = 12
+
+MAX_NODE = (1 << NODE_BITS) - 1
+MAX_SEQUENCE = (1 << SEQUENCE_BITS) - 1
+
+NODES_NAMESPACE = "id_nodes"
+CLAIMS_NAMESPACE = "id_node_claims"
+NODE_LEASE_SECONDS = 120.0
+
+ALPHABET = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+ENCODED_LENGTH = 13
+
+
+def encode(value: int) -> str:
+    chars = []
+    for _ in range(ENCODED_LENGTH):
+        chars.append(ALPHABET[value & 31])
+        value >>= 5
+    return "".join(reversed(chars))
+
+
+def decode(text: str) -> int:
+    value = 0
+    for char in text.upper():
+        value = (value << 5) | ALPHABET.index(char)
+    return value
+
+
+def configured_node_id() -> Optional[int]:
+    configured = os.environ.get("JUDGE_DREDD_NODE_ID")
+    return None if configured is None else int(configured) & MAX_NODE
+
+
+def default_node_id() -> int:
+    """JUDGE_DREDD_NODE_ID if set, otherwise derived from host name and process ID until a lease is taken"""
+    configured = configured_node_id()
+    if configured is not None:
+        return configured
+    return zlib.crc32(f"{socket.gethostname()}:{os.getpid()}".encode("utf-8")) & MAX_NODE
+
+
+def claim_node_id(state, owner: str, lease_seconds: float = NODE_LEASE_SECONDS) -> int:
+    """A node ID no live worker holds, leased to `owner` for lease_seconds"""
+    for _ in range(4 * (MAX_NODE + 1)):
+        claim = state.count(CLAIMS_NAMESPACE)
+        if not state.add(CLAIMS_NAMESPACE, f"{claim:012d}", {"owner": owner, "claimed_at": time.time()}):
+            continue  # another worker took this number first
+        node = claim & MAX_NODE
+        lease = state.get(NODES_NAMESPACE, str(node))
+        claimed = {"owner": owner, "expires_at": time.time() + lease_seconds}
+        if lease is None:
+            if state.add(NODES_NAMESPACE, str(node), claimed):
+                return node
+        elif lease["expires_at"] <= time.time() and state.replace(NODES_NAMESPACE, str(node), lease, claimed):
+            return node
+    raise RuntimeError("Every node ID is leased by a live worker")
+
+
+class IdGenerator:
+    def __init__(self, node_id: Optional[int] = None):
+        self._derived_node = node_id is None
+        self.node_id = default_node_id() if node_id is None else node_id & MAX_NODE
+        self._lock = threading.Lock()
+        self._last_ms = 0
+        self._sequence = 0
+        self._pid = os.getpid()
+        self._lease_state = None
+        self._owner: Optional[str] = None
+        self._lease_seconds = NODE_LEASE_SECONDS
+        self._lease_expires = 0.0
+        self._lease_lock = threading.Lock()
+
+    def lease_node(self, state, lease_seconds: float = NODE_LEASE_SECONDS) -> int:
+        """Take a node ID through the state backend, unless one was given or configured"""
+        if not self._derived_node or configured_node_id() is not None:
+            return self.node_id
+        with self._lease_lock:
+            self._lease_state = state
+            self._lease_seconds = lease_seconds
+            self._owner = f"{socket.gethostname()}:{os.getpid()}:{secrets.token_hex(4)}"
+            return self._claim()
+
+    def _claim(self) -> int:
+        # The lease is counted from before the claim, so it never outlives the stored one
+        started = time.time()
+        self._lease_expires = 0.0
+        node_id = claim_node_id(self._lease_state, self._owner, self._lease_seconds)
+        with self._lock:
+            self.node_id = node_id
+            self._pid = os.getpid()
+        self._lease_expires = started + self._lease_seconds
+        return node_id
+
+    def renew_lease(self, lease_seconds: Optional[float] = None) -> None:
+        """
+        Extend the lease if this worker still owns it. If another worker took
+        the node over, lease a new one; RuntimeError if none is free, and no IDs
+        are minted until a later renewal succeeds.
+        """
+        if self._lease_state is None:
+            return
+        with self._lease_lock:
+            if lease_seconds is not None:
+                self._lease_seconds = lease_seconds
+            node = str(self.node_id)
+            started = time.time()
+            lease = self._lease_state.get(NODES_NAMESPACE, node)
+            renewed = {"owner": self._owner, "expires_at": started + self._lease_seconds}
+            if (lease is not None and lease["owner"] == self._owner
+                    and self._lease_state.replace(NODES_NAMESPACE, node, lease, renewed)):
+                self._lease_expires = renewed["expires_at"]
+                return
+            self._claim()
+
+    def next_int(self) -> int:
+        if self._lease_state is not None:
+            if os.getpid() != self._pid:
+                # Forked worker: lease a node ID of its own
+                self.lease_node(self._lease_state, self._lease_seconds)
+            elif time.time() >= self._lease_expires:
+                # Renewal is overdue, so another worker may hold the node by now: renew or fail first
+                self.renew_lease()
+        with self._lock:
+            if self._derived_node and self._lease_state is None and os.getpid() != self._pid:
+                # Forked worker: take a node ID of its own
+                self._pid = os.getpid()
+                self.node_id = default_node_id()
+            now_ms = int(time.time() * 1000) - _EPOCH_MS
+            if now_ms > self._last_ms:
+                self._last_ms = now_ms
+                self._sequence = 0
+            else:
+                # Same millisecond or clock moved backwards: stay monotonic
+                self._sequence += 1
+                if self._sequence > MAX_SEQUENCE:
+                    self._last_ms += 1
+                    self._sequence = 0
+            return (self._last_ms << (NODE_BITS + SEQUENCE_BITS)) | (self.node_id << SEQUENCE_BITS) | self._sequence
+
+    def new_id(self, prefix: str = "") -> str:
+        return prefix + encode(self.next_int())
+
+
+def id_datetime(id_text: str) -> datetime.datetime:
+    """Creation time encoded in an ID (prefix allowed)"""
+    value = decode(id_text[-ENCODED_LENGTH:])
+    ms = (value >> (NODE_BITS + SEQUENCE_BITS)) + _EPOCH_MS
+    return datetime.datetime.fromtimestamp(ms / 1000, tz=datetime.timezone.utc)
+
+
+def id_bounds(start: datetime.datetime, end: datetime.datetime, prefix: str = "") -> Tuple[str, str]:
+    """Key range [low, high) covering every ID minted in [start, end)"""
+    def floor(moment: datetime.datetime) -> str:
+        if moment.tzinfo is None:
+            moment = moment.astimezone()
+        ms = max(0, int(moment.timestamp() * 1000) - _EPOCH_MS)
+        return prefix + encode(ms << (NODE_BITS + SEQUENCE_BITS))
+    return floor(start), floor(end)
+
+
+_generator = IdGenerator()
+
+
+def new_id(prefix: str = "") -> str:
+    return _generator.new_id(prefix)
+
+
+def lease_node(state, lease_seconds: float = NODE_LEASE_SECONDS) -> int:
+    return _generator.lease_node(state, lease_seconds)
+
+
+def renew_node_lease(lease_seconds: Optional[float] = None) -> None:
+    _generator.renew_lease(lease_seconds)
@@ -0,0 +1,257 @@
+"""
+Memory accounting and cache-pressure eviction
+
+MemoryWatchdog compares the process RSS with a memory budget. The budget
+defaults to this worker's share of the container's cgroup limit, since
+every worker process in the container counts against it. Caches register
+a size estimate and an eviction callback; other large structures (indexes,
+the in-memory state backend) register only a size, so the stats show where
+memory goes. When RSS crosses the high-water mark, the watchdog evicts the
+least recently used share of the registered caches, largest first, until
+it expects to be back under the low-water mark. The OOM killer would
+otherwise restart the worker and lose every cache at once. Freed objects
+do not always shrink RSS at once, because the allocator keeps arenas. So
+after evicting, the watchdog runs the garbage collector and asks glibc to
+return free pages. It then waits a cooldown before evicting again, so RSS
+that lags behind does not drain every cache. Checks run on a worker
+thread: sizing, eviction and a full collection would otherwise stall
+every request on the event loop.
+
+tracemalloc is off by default because it slows every allocation. An
+admin can start it, take a baseline snapshot, and later list the top
+allocation sites or the growth since that baseline.
+"""
+
+import asyncio
+import ctypes
+import ctypes.util
+import gc
+import os
+import sys
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, Optional
+
+from tenancy import estimate_size
+
+try:
+    import resource
+except ImportError:  # not on Windows
+    resource = None
+
+DEFAULT_INTERVAL = 5.0
+HIGH_WATER = 0.9
+LOW_WATER = 0.8
+# Never evict more than this share of a cache in one step; the next check can take more
+MAX_EVICT_FRACTION = 0.5
+COOLDOWN_SECONDS = 30.0
+
+_CGROUP_LIMIT_FILES = ("/sys/fs/cgroup/memory.max", "/sys/fs/cgroup/memory/memory.limit_in_bytes")
+# cgroup v1 reports "no limit" as a huge page-aligned number
+_UNLIMITED = 1 << 60
+
+try:
+    _libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6")
+    _malloc_trim = _libc.malloc_trim
+except (OSError, AttributeError):  # not glibc
+    _malloc_trim = None
+
+
+def rss_bytes() -> Optional[int]:
+    """Current resident set size, or the peak where the current one cannot be read"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        pass
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+    return None
+
+
+def cgroup_limit() -> Optional[int]:
+    """The container memory limit in bytes, or None outside a limited cgroup"""
+    for path in _CGROUP_LIMIT_FILES:
+        try:
+            with open(path) as f:
+                value = f.read().strip()
+        except OSError:
+            continue
+        if value != "max" and value.isdigit() and int(value) < _UNLIMITED:
+            return int(value)
+    return None
+
+
+def worker_budget(workers: int = 1) -> Optional[int]:
+    """This worker's share of the cgroup limit, or None outside a limited cgroup"""
+    limit = cgroup_limit()
+    return limit // max(1, workers) if limit else None
+
+
+def extrapolated_size(values: List[Any], total: int) -> int:
+    """Estimated bytes of `total` items, from a spread of `values` among them"""
+    if not values:
+        return 0
+    return sum(estimate_size(value) for value in values) * total // len(values)
+
+
+def sampled_size(cache, sample: int = 32) -> int:
+    """Estimated bytes of a cache with __len__ and sample(count), from a spread of its values"""
+    return extrapolated_size(cache.sample(sample), len(cache))
+
+
+def release_free_memory() -> int:
+    """Collect garbage and hand free heap pages back to the OS; returns objects collected"""
+    collected = gc.collect()
+    if _malloc_trim is not None:
+        _malloc_trim(0)
+    return collected
+
+
+class MemoryWatchdog:
+    def __init__(self, budget_bytes: Optional[int], interval: float = DEFAULT_INTERVAL,
+                 high_water: float = HIGH_WATER, low_water: float = LOW_WATER):
+        """Without a budget the watchdog only reports"""
+        self.budget_bytes = budget_bytes
+        self.interval = interval
+        self.high_water = high_water
+        self.low_water = low_water
+        self._caches: Dict[str, Dict[str, Callable]] = {}
+        self._baseline: Optional[tracemalloc.Snapshot] = None
+        self.baseline_taken_at: Optional[float] = None
+        self.last_pressure: Optional[Dict[str, Any]] = None
+        self._cooldown_until = 0.0
+        self.counters = {"checks": 0, "pressure_events": 0, "evicted_bytes": 0}
+
+    def register(self, name: str, size: Callable[[], int], evict: Optional[Callable[[float], Any]] = None) -> None:
+        """
+        `size()` estimates the structure's bytes; `evict(fraction)` drops its least recently
+        used share. Without `evict` the structure is only reported.
+        """
+        self._caches[name] = {"size": size, "evict": evict}
+
+    def cache_sizes(self) -> Dict[str, int]:
+        return {name: cache["size"]() for name, cache in self._caches.items()}
+
+    def relieve(self, excess_bytes: int) -> Dict[str, int]:
+        """Evict about `excess_bytes` from the caches, largest first; returns estimated bytes freed per cache"""
+        freed: Dict[str, int] = {}
+        sizes = {name: size for name, size in self.cache_sizes().items() if self._caches[name]["evict"] is not None}
+        for name, size in sorted(sizes.items(), key=lambda pair: -pair[1]):
+            if excess_bytes <= 0 or size <= 0:
+                break
+            fraction = min(MAX_EVICT_FRACTION, excess_bytes / size)
+            self._caches[name]["evict"](fraction)
+            freed[name] = size - self._caches[name]["size"]()
+            excess_bytes -= freed[name]
+        return freed
+
+    def check(self) -> Optional[Dict[str, Any]]:
+        """Evict if RSS is above the high-water mark; returns what was done, or None. Blocks, so run it off the event loop"""
+        self.counters["checks"] += 1
+        rss = rss_bytes()
+        if not self.budget_bytes or rss is None or rss < self.budget_bytes * self.high_water:
+            return None
+        if time.time() < self._cooldown_until:
+            return None
+        started = time.perf_counter()
+        freed = self.relieve(rss - int(self.budget_bytes * self.low_water))
+        collected = release_free_memory()
+        self.counters["pressure_events"] += 1
+        self.counters["evicted_bytes"] += sum(freed.values())
+        self.last_pressure = {
+            "at": time.time(),
+            "rss_before": rss,
+            "rss_after": rss_bytes(),
+            "freed_estimate": freed,
+            "gc_collected": collected,
+            "seconds": round(time.perf_counter() - started, 4),
+        }
+        self._cooldown_until = time.time() + COOLDOWN_SECONDS
+        if not freed:
+            print(f"Memory above {self.high_water:.0%} of budget with no cache left to shrink", file=sys.stderr)
+        return self.last_pressure
+
+    async def run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await asyncio.to_thread(self.check)
+            except Exception as e:
+                print(f"Memory check failed: {e}", file=sys.stderr)
+
+    # tracemalloc
+
+    def start_tracing(self, frames: int = 1) -> None:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+
+    def stop_tracing(self) -> None:
+        tracemalloc.stop()
+        self._baseline = None
+        self.baseline_taken_at = None
+
+    def _snapshot(self) -> tracemalloc.Snapshot:
+        if not tracemalloc.is_tracing():
+            raise RuntimeError("tracemalloc is not running")
+        # Leave out tracemalloc's own bookkeeping
+        return tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        ])
+
+    def take_baseline(self) -> None:
+        self._baseline = self._snapshot()
+        self.baseline_taken_at = time.time()
+
+    def top(self, limit: int = 20, group_by: str = "lineno") -> List[Dict[str, Any]]:
+        """The allocation sites holding the most memory now"""
+        return [{
+            "where": _where(stat.traceback),
+            "size_bytes": stat.size,
+            "count": stat.count,
+        } for stat in self._snapshot().statistics(group_by)[:limit]]
+
+    def diff(self, limit: int = 20, group_by: str = "lineno") -> List[Dict[str, Any]]:
+        """The allocation sites that grew most since the baseline"""
+        if self._baseline is None:
+            raise RuntimeError("No baseline snapshot has been taken")
+        return [{
+            "where": _where(stat.traceback),
+            "size_bytes": stat.size,
+            "size_diff_bytes": stat.size_diff,
+            "count_diff": stat.count_diff,
+        } for stat in self._snapshot().compare_to(self._baseline, group_by)[:limit]]
+
+    def tracing_stats(self) -> Dict[str, Any]:
+        if not tracemalloc.is_tracing():
+            return {"tracing": False}
+        current, peak = tracemalloc.get_traced_memory()
+        return {
+            "tracing": True,
+            "frames": tracemalloc.get_traceback_limit(),
+            "traced_bytes": current,
+            "traced_peak_bytes": peak,
+            "overhead_bytes": tracemalloc.get_tracemalloc_memory(),
+            "baseline_taken_at": self.baseline_taken_at,
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        rss = rss_bytes()
+        return {
+            "rss_bytes": rss,
+            "budget_bytes": self.budget_bytes,
+            "budget_used": round(rss / self.budget_bytes, 3) if rss and self.budget_bytes else None,
+            "high_water": self.high_water,
+            "low_water": self.low_water,
+            "caches": self.cache_sizes(),
+            "last_pressure": self.last_pressure,
+            "tracemalloc": self.tracing_stats(),
+            **self.counters,
+        }
+
+
+def _where(traceback: tracemalloc.Traceback) -> List[str]:
+    # Grouped by filename, frames have no line number
+    return [f"{frame.filename}:{frame.lineno}" if frame.lineno else frame.filename for frame in traceback]
@@ -0,0 +1,443 @@
+"""
+Background ingestion of regulatory news feeds
+
+Configured feeds are polled through one pooled async HTTP client. RSS 2.0,
+Atom and JSON Feed are supported. Every poll is a conditional GET with the
+feed's last ETag and Last-Modified, so an unchanged feed costs a 304 and no
+parsing. Bodies are streamed and the poll is aborted once a feed passes
+MAX_FEED_BYTES. A failing or malformed feed backs off exponentially, starting from
+its poll interval and honouring Retry-After, without delaying the other
+feeds. Item links are kept only if they are http or https URLs.
+Items are deduplicated by a hash of their normalised title, so a story
+syndicated by several sources is stored once. The state backend's atomic
+add means workers polling the same feed never store an item twice. The
+news type (ai, gdpr, legal, compliance) and priority are derived from
+keyword signals matched by the same Aho-Corasick analyzer as descriptions.
+
+The news endpoint only reads the stored items.
+
+    python news_ingestion.py fake-feeds [port]     local feed server for development
+    python news_ingestion.py poll <sources.json>   poll once and print what was stored
+"""
+
+import asyncio
+import datetime
+import email.utils
+import hashlib
+import json
+import random
+import re
+import sys
+import time
+import urllib.parse
+import xml.etree.ElementTree as ET
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+from description_signals import DescriptionAnalyzer
+
+ITEMS_NAMESPACE = "news"
+SOURCES_NAMESPACE = "news_sources"
+
+DEFAULT_INTERVAL = 300.0
+MAX_BACKOFF = 6 * 3600.0
+MAX_FEED_BYTES = 2 * 1024 * 1024
+MAX_ITEMS = 200
+# How often the loop looks for due feeds
+TICK_SECONDS = 15.0
+
+NEWS_TYPES = ("ai", "gdpr", "legal", "compliance")
+
+# Keyword signals; a trailing * matches any word ending (see description_signals.py)
+NEWS_SIGNALS = [
+    {"id": "gdpr", "category": "gdpr", "terms": [
+        "gdpr", "persondata", "personoplysning*", "databeskyttelse*", "data protection", "dpia",
+        "konsekvensanalyse*", "datatilsynet", "edpb", "privacy", "privatliv*", "cookie*"]},
+    {"id": "ai", "category": "ai", "terms": [
+        "ai", "ai act", "ai-forordning*", "kunstig intelligens", "artificial intelligence", "ai office",
+        "general-purpose ai", "gpai", "foundation model*", "machine learning", "maskinlæring", "algoritm*"]},
+    {"id": "legal", "category": "legal", "terms": [
+        "dom", "domstol*", "højesteret", "landsret*", "court", "ruling", "judgment", "cjeu", "eu-domstolen",
+        "afgørelse*", "decision", "sag", "case"]},
+    {"id": "compliance", "category": "compliance", "terms": [
+        "compliance", "overholdelse", "governance", "audit*", "revision", "standard*", "certificer*",
+        "certification", "code of practice", "adfærdskodeks"]},
+    {"id": "priority", "category": "priority", "terms": [
+        "bøde*", "fine", "fined", "fines", "sanktion*", "penalty", "penalties", "forbud*", "ban", "banned",
+        "bindende", "binding", "obligatorisk", "deadline", "frist*", "ikrafttræden*", "enters into force",
+        "håndhævelse*", "enforcement", "retningslinje*", "guideline*", "guidance", "breaking"]},
+]
+
+_ATOM = "{http://www.w3.org/2005/Atom}"
+_WHITESPACE = re.compile(r"\s+")
+_TAGS = re.compile(r"<[^>]+>")
+
+
+def normalise_title(title: str) -> str:
+    return _WHITESPACE.sub(" ", title).strip().casefold()
+
+
+def item_key(title: str) -> str:
+    return hashlib.sha256(normalise_title(title).encode("utf-8")).hexdigest()[:24]
+
+
+def _parse_time(value: Optional[str]) -> Optional[datetime.datetime]:
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        parsed = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        try:
+            parsed = datetime.datetime.fromisoformat(value.replace("Z", "+00:00"))
+        except ValueError:
+            return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=datetime.timezone.utc)
+    return parsed.astimezone(datetime.timezone.utc)
+
+
+def _text(element: Optional[ET.Element]) -> str:
+    return _TAGS.sub(" ", "".join(element.itertext())).strip() if element is not None else ""
+
+
+def _link(url: Optional[str]) -> Optional[str]:
+    """`url` if it is an absolute http(s) URL; the ticker renders it as a link, so nothing else is kept"""
+    url = (url or "").strip()
+    try:
+        parts = urllib.parse.urlsplit(url)
+    except ValueError:
+        return None
+    return url if parts.scheme.lower() in ("http", "https") and parts.netloc else None
+
+
+async def _read_limited(response: httpx.Response, limit: int = MAX_FEED_BYTES) -> bytes:
+    """The (decoded) body of a streamed response; ValueError as soon as it passes `limit` bytes"""
+    declared = response.headers.get("content-length")
+    if declared and declared.isdigit() and int(declared) > limit:
+        raise ValueError(f"Feed is larger than {limit} bytes")
+    chunks, size = [], 0
+    async for chunk in response.aiter_bytes():
+        size += len(chunk)
+        if size > limit:
+            raise ValueError(f"Feed is larger than {limit} bytes")
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+
+def _json_string(item: Dict[str, Any], *fields: str) -> Optional[str]:
+    """The first non-empty of a JSON Feed item's fields; ValueError if it is not a string"""
+    for field in fields:
+        value = item.get(field)
+        if value in (None, ""):
+            continue
+        if not isinstance(value, str):
+            raise ValueError(f"JSON Feed item field {field} is not a string")
+        return value
+    return None
+
+
+def parse_feed(body: bytes, content_type: str = "") -> List[Dict[str, Any]]:
+    """
+    Entries of an RSS 2.0, Atom or JSON Feed document as {title, url, summary, published};
+    ValueError or ET.ParseError for a malformed document
+    """
+    entries = []
+    if "json" in content_type or body.lstrip()[:1] == b"{":
+        document = json.loads(body)
+        items = document.get("items", []) if isinstance(document, dict) else None
+        if not isinstance(items, list) or not all(isinstance(item, dict) for item in items):
+            raise ValueError("JSON Feed items must be a list of objects")
+        for item in items:
+            entries.append({
+                "title": _json_string(item, "title") or "",
+                "url": _link(_json_string(item, "url", "external_url")),
+                "summary": _json_string(item, "summary", "content_text") or "",
+                "published": _parse_time(_json_string(item, "date_published", "date_modified")),
+            })
+        return [entry for entry in entries if entry["title"]]
+
+    root = ET.fromstring(body)
+    if root.tag == f"{_ATOM}feed":
+        for entry in root.iter(f"{_ATOM}entry"):
+            link = next((l.get("href") for l in entry.iter(f"{_ATOM}link") if l.get("rel", "alternate") == "alternate"), None)
+            entries.append({
+                "title": _text(entry.find(f"{_ATOM}title")),
+                "url": _link(link),
+                "summary": _text(entry.find(f"{_ATOM}summary")),
+                "published": _parse_time((entry.findtext(f"{_ATOM}published") or entry.findtext(f"{_ATOM}updated"))),
+            })
+    else:
+        for item in root.iter("item"):
+            entries.append({
+                "title": _text(item.find("title")),
+                "url": _link(item.findtext("link")),
+                "summary": _text(item.find("description")),
+                "published": _parse_time(item.findtext("pubDate")),
+            })
+    return [entry for entry in entries if entry["title"]]
+
+
+def relative_time(timestamp: str, now: Optional[datetime.datetime] = None) -> str:
+    """Age as the ticker shows it: Live, 8 min, 3 t, 2 d"""
+    now = now or datetime.datetime.now(datetime.timezone.utc)
+    minutes = int((now - _parse_time(timestamp)).total_seconds() // 60)
+    if minutes < 5:
+        return "Live"
+    if minutes < 60:
+        return f"{minutes} min"
+    if minutes < 24 * 60:
+        return f"{minutes // 60} t"
+    return f"{minutes // (24 * 60)} d"
+
+
+class NewsIngestor:
+    def __init__(self, state, sources: List[Dict[str, Any]], max_items: int = MAX_ITEMS,
+                 transport: Optional[httpx.AsyncBaseTransport] = None):
+        """
+        `sources` are dicts with id, name and url, plus optional interval (seconds)
+        and type (the news type used when no keyword matches)
+        """
+        self.state = state
+        self.sources = sources
+        self.max_items = max_items
+        self.transport = transport
+        self.analyzer = DescriptionAnalyzer(NEWS_SIGNALS)
+        self.counters = {"polls": 0, "not_modified": 0, "fetched": 0, "stored": 0, "duplicates": 0, "errors": 0}
+
+    def classify(self, title: str, summary: str, default_type: str = "compliance") -> Dict[str, str]:
+        signals = self.analyzer.scan(f"{title} {title} {summary}")  # title words count double
+        types = [signal for signal in signals if signal["category"] in NEWS_TYPES]
+        return {
+            "type": max(types, key=lambda signal: signal["matches"])["category"] if types else default_type,
+            "priority": "high" if any(signal["category"] == "priority" for signal in signals)
+            else "medium" if types else "low",
+        }
+
+    def seed(self, items: List[Dict[str, Any]]) -> None:
+        """Store items (with title, source, type, priority, timestamp) if no news has been ingested yet"""
+        if self.state.count(ITEMS_NAMESPACE):
+            return
+        for item in items:
+            key = item_key(item["title"])
+            self.state.add(ITEMS_NAMESPACE, key, {**item, "id": key})
+
+    def latest(self, limit: int = 50) -> List[Dict[str, Any]]:
+        items = [item for _, item in self.state.items(ITEMS_NAMESPACE)]
+        items.sort(key=lambda item: item["timestamp"], reverse=True)
+        now = datetime.datetime.now(datetime.timezone.utc)
+        return [{**item, "time": relative_time(item["timestamp"], now)} for item in items[:limit]]
+
+    def _store(self, source: Dict[str, Any], entries: List[Dict[str, Any]]) -> int:
+        stored = 0
+        now = datetime.datetime.now(datetime.timezone.utc)
+        for entry in entries:
+            key = item_key(entry["title"])
+            published = min(entry["published"] or now, now)
+            item = {
+                "id": key,
+                "title": entry["title"],
+                "source": source["name"],
+                "url": entry["url"],
+                **self.classify(entry["title"], entry["summary"], source.get("type", "compliance")),
+                "timestamp": published.strftime("%Y-%m-%dT%H:%M:%SZ"),
+            }
+            if self.state.add(ITEMS_NAMESPACE, key, item):
+                stored += 1
+            else:
+                self.counters["duplicates"] += 1
+        self.counters["stored"] += stored
+        return stored
+
+    def prune(self) -> int:
+        """Keep the newest max_items items"""
+        items = sorted(self.state.items(ITEMS_NAMESPACE), key=lambda pair: pair[1]["timestamp"], reverse=True)
+        for key, _ in items[self.max_items:]:
+            self.state.delete(ITEMS_NAMESPACE, key)
+        return max(0, len(items) - self.max_items)
+
+    def _poll_state(self, source: Dict[str, Any]) -> Dict[str, Any]:
+        return self.state.get(SOURCES_NAMESPACE, source["id"]) or {
+            "etag": None, "last_modified": None, "next_poll": 0.0, "failures": 0,
+            "last_status": None, "last_error": None, "last_polled": None,
+        }
+
+    async def poll(self, client: httpx.AsyncClient, source: Dict[str, Any]) -> Dict[str, Any]:
+        """Fetch one feed if it changed and store its new items; returns the feed's poll state"""
+        polled = self._poll_state(source)
+        interval = float(source.get("interval", DEFAULT_INTERVAL))
+        headers = {}
+        if polled["etag"]:
+            headers["If-None-Match"] = polled["etag"]
+        if polled["last_modified"]:
+            headers["If-Modified-Since"] = polled["last_modified"]
+
+        self.counters["polls"] += 1
+        polled = {**polled, "last_polled": time.time(), "stored": 0}
+        retry_after = None
+        try:
+            async with client.stream("GET", source["url"], headers=headers) as response:
+                polled["last_status"] = response.status_code
+                if response.status_code == 304:
+                    self.counters["not_modified"] += 1
+                elif response.status_code == 200:
+                    body = await _read_limited(response)
+                    entries = parse_feed(body, response.headers.get("content-type", ""))
+                    polled["stored"] = self._store(source, entries)
+                    polled["etag"] = response.headers.get("etag")
+                    polled["last_modified"] = response.headers.get("last-modified")
+                    self.counters["fetched"] += 1
+                else:
+                    retry_after = response.headers.get("retry-after")
+                    raise httpx.HTTPStatusError(f"HTTP {response.status_code}", request=response.request,
+                                                response=response)
+        except (httpx.HTTPError, ValueError, TypeError, KeyError, AttributeError, ET.ParseError) as e:
+            # One malformed feed backs off like an unreachable one instead of failing the whole tick
+            self.counters["errors"] += 1
+            polled["failures"] += 1
+            polled["last_error"] = str(e) or type(e).__name__
+            # Exponential backoff with jitter, but never sooner than the server asked for
+            delay = min(MAX_BACKOFF, interval * 2 ** polled["failures"]) * random.uniform(0.8, 1.2)
+            if retry_after and retry_after.isdigit():
+                delay = max(delay, float(retry_after))
+            polled["next_poll"] = time.time() + delay
+        else:
+            polled["failures"] = 0
+            polled["last_error"] = None
+            polled["next_poll"] = time.time() + interval
+        self.state.set(SOURCES_NAMESPACE, source["id"], polled)
+        return polled
+
+    def client(self) -> httpx.AsyncClient:
+        return httpx.AsyncClient(
+            transport=self.transport,
+            timeout=httpx.Timeout(10.0, connect=5.0),
+            limits=httpx.Limits(max_connections=10, max_keepalive_connections=5),
+            follow_redirects=True,
+            headers={"User-Agent": "JudgeDredd-NewsIngestor/1.0"},
+        )
+
+    async def poll_due(self, client: httpx.AsyncClient) -> int:
+        """Poll every feed that is due, concurrently; returns how many were polled"""
+        now = time.time()
+        due = [source for source in self.sources if self._poll_state(source)["next_poll"] <= now]
+        if due:
+            await asyncio.gather(*(self.poll(client, source) for source in due))
+            self.prune()
+        return len(due)
+
+    async def run(self) -> None:
+        async with self.client() as client:
+            while True:
+                try:
+                    await self.poll_due(client)
+                except Exception as e:
+                    print(f"News ingestion failed: {e}", file=sys.stderr)
+                await asyncio.sleep(TICK_SECONDS)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "sources": {source["id"]: self._poll_state(source) for source in self.sources},
+            "items": self.state.count(ITEMS_NAMESPACE),
+            **self.counters,
+        }
+
+
+def load_sources(path: str) -> List[Dict[str, Any]]:
+    with open(path, encoding="utf-8") as f:
+        sources = json.load(f)
+    for source in sources:
+        missing = {"id", "name", "url"} - set(source)
+        if missing:
+            raise ValueError(f"News source {source} lacks {', '.join(sorted(missing))}")
+    return sources
+
+
+def _fake_feeds_handler():
+    """Serves /rss, /atom and /json with validators, and /flaky which fails every other request"""
+    from http.server import BaseHTTPRequestHandler
+
+    updated = email.utils.formatdate(usegmt=True)
+    stamp = datetime.datetime.now(datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+    documents = {
+        "/rss": ("application/rss+xml", f"""<?xml version="1.0" encoding="utf-8"?>
+<rss version="2.0"><channel><title>Datatilsynet</title>
+<item><title>Datatilsynet udsender ny vejledning om DPIA for AI-systemer</title><link>http://localhost/1</link>
+<pubDate>{updated}</pubDate><description>Vejledningen er obligatorisk for offentlige myndigheder.</description></item>
+<item><title>Bøde til kommune for manglende databeskyttelse</title><link>http://localhost/2</link><pubDate>{updated}</pubDate></item>
+</channel></rss>"""),
+        "/atom": ("application/atom+xml", f"""<?xml version="1.0" encoding="utf-8"?>
+<feed xmlns="http://www.w3.org/2005/Atom"><title>EDPB</title>
+<entry><title>EDPB adopts guidelines on AI models and personal data</title><link href="http://localhost/3"/>
+<updated>{stamp}</updated><summary>Binding guidance for data protection authorities.</summary></entry>
+<entry><title>Datatilsynet udsender ny vejledning om DPIA for AI-systemer</title><link href="http://localhost/1"/>
+<updated>{stamp}</updated></entry>
+</feed>"""),
+        "/json": ("application/feed+json", json.dumps({"version": "https://jsonfeed.org/version/1.1", "title": "AI Office", "items": [
+            {"id": "4", "title": "AI Office publishes the general-purpose AI code of practice", "url": "http://localhost/4",
+             "date_published": stamp, "content_text": "Providers can sign the code to demonstrate compliance."},
+        ]})),
+    }
+    etags = {path: '"' + hashlib.sha256(body.encode()).hexdigest()[:16] + '"' for path, (_, body) in documents.items()}
+    flaky = {"requests": 0}
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path == "/flaky":
+                flaky["requests"] += 1
+                if flaky["requests"] % 2:
+                    self.send_response(503)
+                    self.send_header("Retry-After", "1")
+                    self.end_headers()
+                    return
+                self.path = "/rss"
+            if self.path not in documents:
+                self.send_response(404)
+                self.end_headers()
+                return
+            if self.headers.get("If-None-Match") == etags[self.path] or self.headers.get("If-Modified-Since") == updated:
+                self.send_response(304)
+                self.end_headers()
+                return
+            content_type, body = documents[self.path]
+            data = body.encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(data)))
+            self.send_header("ETag", etags[self.path])
+            self.send_header("Last-Modified", updated)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            print(f"{self.command} {self.path} -> {args[1] if len(args) > 1 else ''}")
+
+    return Handler
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else ""
+    if command == "fake-feeds":
+        from http.server import ThreadingHTTPServer
+
+        port = int(sys.argv[2]) if len(sys.argv) > 2 else 8099
+        print(f"Fake feeds on http://127.0.0.1:{port}/rss, /atom, /json and /flaky")
+        ThreadingHTTPServer(("127.0.0.1", port), _fake_feeds_handler()).serve_forever()
+    elif command == "poll":
+        from state_backend import NearCache, create_backend
+
+        ingestor = NewsIngestor(NearCache(create_backend("memory://")), load_sources(sys.argv[2]))
+
+        async def poll_twice():
+            async with ingestor.client() as client:
+                for _ in range(2):
+                    for source in ingestor.sources:
+                        polled = await ingestor.poll(client, source)
+                        print(f"{source['id']}: HTTP {polled['last_status']}, stored {polled.get('stored', 0)}, "
+                              f"failures {polled['failures']}")
+
+        asyncio.run(poll_twice())
+        print(json.dumps(ingestor.latest(), ensure_ascii=False, indent=2))
+    else:
+        print(__doc__)
@@ -0,0 +1,155 @@
+"""
+Password hashing with a work factor calibrated to a latency budget
+
+calibrate() times the hash function on the current machine and returns a
+policy whose hashes take about `budget_ms` to compute: bcrypt rounds, or
+argon2id memory and time cost when argon2-cffi is installed. Hashes carry
+their own parameters ("$2b$12$..." or "$argon2id$v=19$m=...,t=...,p=...$..."),
+so verify_password() accepts any hash ever issued. needs_rehash() reports
+hashes weaker than the current policy or made with another scheme, so they
+can be replaced with a fresh hash the next time the user logs in. A hash
+stronger than the policy is kept: recalibrating on a slower machine must
+not lower the cost of stored hashes.
+
+argon2 memory is capped at ARGON2_MAX_MEMORY_KIB, so that several logins
+hashing at once cannot exhaust a worker's memory. Budget left once the cap
+is reached goes to time_cost.
+
+A policy is a plain dict, so it can be shared through the state backend
+and every worker uses the same one.
+"""
+
+import datetime
+import sys
+import time
+from typing import Any, Dict, Optional
+
+import bcrypt
+
+try:
+    import argon2
+except ImportError:  # optional dependency
+    argon2 = None
+
+DEFAULT_BUDGET_MS = 250.0
+
+# Floors follow common guidance, so a slow machine never gets weak hashes; ceilings bound login cost
+BCRYPT_MIN_ROUNDS = 12
+BCRYPT_MAX_ROUNDS = 16
+ARGON2_MIN_MEMORY_KIB = 19 * 1024
+ARGON2_MAX_MEMORY_KIB = 64 * 1024
+ARGON2_MIN_TIME_COST = 2
+ARGON2_PARALLELISM = 1
+# bcrypt only reads this many bytes of a password; bcrypt 5 raises ValueError for longer ones
+BCRYPT_MAX_PASSWORD_BYTES = 72
+
+
+def available_schemes() -> list:
+    return ["bcrypt", "argon2id"] if argon2 is not None else ["bcrypt"]
+
+
+def _elapsed_ms(hash_once, repeat: int = 2) -> float:
+    """Best of `repeat` runs, which is least disturbed by other load"""
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        hash_once()
+        elapsed = (time.perf_counter() - started) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def _argon2_hasher(policy: Dict[str, Any]):
+    return argon2.PasswordHasher(time_cost=policy["time_cost"], memory_cost=policy["memory_kib"],
+                                 parallelism=policy["parallelism"], type=argon2.Type.ID)
+
+
+def calibrate(budget_ms: float = DEFAULT_BUDGET_MS, scheme: str = "bcrypt") -> Dict[str, Any]:
+    """The strongest parameters of `scheme` whose hash stays within budget_ms here"""
+    if scheme not in available_schemes():
+        raise ValueError(f"Password hash scheme must be one of {', '.join(available_schemes())}")
+
+    if scheme == "bcrypt":
+        # Each round doubles the cost, so one measurement at the floor predicts the rest
+        base_ms = _elapsed_ms(lambda: bcrypt.hashpw(b"calibration", bcrypt.gensalt(BCRYPT_MIN_ROUNDS)))
+        rounds = BCRYPT_MIN_ROUNDS
+        while rounds < BCRYPT_MAX_ROUNDS and base_ms * 2 ** (rounds + 1 - BCRYPT_MIN_ROUNDS) <= budget_ms:
+            rounds += 1
+        policy = {"scheme": "bcrypt", "rounds": rounds}
+        expected_ms = base_ms * 2 ** (rounds - BCRYPT_MIN_ROUNDS)
+    else:
+        # Cost grows linearly with memory and time cost: spend the budget on memory up to the cap, then on time
+        floor = {"scheme": "argon2id", "memory_kib": ARGON2_MIN_MEMORY_KIB,
+                 "time_cost": ARGON2_MIN_TIME_COST, "parallelism": ARGON2_PARALLELISM}
+        base_ms = _elapsed_ms(lambda: _argon2_hasher(floor).hash("calibration"))
+        scale = max(1.0, budget_ms / base_ms)
+        memory_kib = min(ARGON2_MAX_MEMORY_KIB, int(ARGON2_MIN_MEMORY_KIB * scale) // 1024 * 1024)
+        time_cost = max(ARGON2_MIN_TIME_COST,
+                        int(ARGON2_MIN_TIME_COST * scale * ARGON2_MIN_MEMORY_KIB / memory_kib))
+        policy = {**floor, "memory_kib": memory_kib, "time_cost": time_cost}
+        expected_ms = base_ms * memory_kib / ARGON2_MIN_MEMORY_KIB * time_cost / ARGON2_MIN_TIME_COST
+
+    return {
+        **policy,
+        "budget_ms": budget_ms,
+        "expected_ms": round(expected_ms, 1),
+        "calibrated_at": datetime.datetime.now().isoformat(),
+    }
+
+
+def password_error(password: str, policy: Dict[str, Any]) -> Optional[str]:
+    """Why `password` cannot be hashed under `policy`, or None if it can"""
+    if policy["scheme"] == "bcrypt" and len(password.encode("utf-8")) > BCRYPT_MAX_PASSWORD_BYTES:
+        return f"Password must be at most {BCRYPT_MAX_PASSWORD_BYTES} bytes in UTF-8"
+    return None
+
+
+def hash_password(password: str, policy: Dict[str, Any]) -> str:
+    if policy["scheme"] == "argon2id":
+        return _argon2_hasher(policy).hash(password)
+    return bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt(policy["rounds"])).decode("utf-8")
+
+
+def hash_parameters(hashed: str) -> Optional[Dict[str, Any]]:
+    """The scheme and work factors encoded in a hash, or None if it is not one we issue"""
+    if hashed.startswith(("$2a$", "$2b$", "$2y$")):
+        return {"scheme": "bcrypt", "rounds": int(hashed[4:6])}
+    if hashed.startswith("$argon2id$"):
+        # $argon2id$v=19$m=65536,t=3,p=4$salt$hash
+        settings = dict(item.split("=", 1) for item in hashed.split("$")[3].split(","))
+        return {"scheme": "argon2id", "memory_kib": int(settings["m"]),
+                "time_cost": int(settings["t"]), "parallelism": int(settings["p"])}
+    return None
+
+
+def verify_password(password: str, hashed: str) -> bool:
+    if hashed.startswith("$argon2"):
+        if argon2 is None:
+            raise RuntimeError("An argon2 password hash needs the argon2-cffi package")
+        try:
+            return argon2.PasswordHasher().verify(hashed, password)
+        except (argon2.exceptions.VerificationError, argon2.exceptions.InvalidHashError):
+            return False
+    return bcrypt.checkpw(password.encode("utf-8"), hashed.encode("utf-8"))
+
+
+def needs_rehash(hashed: str, policy: Dict[str, Any]) -> bool:
+    """True when the hash was made with another scheme or with a lower work factor than the policy's"""
+    parameters = hash_parameters(hashed)
+    if parameters is None or parameters["scheme"] != policy["scheme"]:
+        return True
+    if parameters["scheme"] == "bcrypt":
+        return parameters["rounds"] < policy["rounds"]
+    return parameters["memory_kib"] < policy["memory_kib"] or parameters["time_cost"] < policy["time_cost"]
+
+
+if __name__ == "__main__":
+    # python password_hashing.py [budget_ms] [scheme]  - print the calibrated policy for this machine
+    import json
+
+    budget = float(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_BUDGET_MS
+    policy = calibrate(budget, sys.argv[2] if len(sys.argv) > 2 else "bcrypt")
+    started = time.perf_counter()
+    hash_password("benchmark", policy)
+    print(json.dumps(policy, indent=2))
+    print(f"measured {(time.perf_counter() - started) * 1000:.1f} ms per hash")
@@ -0,0 +1,216 @@
+"""
+Admin profiling: per-request profiles and a continuous stack sampler
+
+Sending `X-Profile: collapsed` (statistical, the default) or
+`X-Profile: cprofile` (deterministic) with an admin token replaces the
+response body with a profile of that request: collapsed stacks
+("frame;frame;frame count" lines, the input format of flamegraph.pl and
+speedscope) or a pstats report. The original status and duration are
+returned in X-Profiled-Status and X-Profile-Duration-Ms. Requests without
+the header go straight through.
+
+A profile is not isolated to its request. Both profilers see the event loop
+thread, so anything other requests run on the loop meanwhile shows up in it
+as well; profile on a quiet worker. Profiled requests are serialised,
+because cProfile can only have one active profiler per thread and the
+sampler changes the interpreter-wide switch interval.
+
+StackSampler samples one thread's Python stack from a background thread
+and aggregates collapsed stacks. It only exists while a profile is running.
+"""
+
+import asyncio
+import cProfile
+import collections
+import io
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+DEFAULT_INTERVAL = 0.005
+# Distinct stacks kept per profile; further new stacks are counted as truncated
+MAX_STACKS = 20000
+TRUNCATED_STACK = ("[truncated]",)
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class StackSampler:
+    def __init__(self, thread_id: int, interval: float = DEFAULT_INTERVAL, max_stacks: int = MAX_STACKS):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.max_stacks = max_stacks
+        self.stacks: Dict[Tuple[str, ...], int] = collections.Counter()
+        self.samples = 0
+        self.started_at: Optional[float] = None
+        self.stopped_at: Optional[float] = None
+        self._labels: Dict[Any, str] = {}
+        # The sampler thread adds stacks while reports read them
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, duration: Optional[float] = None) -> "StackSampler":
+        self.started_at = time.time()
+        self._thread = threading.Thread(target=self._run, args=(duration,), name="stack-sampler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> "StackSampler":
+        self._stop.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+        return self
+
+    def _sample(self) -> None:
+        frame = sys._current_frames().get(self.thread_id)
+        if frame is None:
+            return
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            label = self._labels.get(code)
+            if label is None:
+                label = self._labels[code] = _frame_label(frame)
+            stack.append(label)
+            frame = frame.f_back
+        stack = tuple(reversed(stack))
+        with self._lock:
+            if stack not in self.stacks and len(self.stacks) >= self.max_stacks:
+                stack = TRUNCATED_STACK
+            self.stacks[stack] += 1
+            self.samples += 1
+
+    def _run(self, duration: Optional[float]) -> None:
+        deadline = None if duration is None else time.monotonic() + duration
+        while not self._stop.wait(self.interval):
+            self._sample()
+            if deadline is not None and time.monotonic() >= deadline:
+                break
+        self.stopped_at = time.time()
+
+    def _snapshot(self) -> Tuple[List[Tuple[Tuple[str, ...], int]], int]:
+        """(stack counts, samples) as of now, safe to read while sampling goes on"""
+        with self._lock:
+            return list(self.stacks.items()), self.samples
+
+    def collapsed(self) -> str:
+        stacks, _ = self._snapshot()
+        return "".join(f"{';'.join(stack)} {count}\n" for stack, count in sorted(stacks, key=lambda item: -item[1]))
+
+    def summary(self) -> Dict[str, Any]:
+        """Sampling stats and the hottest frames by self and total samples"""
+        stacks, samples = self._snapshot()
+        own: Dict[str, int] = collections.Counter()
+        total: Dict[str, int] = collections.Counter()
+        for stack, count in stacks:
+            own[stack[-1]] += count
+            for label in set(stack):
+                total[label] += count
+        end = self.stopped_at or time.time()
+        return {
+            "running": self.running,
+            "interval": self.interval,
+            "samples": samples,
+            "distinct_stacks": len(stacks),
+            "started_at": self.started_at,
+            "duration_seconds": round(end - self.started_at, 3) if self.started_at else 0,
+            "top_self": own.most_common(20),
+            "top_total": total.most_common(20),
+        }
+
+
+def cprofile_report(profiler: cProfile.Profile, limit: int = 60) -> str:
+    out = io.StringIO()
+    stats = pstats.Stats(profiler, stream=out)
+    stats.sort_stats("cumulative").print_stats(limit)
+    return out.getvalue()
+
+
+class ProfilingMiddleware:
+    """Profiles single requests carrying X-Profile when `authorize(authorization header)` allows it"""
+
+    def __init__(self, app, authorize: Callable[[str], bool], interval: float = 0.001):
+        self.app = app
+        self.authorize = authorize
+        self.interval = interval
+        self._profiling = asyncio.Lock()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        mode = None
+        authorization = ""
+        for key, value in scope["headers"]:
+            if key == b"x-profile":
+                mode = value.decode("latin-1").strip().lower() or "collapsed"
+            elif key == b"authorization":
+                authorization = value.decode("latin-1")
+        if mode is None:
+            await self.app(scope, receive, send)
+            return
+
+        if mode not in ("collapsed", "cprofile") or not self.authorize(authorization):
+            body = json.dumps({"detail": "Profiling requires an admin token and X-Profile: collapsed|cprofile"}).encode()
+            await send({"type": "http.response.start", "status": 403,
+                        "headers": [(b"content-type", b"application/json"),
+                                    (b"content-length", str(len(body)).encode())]})
+            await send({"type": "http.response.body", "body": body})
+            return
+
+        response_status = 500
+
+        async def capture_send(message):
+            nonlocal response_status
+            if message["type"] == "http.response.start":
+                response_status = message["status"]
+            # The profiled response body is discarded; the profile replaces it
+
+        async with self._profiling:
+            report, duration_ms = await self._profile(mode, scope, receive, capture_send)
+
+        body = report.encode("utf-8")
+        await send({"type": "http.response.start", "status": 200, "headers": [
+            (b"content-type", b"text/plain; charset=utf-8"),
+            (b"content-length", str(len(body)).encode()),
+            (b"x-profiled-status", str(response_status).encode()),
+            (b"x-profile-duration-ms", f"{duration_ms:.2f}".encode()),
+            (b"cache-control", b"no-store"),
+        ]})
+        await send({"type": "http.response.body", "body": body})
+
+    async def _profile(self, mode: str, scope, receive, send) -> Tuple[str, float]:
+        """(report, duration in ms) of one request"""
+        started = time.perf_counter()
+        if mode == "cprofile":
+            profiler = cProfile.Profile()
+            profiler.enable()
+            try:
+                await self.app(scope, receive, send)
+            finally:
+                profiler.disable()
+            report = cprofile_report(profiler)
+        else:
+            # Let the sampler thread take the GIL at the sampling interval
+            switch_interval = sys.getswitchinterval()
+            sys.setswitchinterval(min(switch_interval, self.interval))
+            sampler = StackSampler(threading.get_ident(), self.interval).start()
+            try:
+                await self.app(scope, receive, send)
+            finally:
+                sampler.stop()
+                sys.setswitchinterval(switch_interval)
+            report = sampler.collapsed()
+        return report, (time.perf_counter() - started) * 1000
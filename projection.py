@@ -0,0 +1,69 @@
+"""
+Sparse fieldsets for JSON responses
+
+`fields=a,b.c,d.e.f` keeps only the listed dotted paths of a response. A
+path that ends on an object keeps the whole object; paths through a list
+apply to every element. Unknown paths are ignored, like absent optional
+fields.
+
+Handlers build their response with `Lazy(...)` around expensive parts.
+project() only calls a Lazy that the projection keeps, so a client that
+asks for a score never pays for wizard step generation. Projection happens
+before serialisation, so dropped parts are never encoded either.
+"""
+
+import functools
+import re
+from typing import Any, Callable, Dict, Optional
+
+# Parsed projection: field -> sub-projection, or None to keep the whole value
+FieldTree = Dict[str, Optional["FieldTree"]]
+
+MAX_FIELDS = 64
+_PATH = re.compile(r"[^\s.,]+(?:\.[^\s.,]+)*")
+
+
+class Lazy:
+    """A response value computed only if the projection keeps it"""
+
+    __slots__ = ("compute",)
+
+    def __init__(self, compute: Callable[[], Any]):
+        self.compute = compute
+
+
+@functools.lru_cache(maxsize=256)
+def parse_fields(fields: Optional[str]) -> Optional[FieldTree]:
+    """Parse a fields parameter; None or blank keeps everything. Raises ValueError on bad paths"""
+    if fields is None or not fields.strip():
+        return None
+    paths = [path.strip() for path in fields.split(",") if path.strip()]
+    if len(paths) > MAX_FIELDS:
+        raise ValueError(f"At most {MAX_FIELDS} fields may be requested")
+    tree: FieldTree = {}
+    for path in paths:
+        if not _PATH.fullmatch(path):
+            raise ValueError(f"Invalid field path: {path!r}")
+        node = tree
+        parts = path.split(".")
+        for part in parts[:-1]:
+            child = node.get(part, {})
+            if child is None:
+                break  # an ancestor is already kept whole
+            node = node.setdefault(part, child)
+        else:
+            node[parts[-1]] = None
+    return tree
+
+
+def project(value: Any, tree: Optional[FieldTree]) -> Any:
+    """Resolve Lazy values and keep only the fields in `tree` (None keeps all)"""
+    if isinstance(value, Lazy):
+        value = value.compute()
+    if isinstance(value, dict):
+        if tree is None:
+            return {key: project(item, None) for key, item in value.items()}
+        return {key: project(value[key], subtree) for key, subtree in tree.items() if key in value}
+    if isinstance(value, (list, tuple)):
+        return [project(item, tree) for item in value]
+    return value
@@ -0,0 +1,230 @@
+"""
+Bulk user provisioning from CSV or NDJSON uploads
+
+All rows are parsed and validated before any password is hashed. Bad
+emails, missing fields, passwords the hash scheme cannot take (over 72
+bytes for bcrypt), duplicates within the upload and addresses that
+already exist are reported per row and cost no hashing. Should hashing a
+chunk still fail, its rows are reported as invalid and the upload goes on. The passwords of
+the remaining rows are hashed in chunks across a process pool, so an
+upload takes about rows * hash time / cores rather than running bcrypt
+serially. Each chunk is inserted as soon as it is hashed, and its results
+are streamed back as NDJSON lines, followed by a summary line.
+
+With atomic=True nothing is inserted unless every row is valid. If another
+writer creates one of the users first, the rows already inserted are
+removed again.
+"""
+
+import asyncio
+import csv
+import io
+import json
+import math
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, AsyncIterator, Callable, Dict, List, Literal, Optional, Tuple
+
+from pydantic import BaseModel, EmailStr, ValidationError
+
+from password_hashing import hash_password, password_error
+
+MAX_ROWS = 10000
+# Rows per pool task: large enough to amortise the round trip, small enough to stream results early
+MAX_CHUNK_ROWS = 32
+
+
+class BulkUserRow(BaseModel):
+    first_name: str
+    last_name: str
+    email: EmailStr
+    password: str
+    organization: Optional[str] = None
+    role: Literal["user", "admin"] = "user"
+
+
+def parse_upload(body: bytes, content_type: str) -> List[Tuple[int, Any]]:
+    """(row number, raw row) pairs; a raw row is a dict, or an error message if it could not be read"""
+    media_type = content_type.split(";", 1)[0].strip().lower()
+    text = body.decode("utf-8-sig")
+    rows: List[Tuple[int, Any]] = []
+    if media_type == "text/csv":
+        reader = csv.DictReader(io.StringIO(text))
+        if not reader.fieldnames or not {"email", "password"} <= {name.strip().lower() for name in reader.fieldnames}:
+            raise ValueError("CSV header must name at least the email and password columns")
+        for record in reader:
+            row = {(name or "").strip().lower(): (value or "").strip() for name, value in record.items() if name}
+            rows.append((reader.line_num, {name: value for name, value in row.items() if value != ""}))
+    elif media_type in ("application/x-ndjson", "application/jsonl", "application/json-seq"):
+        for number, line in enumerate(text.splitlines(), start=1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except json.JSONDecodeError as e:
+                rows.append((number, f"Invalid JSON: {e.msg}"))
+                continue
+            rows.append((number, row if isinstance(row, dict) else "Each line must be a JSON object"))
+    else:
+        raise ValueError("Upload must be text/csv or application/x-ndjson")
+    if len(rows) > MAX_ROWS:
+        raise ValueError(f"At most {MAX_ROWS} users per upload")
+    return rows
+
+
+def _hash_chunk(policy: Dict[str, Any], passwords: List[str]) -> List[str]:
+    """Runs in a pool worker"""
+    return [hash_password(password, policy) for password in passwords]
+
+
+def _line(result: Dict[str, Any]) -> bytes:
+    return json.dumps(result, ensure_ascii=False).encode("utf-8") + b"\n"
+
+
+class BulkProvisioner:
+    def __init__(self, users, build_user: Callable[[BulkUserRow, str], Dict[str, Any]],
+                 hash_policy: Callable[[], Dict[str, Any]], max_workers: Optional[int] = None):
+        """`users` is the user mapping (with an atomic add); `build_user(row, hashed_password)` makes its record"""
+        self.users = users
+        self.build_user = build_user
+        self.hash_policy = hash_policy
+        self.max_workers = max_workers or os.cpu_count() or 1
+        # One upload hashes at a time; two pools would only compete for the same cores
+        self._lock = asyncio.Lock()
+        self.counters = {"uploads": 0, "rows": 0, "created": 0}
+
+    def validate(self, rows: List[Tuple[int, Any]], organization: str,
+                 same_organization: Callable[[str], bool],
+                 policy: Dict[str, Any]) -> Tuple[List[Dict[str, Any]], List[Tuple[int, BulkUserRow]]]:
+        """(results of rejected rows, accepted rows); accepted rows get `organization`, the admin's organisation ID"""
+        rejected: List[Dict[str, Any]] = []
+        accepted: List[Tuple[int, BulkUserRow]] = []
+        seen = set()
+        for number, raw in rows:
+            if isinstance(raw, str):
+                rejected.append({"row": number, "status": "invalid", "errors": [{"field": None, "message": raw}]})
+                continue
+            try:
+                user = BulkUserRow.model_validate(raw)
+            except ValidationError as e:
+                errors = [{"field": ".".join(str(part) for part in item["loc"]) or None, "message": item["msg"]}
+                          for item in e.errors(include_url=False)]
+                rejected.append({"row": number, "email": raw.get("email"), "status": "invalid", "errors": errors})
+                continue
+            email = str(user.email)
+            unhashable = password_error(user.password, policy)
+            if unhashable:
+                rejected.append({"row": number, "email": email, "status": "invalid",
+                                 "errors": [{"field": "password", "message": unhashable}]})
+            elif user.organization and not same_organization(user.organization):
+                rejected.append({"row": number, "email": email, "status": "invalid", "errors": [
+                    {"field": "organization", "message": "Users can only be provisioned into the admin's organisation"}]})
+            elif email.casefold() in seen:
+                rejected.append({"row": number, "email": email, "status": "duplicate"})
+            elif email in self.users:
+                rejected.append({"row": number, "email": email, "status": "exists"})
+            else:
+                seen.add(email.casefold())
+                accepted.append((number, user.model_copy(update={"organization": organization})))
+        return rejected, accepted
+
+    def _chunks(self, accepted: List[Tuple[int, BulkUserRow]]) -> List[List[Tuple[int, BulkUserRow]]]:
+        # Several chunks per worker keep every core busy to the end and results flowing
+        size = max(1, min(MAX_CHUNK_ROWS, math.ceil(len(accepted) / (self.max_workers * 4))))
+        return [accepted[i:i + size] for i in range(0, len(accepted), size)]
+
+    async def provision(self, rows: List[Tuple[int, Any]], organization: str,
+                        same_organization: Callable[[str], bool], atomic: bool = False) -> AsyncIterator[bytes]:
+        """NDJSON lines: one result per row in completion order, then {"summary": ...}"""
+        started = time.perf_counter()
+        policy = self.hash_policy()
+        rejected, accepted = self.validate(rows, organization, same_organization, policy)
+        summary = {"rows": len(rows), "created": 0, "exists": 0, "duplicate": 0, "invalid": 0, "not_created": 0}
+        self.counters["uploads"] += 1
+        self.counters["rows"] += len(rows)
+
+        def count(result: Dict[str, Any]) -> bytes:
+            summary[result["status"]] += 1
+            return _line(result)
+
+        for result in rejected:
+            yield count(result)
+        if atomic and rejected:
+            for number, user in accepted:
+                yield count({"row": number, "email": str(user.email), "status": "not_created"})
+            yield _line({"summary": {**summary, "atomic": True, "seconds": round(time.perf_counter() - started, 3)}})
+            return
+
+        async with self._lock:
+            loop = asyncio.get_running_loop()
+            chunks = self._chunks(accepted)
+            pool = ProcessPoolExecutor(max_workers=max(1, min(self.max_workers, len(chunks))))
+
+            async def hash_chunk(chunk):
+                """(chunk, hashes), or (chunk, error message) if the chunk could not be hashed"""
+                try:
+                    return chunk, await loop.run_in_executor(pool, _hash_chunk, policy, [user.password for _, user in chunk])
+                except Exception as e:
+                    return chunk, f"Password could not be hashed: {e}"
+
+            def failed(chunk, message: str) -> List[bytes]:
+                return [count({"row": number, "email": str(user.email), "status": "invalid",
+                               "errors": [{"field": "password", "message": message}]}) for number, user in chunk]
+
+            try:
+                pending = [hash_chunk(chunk) for chunk in chunks]
+                if atomic:
+                    results = await asyncio.gather(*pending)
+                    errors = [(chunk, hashes) for chunk, hashes in results if isinstance(hashes, str)]
+                    if errors:
+                        for chunk, message in errors:
+                            for line in failed(chunk, message):
+                                yield line
+                        for chunk, hashes in results:
+                            if not isinstance(hashes, str):
+                                for number, user in chunk:
+                                    yield count({"row": number, "email": str(user.email), "status": "not_created"})
+                    else:
+                        hashed = [pair for chunk, hashes in results for pair in zip(chunk, hashes)]
+                        for line in self._insert_all(hashed, count):
+                            yield line
+                else:
+                    for next_chunk in asyncio.as_completed(pending):
+                        chunk, hashes = await next_chunk
+                        if isinstance(hashes, str):
+                            for line in failed(chunk, hashes):
+                                yield line
+                            continue
+                        for (number, user), hashed_password in zip(chunk, hashes):
+                            yield count(self._insert(number, user, hashed_password))
+            finally:
+                pool.shutdown(wait=False, cancel_futures=True)
+
+        self.counters["created"] += summary["created"]
+        yield _line({"summary": {**summary, "atomic": atomic, "seconds": round(time.perf_counter() - started, 3)}})
+
+    def _insert(self, number: int, user: BulkUserRow, hashed_password: str) -> Dict[str, Any]:
+        record = self.build_user(user, hashed_password)
+        if not self.users.add(record["email"], record):
+            return {"row": number, "email": record["email"], "status": "exists"}
+        return {"row": number, "email": record["email"], "status": "created", "id": record["id"]}
+
+    def _insert_all(self, hashed: List[Tuple[Tuple[int, BulkUserRow], str]], count) -> List[bytes]:
+        inserted: List[Dict[str, Any]] = []
+        for (number, user), hashed_password in hashed:
+            result = self._insert(number, user, hashed_password)
+            if result["status"] != "created":
+                # Lost a race with another writer: undo this upload
+                for earlier in inserted:
+                    del self.users[earlier["email"]]
+                conflict = [count(result)]
+                return conflict + [
+                    count({"row": other_number, "email": str(other.email), "status": "not_created"})
+                    for (other_number, other), _ in hashed if other_number != number
+                ]
+            inserted.append(result)
+        return [count(result) for result in inserted]
+
+    def stats(self) -> Dict[str, Any]:
+        return {"max_workers": self.max_workers, "busy": self._lock.locked(), **self.counters}
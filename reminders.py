@@ -0,0 +1,473 @@
+"""
+Reassessment reminders and compliance update notifications
+
+Every stored assessment with an owner gets a reassessment due date derived
+from its risk score. Due dates live in a heap keyed by (tenant, assessment
+ID): system names are free text and many are left at the wizard's default,
+so they cannot tell systems apart. Re-scoring or reusing an assessment keeps
+its ID and so moves its reminder. The scheduler task sleeps until the earliest due date (or until
+an earlier one is scheduled), so it uses no CPU while idle. Due reminders
+are checked against the owner's notification preferences at send time and
+handed to a batched outbox that delivers through pluggable sinks (SMTP
+email, push) with retries and exponential backoff.
+
+Every worker keeps its own heap. Assessments stored or deleted by another
+worker reach it through the state backend's change notifications (see
+track and forget). The last send per assessment is recorded in the state
+backend, one record per assessment that each send overwrites. Recording
+it is a compare-and-set, so only one worker delivers each reminder, and
+a restarted worker schedules the next repeat from it instead of sending
+every overdue reminder again.
+"""
+
+import asyncio
+import collections
+import datetime
+import heapq
+import itertools
+import smtplib
+import sys
+import threading
+import time
+from email.message import EmailMessage
+from typing import Any, Awaitable, Callable, Dict, Hashable, Iterable, List, Optional, Tuple
+
+from ids import new_id
+
+DAY = 24 * 60 * 60
+
+# Reassessment interval by risk band (risk score 70-100 / 40-69 / 0-39)
+REASSESSMENT_INTERVALS = {
+    "high": 90 * DAY,
+    "medium": 180 * DAY,
+    "low": 365 * DAY,
+}
+
+# Overdue reassessments are reminded again after this long
+REMINDER_REPEAT_SECONDS = 14 * DAY
+
+SENT_NAMESPACE = "reminders_sent"
+
+
+def risk_band(risk_score: int) -> str:
+    return "high" if risk_score >= 70 else "medium" if risk_score >= 40 else "low"
+
+
+def reassessment_due(assessment: Dict[str, Any]) -> float:
+    assessed = datetime.datetime.fromisoformat(assessment["created_at"]).timestamp()
+    return assessed + REASSESSMENT_INTERVALS[risk_band(assessment["risk_score"])]
+
+
+def next_reminder(assessment: Dict[str, Any], sent: Optional[Dict[str, Any]]) -> float:
+    """When to remind next, given the last send recorded for the assessment (if any)"""
+    due = reassessment_due(assessment)
+    # A send for an earlier assessment of the system does not delay the reminder of the redone one
+    if sent is not None and sent.get("assessed_at") == assessment["created_at"]:
+        due = max(due, sent["sent_at"] + REMINDER_REPEAT_SECONDS)
+    return due
+
+
+class ReminderScheduler:
+    """Heap of due dates with lazy deletion; run() fires entries as they fall due"""
+
+    def __init__(self, fire: Callable[[Hashable, Any], Awaitable[None]], clock: Callable[[], float] = time.time):
+        self.fire = fire
+        self.clock = clock
+        self._heap: List[Tuple[float, int, Hashable]] = []
+        self._entries: Dict[Hashable, Tuple[float, Any]] = {}
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self.counters = {"scheduled": 0, "fired": 0, "errors": 0}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def schedule(self, key: Hashable, due: float, payload: Any) -> None:
+        """Schedule or move `key`; safe to call from any thread"""
+        with self._lock:
+            earliest = self._heap[0][0] if self._heap else None
+            self._entries[key] = (due, payload)
+            heapq.heappush(self._heap, (due, next(self._sequence), key))
+            self.counters["scheduled"] += 1
+            self._compact()
+        if earliest is None or due < earliest:
+            self._wake()
+
+    def bulk_load(self, items: Iterable[Tuple[Hashable, float, Any]]) -> None:
+        """Replace the schedule in one heapify instead of one push per entry"""
+        with self._lock:
+            self._entries = {key: (due, payload) for key, due, payload in items}
+            self._heap = [(due, next(self._sequence), key) for key, (due, _) in self._entries.items()]
+            heapq.heapify(self._heap)
+        self._wake()
+
+    def get(self, key: Hashable) -> Optional[Tuple[float, Any]]:
+        return self._entries.get(key)
+
+    def cancel(self, key: Hashable) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def _compact(self) -> None:
+        # Drop superseded heap entries once they outnumber live ones
+        if len(self._heap) > 2 * len(self._entries) + 1024:
+            self._heap = [(due, seq, key) for due, seq, key in self._heap
+                          if self._entries.get(key, (None,))[0] == due]
+            heapq.heapify(self._heap)
+
+    def _wake(self) -> None:
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    def _pop_due(self, now: float) -> Tuple[List[Tuple[Hashable, Any]], Optional[float]]:
+        due = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                when, _, key = heapq.heappop(self._heap)
+                entry = self._entries.get(key)
+                if entry is not None and entry[0] == when:
+                    del self._entries[key]
+                    due.append((key, entry[1]))
+            return due, self._heap[0][0] if self._heap else None
+
+    async def run(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        while True:
+            self._wakeup.clear()
+            due, next_due = self._pop_due(self.clock())
+            for key, payload in due:
+                try:
+                    await self.fire(key, payload)
+                    self.counters["fired"] += 1
+                except Exception as e:
+                    self.counters["errors"] += 1
+                    print(f"Reminder {key} failed: {e}", file=sys.stderr)
+            if due:
+                continue
+            timeout = None if next_due is None else max(0.0, next_due - self.clock())
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            next_due = self._heap[0][0] if self._heap else None
+            return {"pending": len(self._entries), "heap_entries": len(self._heap), "next_due": next_due, **self.counters}
+
+
+# Delivery sinks: send_batch returns the messages that could not be delivered
+
+class SmtpSink:
+    channel = "email"
+
+    def __init__(self, host: str, port: int, sender: str, timeout: float = 10.0):
+        self.host = host
+        self.port = port
+        self.sender = sender
+        self.timeout = timeout
+
+    async def send_batch(self, messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        return await asyncio.get_running_loop().run_in_executor(None, self._send, messages)
+
+    def _send(self, messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """One SMTP connection per batch"""
+        failed = []
+        try:
+            with smtplib.SMTP(self.host, self.port, timeout=self.timeout) as smtp:
+                for message in messages:
+                    email = EmailMessage()
+                    email["From"] = self.sender
+                    email["To"] = message["recipient"]
+                    email["Subject"] = message["subject"]
+                    email["Message-ID"] = f"<{message['id']}@judgedredd.ai>"
+                    email.set_content(message["body"])
+                    try:
+                        smtp.send_message(email)
+                    except smtplib.SMTPException:
+                        failed.append(message)
+        except (OSError, smtplib.SMTPException):
+            return messages
+        return failed
+
+
+class StatePushSink:
+    """Push notifications kept in the state backend for clients to fetch"""
+    channel = "push"
+
+    def __init__(self, state):
+        self.state = state
+
+    async def send_batch(self, messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        for message in messages:
+            self.state.set(f"notifications:{message['recipient']}", message["id"], {
+                "id": message["id"],
+                "type": message["type"],
+                "title": message["subject"],
+                "body": message["body"],
+                "data": message.get("data", {}),
+                "created_at": datetime.datetime.now().isoformat(),
+            })
+        return []
+
+
+class Outbox:
+    """Batched async delivery with retries; put() is safe to call from any thread"""
+
+    def __init__(self, sinks: Iterable, batch_size: int = 100, linger: float = 0.5,
+                 max_attempts: int = 5, retry_delay: float = 5.0):
+        self.sinks = {sink.channel: sink for sink in sinks}
+        self.batch_size = batch_size
+        self.linger = linger
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.dead_letters: collections.deque = collections.deque(maxlen=1000)
+        self.counters = {"queued": 0, "sent": 0, "retried": 0, "dead": 0, "batches": 0}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._backlog: List[Dict[str, Any]] = []
+
+    def put(self, message: Dict[str, Any]) -> None:
+        message.setdefault("id", new_id("msg_"))
+        message.setdefault("attempts", 0)
+        self.counters["queued"] += 1
+        if self._loop is None:
+            self._backlog.append(message)
+        else:
+            self._loop.call_soon_threadsafe(self._queue.put_nowait, message)
+
+    async def _next_batch(self) -> List[Dict[str, Any]]:
+        batch = [await self._queue.get()]
+        deadline = self._loop.time() + self.linger
+        while len(batch) < self.batch_size:
+            remaining = deadline - self._loop.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    def _retry(self, message: Dict[str, Any], error: str) -> None:
+        message["attempts"] += 1
+        message["last_error"] = error
+        if message["attempts"] >= self.max_attempts:
+            self.counters["dead"] += 1
+            self.dead_letters.append(message)
+            return
+        self.counters["retried"] += 1
+        delay = self.retry_delay * 2 ** (message["attempts"] - 1)
+        self._loop.call_later(delay, self._queue.put_nowait, message)
+
+    async def run(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue()
+        for message in self._backlog:
+            self._queue.put_nowait(message)
+        self._backlog = []
+
+        while True:
+            batch = await self._next_batch()
+            self.counters["batches"] += 1
+            by_channel: Dict[str, List[Dict[str, Any]]] = collections.defaultdict(list)
+            for message in batch:
+                by_channel[message["channel"]].append(message)
+
+            for channel, messages in by_channel.items():
+                sink = self.sinks.get(channel)
+                if sink is None:
+                    for message in messages:
+                        self._retry(message, f"No sink for channel {channel}")
+                    continue
+                try:
+                    failed = await sink.send_batch(messages)
+                    error = "Delivery failed"
+                except Exception as e:
+                    failed, error = messages, str(e)
+                self.counters["sent"] += len(messages) - len(failed)
+                for message in failed:
+                    self._retry(message, error)
+
+    def stats(self) -> Dict[str, Any]:
+        pending = self._queue.qsize() if self._queue is not None else len(self._backlog)
+        return {"pending": pending, "dead_letters": len(self.dead_letters), **self.counters}
+
+
+class Reminders:
+    """Derives reminders from stored assessments and routes them by user preferences"""
+
+    def __init__(self, state, users, outbox: Outbox, clock: Callable[[], float] = time.time):
+        self.state = state
+        self.users = users
+        self.outbox = outbox
+        self.scheduler = ReminderScheduler(self._fire, clock)
+
+    @staticmethod
+    def _key(tenant_key: str, assessment: Dict[str, Any]) -> Tuple[str, str]:
+        return tenant_key, assessment["id"]
+
+    @staticmethod
+    def _sent_key(tenant_key: str, assessment_id: str) -> str:
+        return f"{tenant_key}:{assessment_id}"
+
+    @staticmethod
+    def _payload(assessment: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            "assessment_id": assessment["id"],
+            "name": assessment["name"],
+            "owner": assessment["created_by"],
+            "risk_score": assessment["risk_score"],
+            "assessed_at": assessment["created_at"],
+        }
+
+    def track(self, tenant_key: str, assessment: Dict[str, Any]) -> None:
+        """(Re)schedule the reassessment reminder for a stored assessment"""
+        if not assessment.get("created_by") or "created_at" not in assessment:
+            return
+        key, payload = self._key(tenant_key, assessment), self._payload(assessment)
+        current = self.scheduler.get(key)
+        if current is not None and current[1] == payload:
+            return  # unchanged; keep any repeat reminder already scheduled
+        sent = self.state.get(SENT_NAMESPACE, self._sent_key(tenant_key, assessment["id"]))
+        self.scheduler.schedule(key, next_reminder(assessment, sent), payload)
+
+    def forget(self, tenant_key: str, assessment_id: str) -> None:
+        """Drop the reminder of a deleted assessment"""
+        self.scheduler.cancel((tenant_key, assessment_id))
+        self.state.delete(SENT_NAMESPACE, self._sent_key(tenant_key, assessment_id))
+
+    def load(self, assessments: Iterable[Tuple[str, Dict[str, Any]]]) -> None:
+        """Rebuild the schedule from (tenant key, assessment) pairs and the recorded sends"""
+        sent = {}
+        for key, record in self.state.items(SENT_NAMESPACE):
+            if "assessed_at" in record:
+                sent[key] = record
+            else:
+                self.state.delete(SENT_NAMESPACE, key)  # a per-day claim from before sends were recorded per assessment
+        self.scheduler.bulk_load(
+            (self._key(tenant_key, assessment),
+             next_reminder(assessment, sent.get(self._sent_key(tenant_key, assessment["id"]))),
+             self._payload(assessment))
+            for tenant_key, assessment in assessments
+            if assessment.get("created_by") and "created_at" in assessment
+        )
+
+    def _wants(self, email: str, preference: str) -> List[str]:
+        """Channels the user accepts for a notification type"""
+        user = self.users.get(email)
+        if user is None or not user.get("is_active", True):
+            return []
+        notifications = user.get("preferences", {}).get("notifications", {})
+        if not notifications.get(preference):
+            return []
+        return [channel for channel, flag in (("email", "email"), ("push", "push")) if notifications.get(flag)]
+
+    def _send(self, recipient: str, channels: List[str], kind: str, subject: str, body: str,
+              data: Dict[str, Any]) -> None:
+        for channel in channels:
+            self.outbox.put({"channel": channel, "recipient": recipient, "type": kind,
+                             "subject": subject, "body": body, "data": data})
+
+    def _claim(self, tenant_key: str, payload: Dict[str, Any], now: float) -> bool:
+        """Record this send; False if another worker already sent this round's reminder"""
+        sent_key = self._sent_key(tenant_key, payload["assessment_id"])
+        record = {"sent_at": now, "assessed_at": payload["assessed_at"]}
+        previous = self.state.get(SENT_NAMESPACE, sent_key)
+        if previous is None:
+            return self.state.add(SENT_NAMESPACE, sent_key, record)
+        # Workers fire the same round within moments of each other; half a repeat apart is another round
+        if previous.get("assessed_at") == payload["assessed_at"] and previous["sent_at"] > now - REMINDER_REPEAT_SECONDS / 2:
+            return False
+        return self.state.replace(SENT_NAMESPACE, sent_key, previous, record)
+
+    async def _fire(self, key: Tuple[str, str], payload: Dict[str, Any]) -> None:
+        tenant_key = key[0]
+        now = self.scheduler.clock()
+        # Remind again later unless the assessment is redone or deleted meanwhile
+        self.scheduler.schedule(key, now + REMINDER_REPEAT_SECONDS, payload)
+        if not self._claim(tenant_key, payload, now):
+            return
+
+        channels = self._wants(payload["owner"], "assessment_reminders")
+        if channels:
+            self._send(payload["owner"], channels, "assessment_reminder",
+                       f"Revurdering af {payload['name']} forfalder",
+                       f"AI-systemet {payload['name']} blev senest vurderet {payload['assessed_at'][:10]} "
+                       f"med risiko score {payload['risk_score']}. Gennemfør en ny compliance vurdering.",
+                       {"assessment_id": payload["assessment_id"], "organization": tenant_key})
+
+    def compliance_updates(self, changes: List[Dict[str, Any]]) -> None:
+        """Notify owners whose stored decision changed after a ruleset update"""
+        for change in changes:
+            owner = change.get("created_by")
+            channels = self._wants(owner, "compliance_updates") if owner else []
+            if not channels or not change["decision_changed"]:
+                continue
+            before, after = change["before"]["status"], change["after"]["status"]
+            self._send(owner, channels, "compliance_update",
+                       f"Ændret compliance beslutning for {change['name']}",
+                       f"Efter en opdatering af reglerne er beslutningen for {change['name']} "
+                       f"ændret fra {before} til {after}.",
+                       {"assessment_id": change["assessment_id"], "organization": change["organization"]})
+
+    def stats(self) -> Dict[str, Any]:
+        return {"scheduler": self.scheduler.stats(), "outbox": self.outbox.stats()}
+
+
+async def _smtp_session(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    """Minimal SMTP receiver that prints each message instead of relaying it"""
+    async def reply(line: str):
+        writer.write(line.encode("ascii") + b"\r\n")
+        await writer.drain()
+
+    await reply("220 judge-dredd smtp sink")
+    envelope: Dict[str, Any] = {"from": None, "to": []}
+    while True:
+        line = (await reader.readline()).decode("utf-8", "replace").rstrip("\r\n")
+        if not line:
+            break
+        verb = line.split(" ", 1)[0].upper()
+        if verb in ("HELO", "EHLO"):
+            await reply("250 judge-dredd")
+        elif verb == "MAIL":
+            envelope = {"from": line[10:], "to": []}
+            await reply("250 OK")
+        elif verb == "RCPT":
+            envelope["to"].append(line[8:])
+            await reply("250 OK")
+        elif verb == "DATA":
+            await reply("354 End data with <CR><LF>.<CR><LF>")
+            lines = []
+            while True:
+                data = (await reader.readline()).decode("utf-8", "replace").rstrip("\r\n")
+                if data == ".":
+                    break
+                lines.append(data[1:] if data.startswith("..") else data)
+            subject = next((l[9:] for l in lines if l.lower().startswith("subject: ")), "")
+            print(f"{datetime.datetime.now().isoformat()} {envelope['from']} -> {', '.join(envelope['to'])}: {subject}")
+            await reply("250 OK")
+        elif verb == "QUIT":
+            await reply("221 Bye")
+            break
+        elif verb in ("RSET", "NOOP"):
+            await reply("250 OK")
+        else:
+            await reply("502 Command not implemented")
+    writer.close()
+
+
+if __name__ == "__main__":
+    # python reminders.py smtp-sink [port]  - local SMTP stand-in for development
+    port = int(sys.argv[2]) if len(sys.argv) > 2 else 8025
+
+    async def serve():
+        server = await asyncio.start_server(_smtp_session, "127.0.0.1", port)
+        print(f"SMTP sink listening on 127.0.0.1:{port}")
+        async with server:
+            await server.serve_forever()
+
+    asyncio.run(serve())
@@ -0,0 +1,426 @@
+"""
+Background re-scoring of stored assessments after a ruleset change
+
+Rules are the sections of decision_tree.json (top level, and one level
+below for object sections). A rule references the engine input fields it
+mentions; an assessment touched a rule if its recorded evaluation read set
+includes one of those fields. Rules that mention no input field are
+treated as touching every assessment.
+
+Jobs run in a background thread, fan batches out to a process pool, are
+throttled to a maximum rate, checkpoint their cursor in the state backend
+and can be paused and resumed (also by another worker after a crash).
+All control state lives in the job record: the run that owns the job is
+named in it, every write of the record is a compare-and-set that keeps
+that owner, and a pause is a flag on the record that the owning run polls
+after each window, whichever worker set it. A run whose heartbeat is
+older than JOB_LEASE_SECONDS can be taken over, and the run it replaced
+stops at its next write.
+The assessments to re-score are written once when the job starts; each
+window only updates the job's cursor and appends its own report page, so
+checkpointing costs the same for the last window as for the first.
+"""
+
+import datetime
+import hashlib
+import json
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from ids import new_id
+
+Ref = Tuple[str, str]  # (tenant key, assessment id)
+
+JOBS_NAMESPACE = "rescore_jobs"
+REPORTS_NAMESPACE = "rescore_reports"
+REFS_NAMESPACE = "rescore_refs"
+
+# A running job whose heartbeat is older than this may be taken over
+JOB_LEASE_SECONDS = 60
+
+# Attempts at the compare-and-set of a job record before giving up
+JOB_UPDATE_ATTEMPTS = 5
+
+COMPARED_FIELDS = ("risk_score", "risk_level", "status", "required_assessments", "ai_classification")
+
+
+def _digest(value: Any) -> str:
+    return hashlib.sha256(json.dumps(value, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+def flatten_rules(tree: Dict[str, Any]) -> Dict[str, Any]:
+    """rule id -> rule body"""
+    rules = {}
+    for section, body in tree.items():
+        if isinstance(body, dict) and body:
+            for key, value in body.items():
+                rules[f"{section}.{key}"] = value
+        else:
+            rules[section] = body
+    return rules
+
+
+def changed_rules(old_tree: Dict[str, Any], new_tree: Dict[str, Any]) -> Set[str]:
+    old_rules, new_rules = flatten_rules(old_tree), flatten_rules(new_tree)
+    return {
+        rule for rule in set(old_rules) | set(new_rules)
+        if rule not in old_rules or rule not in new_rules or _digest(old_rules[rule]) != _digest(new_rules[rule])
+    }
+
+
+def _mentioned(value: Any, fields: Set[str], found: Set[str]) -> None:
+    if isinstance(value, dict):
+        for key, item in value.items():
+            if key in fields:
+                found.add(key)
+            _mentioned(item, fields, found)
+    elif isinstance(value, list):
+        for item in value:
+            _mentioned(item, fields, found)
+    elif isinstance(value, str) and value in fields:
+        found.add(value)
+
+
+def rule_references(trees: Iterable[Dict[str, Any]], fields: Iterable[str]) -> Dict[str, Set[str]]:
+    """rule id -> engine input fields mentioned by any version of the rule"""
+    fields = set(fields)
+    references: Dict[str, Set[str]] = defaultdict(set)
+    for tree in trees:
+        for rule, body in flatten_rules(tree).items():
+            _mentioned(body, fields, references[rule])
+    return references
+
+
+class RuleDependencyIndex:
+    """engine input field -> assessments whose evaluation read it"""
+
+    def __init__(self):
+        self._by_field: Dict[str, Set[Ref]] = defaultdict(set)
+        self._reads: Dict[Ref, Set[str]] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._reads)
+
+    def add(self, ref: Ref, reads: Iterable[str]) -> None:
+        with self._lock:
+            self._discard(ref)
+            reads = set(reads)
+            self._reads[ref] = reads
+            for field in reads:
+                self._by_field[field].add(ref)
+
+    def remove(self, ref: Ref) -> None:
+        with self._lock:
+            self._discard(ref)
+
+    def _discard(self, ref: Ref) -> None:
+        for field in self._reads.pop(ref, ()):
+            self._by_field[field].discard(ref)
+
+    def export(self) -> Dict[Ref, Set[str]]:
+        """ref -> fields read, for snapshots (sets are replaced on add, never mutated)"""
+        with self._lock:
+            return dict(self._reads)
+
+    def sample(self, count: int) -> List[Tuple[Ref, Set[str]]]:
+        """Up to `count` (ref, fields read) spread over the index, for size estimates"""
+        with self._lock:
+            entries = list(self._reads.items())
+        return entries[::max(1, len(entries) // count)][:count] if count > 0 else []
+
+    def adopt(self, reads: Dict[Ref, Set[str]]) -> None:
+        with self._lock:
+            self._reads = dict(reads)
+            self._by_field = defaultdict(set)
+            for ref, fields in self._reads.items():
+                for field in fields:
+                    self._by_field[field].add(ref)
+
+    def affected(self, rules: Set[str], references: Dict[str, Set[str]]) -> Set[Ref]:
+        with self._lock:
+            refs: Set[Ref] = set()
+            for rule in rules:
+                fields = references.get(rule)
+                if not fields:
+                    return set(self._reads)
+                for field in fields:
+                    refs |= self._by_field.get(field, set())
+            return refs
+
+
+class JobTakenOver(Exception):
+    """The job record names another run as its owner"""
+
+
+# Process pool worker state
+_worker_engine = None
+_worker_analyzer = None
+
+
+def _init_worker(decision_tree_path: str) -> None:
+    global _worker_engine, _worker_analyzer
+    from rules_engine import AIComplianceRulesEngine
+    from description_signals import DescriptionAnalyzer
+    _worker_engine = AIComplianceRulesEngine(decision_tree_path)
+    with open(decision_tree_path, encoding="utf-8") as f:
+        _worker_analyzer = DescriptionAnalyzer.from_ruleset(json.load(f))
+
+
+def _score_batch(batch: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    from description_signals import evaluate
+    from wizard_sessions import TrackingResponses
+
+    scored = []
+    for user_responses in batch:
+        tracked = TrackingResponses(user_responses)
+        result, classification = evaluate(_worker_engine, _worker_analyzer, tracked)
+        scored.append({
+            "risk_score": result.risk_score,
+            "risk_level": result.risk_level,
+            "status": result.decision,
+            "required_assessments": list(result.required_assessments),
+            "ai_classification": classification,
+            "evaluation_reads": sorted(tracked.reads),
+        })
+    return scored
+
+
+class Rescorer:
+    def __init__(self, state, index: RuleDependencyIndex, decision_tree_path: str,
+                 load_assessment: Callable[[Ref], Optional[Dict[str, Any]]],
+                 save_assessment: Callable[[Ref, Dict[str, Any]], None],
+                 max_workers: int = 2, batch_size: int = 50, max_rate: float = 200.0,
+                 on_complete: Optional[Callable[[Dict[str, Any], List[Dict[str, Any]]], None]] = None):
+        self.state = state
+        self.index = index
+        self.decision_tree_path = decision_tree_path
+        self.load_assessment = load_assessment
+        self.save_assessment = save_assessment
+        self.max_workers = max_workers
+        self.batch_size = batch_size
+        self.max_rate = max_rate
+        self.on_complete = on_complete
+
+    def _update(self, job_id: str, change: Callable[[Dict[str, Any]], Optional[Dict[str, Any]]]
+                ) -> Optional[Dict[str, Any]]:
+        """
+        Compare-and-set the job record to change(current), retried if another worker wrote it
+        meanwhile. change returns None to leave the record as it is; returns what was written.
+        """
+        for _ in range(JOB_UPDATE_ATTEMPTS):
+            current = self.state.get(JOBS_NAMESPACE, job_id)
+            if current is None:
+                return None
+            job = change(dict(current))
+            if job is None:
+                return None
+            if self.state.replace(JOBS_NAMESPACE, job_id, current, job):
+                return job
+        raise RuntimeError(f"Re-score job {job_id} kept changing while it was updated")
+
+    def _save_job(self, job: Dict[str, Any]) -> None:
+        """Write the run's progress, keeping the pause flag others may have set; JobTakenOver if no longer ours"""
+        def save(current):
+            if current.get("owner") != job["owner"]:
+                raise JobTakenOver(job["id"])
+            return {**job, "pause_requested": current.get("pause_requested", False), "heartbeat": time.time()}
+
+        saved = self._update(job["id"], save)
+        if saved is None:
+            raise JobTakenOver(job["id"])
+        job.update(saved)
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        job = self.state.get(JOBS_NAMESPACE, job_id)
+        if job is None:
+            return None
+        progress = job["processed"] / job["total"] * 100 if job["total"] else 100.0
+        return {**job, "progress": round(progress, 1)}
+
+    def report(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """All changes of a job, from its report pages (one per window with changes)"""
+        if self.state.get(JOBS_NAMESPACE, job_id) is None:
+            return None
+        pages = self.state.range(REPORTS_NAMESPACE, f"{job_id}:", f"{job_id};")
+        return {"job_id": job_id, "changes": [change for _, page in pages for change in page]}
+
+    def running(self, ruleset_hash: str) -> Optional[Dict[str, Any]]:
+        """A running or paused job for this ruleset, if any"""
+        for job_id, job in self.state.items(JOBS_NAMESPACE):
+            if job["ruleset_hash"] == ruleset_hash and job["status"] in ("running", "paused"):
+                return self.get(job_id)
+        return None
+
+    def start(self, refs: Iterable[Ref], rules: Set[str], ruleset_hash: str,
+              max_rate: Optional[float] = None) -> Dict[str, Any]:
+        pending = sorted([list(ref) for ref in refs], key=lambda ref: (ref[1], ref[0]))
+        job = {
+            "id": new_id("rescore_"),
+            "status": "running",
+            "ruleset_hash": ruleset_hash,
+            "changed_rules": sorted(rules),
+            "total": len(pending),
+            "processed": 0,
+            "changed": 0,
+            "decision_changes": 0,
+            "failed": 0,
+            "max_rate": max_rate or self.max_rate,
+            "started_at": datetime.datetime.now().isoformat(),
+            "finished_at": None,
+            "error": None,
+            "owner": new_id("run_"),
+            "pause_requested": False,
+            "heartbeat": time.time(),
+        }
+        self.state.set(REFS_NAMESPACE, job["id"], pending)
+        self.state.add(JOBS_NAMESPACE, job["id"], job)
+        self._launch(job)
+        return self.get(job["id"])
+
+    def pause(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Ask the job's run, on whichever worker, to stop after its current window"""
+        self._update(job_id, lambda job: {**job, "pause_requested": True} if job["status"] == "running" else None)
+        return self.get(job_id)
+
+    def resume(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Restart a paused (or failed) job here, or cancel a pause its run has not reached yet"""
+        claimed = []
+
+        def resume(job):
+            claimed.clear()
+            if job["status"] == "running":
+                return {**job, "pause_requested": False} if job.get("pause_requested") else None
+            if job["status"] in ("paused", "failed"):
+                claimed.append(True)
+                return self._claimed(job)
+            return None
+
+        job = self._update(job_id, resume)
+        if job is not None and claimed:
+            self._launch(job)
+        return self.get(job_id)
+
+    def resume_abandoned(self) -> List[str]:
+        """Take over running jobs whose owner stopped sending heartbeats"""
+        def take_over(job):
+            if job["status"] == "running" and time.time() - job["heartbeat"] > JOB_LEASE_SECONDS:
+                return self._claimed(job)
+            return None
+
+        resumed = []
+        for job_id, _ in self.state.items(JOBS_NAMESPACE):
+            job = self._update(job_id, take_over)
+            if job is not None:
+                self._launch(job)
+                resumed.append(job_id)
+        return resumed
+
+    @staticmethod
+    def _claimed(job: Dict[str, Any]) -> Dict[str, Any]:
+        """The job as owned by a new run on this worker"""
+        return {**job, "status": "running", "owner": new_id("run_"), "pause_requested": False,
+                "heartbeat": time.time(), "error": None}
+
+    def _launch(self, job: Dict[str, Any]) -> None:
+        thread = threading.Thread(target=self._run, args=(dict(job),), name=f"rescore-{job['id']}", daemon=True)
+        thread.start()
+
+    def _run(self, job: Dict[str, Any]) -> None:
+        job_id = job["id"]
+        pending = self.state.get(REFS_NAMESPACE, job_id) or []
+        window = self.batch_size * self.max_workers
+        try:
+            with ProcessPoolExecutor(max_workers=self.max_workers, initializer=_init_worker,
+                                     initargs=(self.decision_tree_path,)) as pool:
+                while job["processed"] < job["total"]:
+                    if job["pause_requested"]:
+                        if self._stop_paused(job):
+                            return
+                        continue  # the pause was withdrawn meanwhile
+
+                    started = time.monotonic()
+                    refs = [tuple(ref) for ref in pending[job["processed"]:job["processed"] + window]]
+                    documents = [(ref, self.load_assessment(ref)) for ref in refs]
+                    scorable = [(ref, doc) for ref, doc in documents if doc and doc.get("user_responses")]
+                    job["failed"] += len(documents) - len(scorable)
+
+                    batches = [
+                        [doc["user_responses"] for _, doc in scorable[i:i + self.batch_size]]
+                        for i in range(0, len(scorable), self.batch_size)
+                    ]
+                    scored = [item for batch in pool.map(_score_batch, batches) for item in batch]
+                    self._apply(job, scorable, scored)
+
+                    job["processed"] += len(refs)
+                    # Also picks up a pause requested by any worker
+                    self._save_job(job)
+
+                    # Throttle to max_rate assessments per second
+                    minimum = len(refs) / job["max_rate"]
+                    elapsed = time.monotonic() - started
+                    if elapsed < minimum:
+                        time.sleep(minimum - elapsed)
+
+            job["status"] = "completed"
+            job["finished_at"] = datetime.datetime.now().isoformat()
+            self._save_job(job)
+            self.state.delete(REFS_NAMESPACE, job_id)
+            if self.on_complete:
+                self.on_complete(self.get(job_id), self.report(job_id)["changes"])
+        except JobTakenOver:
+            return  # another run owns the job now and carries on from the last checkpoint
+        except Exception as e:
+            job["status"] = "failed"
+            job["error"] = str(e)
+            try:
+                self._save_job(job)
+            except JobTakenOver:
+                pass
+
+    def _stop_paused(self, job: Dict[str, Any]) -> bool:
+        """Record the run as paused, unless the pause was withdrawn since it was read"""
+        def stop(current):
+            if current.get("owner") != job["owner"]:
+                raise JobTakenOver(job["id"])
+            if not current.get("pause_requested"):
+                return None
+            return {**job, "status": "paused", "owner": None, "pause_requested": False, "heartbeat": time.time()}
+
+        if self._update(job["id"], stop) is not None:
+            return True
+        self._save_job(job)
+        return False
+
+    def _apply(self, job: Dict[str, Any], scorable: List[Tuple[Ref, Dict[str, Any]]],
+               scored: List[Dict[str, Any]]) -> None:
+        changes = []
+        for (ref, before), after in zip(scorable, scored):
+            reads = after.pop("evaluation_reads")
+            self.index.add(ref, reads)
+            if all(before.get(field) == after[field] for field in COMPARED_FIELDS):
+                continue
+            changes.append({
+                "organization": ref[0],
+                "assessment_id": ref[1],
+                "name": before.get("name"),
+                "created_by": before.get("created_by"),
+                "decision_changed": before.get("status") != after["status"],
+                "before": {field: before.get(field) for field in COMPARED_FIELDS},
+                "after": after,
+            })
+            self.save_assessment(ref, {
+                **before, **after,
+                "evaluation_reads": reads,
+                "ruleset_hash": job["ruleset_hash"],
+                "rescored_at": datetime.datetime.now().isoformat(),
+            })
+
+        if changes:
+            job["changed"] += len(changes)
+            job["decision_changes"] += sum(1 for change in changes if change["decision_changed"])
+            # Keyed by the cursor, so a window repeated after a crash overwrites its page
+            self.state.set(REPORTS_NAMESPACE, f"{job['id']}:{job['processed']:012d}", changes)
@@ -0,0 +1,131 @@
+"""
+What-if sensitivity analysis over the AI compliance rules engine
+"""
+
+import itertools
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from description_signals import evaluate
+
+# DetailedAssessmentRequest field -> rules engine input key
+ENGINE_FIELD_MAP = {
+    "beskrivelse": "description",
+    "ai_system_type": "ai_system_type",
+    "rolle": "role",
+    "branch_sector": "branch_sector",
+    "handles_personal_data": "handles_personal_data",
+    "data_types": "data_types",
+    "automated_decisions": "automated_decisions",
+    "decision_type": "decision_type",
+    "decision_impact": "decision_impact",
+}
+
+ENGINE_KEYS = tuple(ENGINE_FIELD_MAP.values())
+
+# Upper bound on combinations evaluated in a single what-if call
+MAX_COMBINATIONS = 1000
+
+
+def _freeze(value: Any) -> Any:
+    if isinstance(value, list):
+        return tuple(_freeze(v) for v in value)
+    if isinstance(value, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in value.items()))
+    return value
+
+
+def engine_input_key(user_responses: Dict[str, Any]) -> Tuple:
+    """Hashable key identifying a rules engine input"""
+    return tuple(_freeze(user_responses.get(key)) for key in ENGINE_KEYS)
+
+
+def expand_variations(variations: Optional[List[Dict[str, Any]]] = None,
+                      grid: Optional[Dict[str, List[Any]]] = None) -> List[Dict[str, Any]]:
+    """Combine explicit variations with the cartesian product of a grid"""
+    combinations = [dict(v) for v in (variations or [])]
+
+    if grid:
+        fields = list(grid.keys())
+        size = 1
+        for field in fields:
+            size *= len(grid[field])
+        if len(combinations) + size > MAX_COMBINATIONS:
+            raise ValueError(f"What-if grid exceeds {MAX_COMBINATIONS} combinations")
+        for values in itertools.product(*(grid[field] for field in fields)):
+            combinations.append(dict(zip(fields, values)))
+
+    if len(combinations) > MAX_COMBINATIONS:
+        raise ValueError(f"What-if grid exceeds {MAX_COMBINATIONS} combinations")
+
+    for changes in combinations:
+        unknown = [field for field in changes if field not in ENGINE_FIELD_MAP]
+        if unknown:
+            raise ValueError(f"Unknown assessment fields: {', '.join(sorted(unknown))}")
+
+    return combinations
+
+
+class SensitivityAnalyzer:
+    """Evaluates many engine inputs, sharing results between identical inputs"""
+
+    def __init__(self, engine, description_analyzer=None):
+        self.engine = engine
+        self.description_analyzer = description_analyzer
+        self._results: Dict[Tuple, Tuple[Any, str]] = {}
+        self.evaluations = 0
+
+    def evaluate(self, user_responses: Dict[str, Any]):
+        """(result, classification), escalated by description signals as for stored assessments"""
+        key = engine_input_key(user_responses)
+        evaluated = self._results.get(key)
+        if evaluated is None:
+            evaluated = self._results[key] = evaluate(self.engine, self.description_analyzer, user_responses)
+            self.evaluations += 1
+        return evaluated
+
+
+def _summarize(result, classification: str) -> Dict[str, Any]:
+    return {
+        "risk_score": result.risk_score,
+        "risk_level": result.risk_level,
+        "decision": result.decision,
+        "ai_classification": classification,
+        "required_assessments": list(result.required_assessments),
+    }
+
+
+def run_sensitivity(engine, base_responses: Dict[str, Any],
+                    variations: List[Tuple[Dict[str, Any], Dict[str, Any]]],
+                    description_analyzer=None) -> Dict[str, Any]:
+    """
+    Evaluate a base input and each (changes, user_responses) variation,
+    returning the risk score and decision delta against the base.
+    """
+    started = time.perf_counter()
+    analyzer = SensitivityAnalyzer(engine, description_analyzer)
+
+    base = _summarize(*analyzer.evaluate(base_responses))
+    base_assessments = set(base["required_assessments"])
+
+    results = []
+    for changes, user_responses in variations:
+        summary = _summarize(*analyzer.evaluate(user_responses))
+        assessments = set(summary["required_assessments"])
+        summary.update({
+            "changes": changes,
+            "risk_score_delta": summary["risk_score"] - base["risk_score"],
+            "decision_changed": summary["decision"] != base["decision"],
+            "classification_changed": summary["ai_classification"] != base["ai_classification"],
+            "added_assessments": sorted(assessments - base_assessments),
+            "removed_assessments": sorted(base_assessments - assessments),
+        })
+        results.append(summary)
+
+    return {
+        "base": base,
+        "variations": results,
+        "total_variations": len(results),
+        "unique_evaluations": analyzer.evaluations,
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 2),
+    }
@@ -0,0 +1,205 @@
+"""
+Near-duplicate detection for the assessment inventory
+
+Each assessment becomes a set of features: word unigrams and bigrams of
+the normalised system name and description, character trigrams of the
+name, and the engine's decision fields (repeated so they weigh as much
+as a short description). The set is summarised by a one-permutation
+MinHash signature: every feature is hashed once, and its bin keeps the
+minimum. Empty bins are filled from the next non-empty bin. Signatures are
+split into bands for locality-sensitive hashing, so a lookup touches only
+the assessments that share a band with the query, never the whole
+inventory. Candidates are ranked by the estimated Jaccard similarity.
+"""
+
+import base64
+import operator
+import re
+import threading
+import unicodedata
+import zlib
+from array import array
+from collections import Counter, defaultdict
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+NUM_BINS = 64
+BANDS = 16
+ROWS = NUM_BINS // BANDS  # pairs above roughly (1/BANDS) ** (1/ROWS) = 0.5 similarity collide
+DEFAULT_THRESHOLD = 0.6
+# Most recent entries read per band bucket, and candidates scored per query
+MAX_BUCKET_SCAN = 200
+MAX_SCORED = 64
+
+# Decision fields folded into the signature; each value counts FIELD_WEIGHT times
+DECISION_FIELDS = ("ai_system_type", "role", "branch_sector", "handles_personal_data", "data_types",
+                   "automated_decisions", "decision_type", "decision_impact")
+FIELD_WEIGHT = 3
+
+_EMPTY = 0xFFFFFFFF
+_WORD = re.compile(r"\w+", re.UNICODE)
+
+
+def normalise_text(text: str) -> List[str]:
+    text = unicodedata.normalize("NFKC", text or "").casefold()
+    return _WORD.findall(text)
+
+
+def features(name: str, user_responses: Dict[str, Any]) -> Set[str]:
+    feats: Set[str] = set()
+    for prefix, words in (("n", normalise_text(name)), ("d", normalise_text(user_responses.get("description", "")))):
+        feats.update(f"{prefix}:{word}" for word in words)
+        feats.update(f"{prefix}:{a} {b}" for a, b in zip(words, words[1:]))
+    compact = " ".join(normalise_text(name))
+    feats.update(f"c:{compact[i:i + 3]}" for i in range(len(compact) - 2))
+
+    for field in DECISION_FIELDS:
+        value = user_responses.get(field)
+        values = sorted(map(str, value)) if isinstance(value, (list, tuple, set)) else [str(value)]
+        for item in values or ["-"]:
+            feats.update(f"f:{field}={item}#{i}" for i in range(FIELD_WEIGHT))
+    return feats
+
+
+def signature(feats: Iterable[str]) -> array:
+    """One-permutation MinHash with rotation densification"""
+    sig = array("I", [_EMPTY]) * NUM_BINS
+    for feat in feats:
+        data = feat.encode("utf-8")
+        # Two seeded CRC32s make a cheap, process-independent 64-bit hash
+        h = zlib.crc32(data) | (zlib.crc32(data, 0x9E3779B9) << 32)
+        b, value = h % NUM_BINS, (h // NUM_BINS) & 0xFFFFFFFF
+        if value < sig[b]:
+            sig[b] = value
+    if _EMPTY in sig and any(v != _EMPTY for v in sig):
+        filled = list(sig)
+        for b in range(NUM_BINS):
+            offset = 1
+            while filled[b] == _EMPTY:
+                filled[b] = sig[(b + offset) % NUM_BINS]
+                offset += 1
+        sig = array("I", filled)
+    return sig
+
+
+def encode_signature(sig: array) -> str:
+    return base64.b64encode(sig.tobytes()).decode("ascii")
+
+
+def decode_signature(text: str) -> array:
+    sig = array("I")
+    sig.frombytes(base64.b64decode(text))
+    return sig
+
+
+def estimated_similarity(a: array, b: array) -> float:
+    return sum(map(operator.eq, a, b)) / NUM_BINS
+
+
+class SimilarityIndex:
+    """Per-tenant LSH buckets of assessment signatures"""
+
+    def __init__(self):
+        self._buckets: Dict[str, Dict[int, List[str]]] = defaultdict(lambda: defaultdict(list))
+        self._signatures: Dict[str, Dict[str, array]] = defaultdict(dict)
+        self._inputs: Dict[str, Dict[str, Tuple]] = defaultdict(dict)
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return sum(len(sigs) for sigs in self._signatures.values())
+
+    @staticmethod
+    def _band_keys(sig: array) -> List[int]:
+        return [hash((band,) + tuple(sig[band * ROWS:(band + 1) * ROWS])) for band in range(BANDS)]
+
+    def add(self, tenant_key: str, assessment_id: str, sig: array, input_key: Tuple) -> None:
+        """Index an assessment; same as replace(), so an updated one is re-indexed"""
+        self.replace(tenant_key, assessment_id, sig, input_key)
+
+    def replace(self, tenant_key: str, assessment_id: str, sig: array, input_key: Tuple) -> None:
+        """Index an assessment under `sig`, dropping the buckets of the signature it had"""
+        with self._lock:
+            signatures = self._signatures[tenant_key]
+            if signatures.get(assessment_id) == sig and self._inputs[tenant_key].get(assessment_id) == input_key:
+                return
+            self._discard(tenant_key, assessment_id)
+            signatures[assessment_id] = sig
+            self._inputs[tenant_key][assessment_id] = input_key
+            buckets = self._buckets[tenant_key]
+            for key in self._band_keys(sig):
+                buckets[key].append(assessment_id)
+
+    def remove(self, tenant_key: str, assessment_id: str) -> None:
+        with self._lock:
+            self._discard(tenant_key, assessment_id)
+
+    def _discard(self, tenant_key: str, assessment_id: str) -> None:
+        sig = self._signatures.get(tenant_key, {}).pop(assessment_id, None)
+        if sig is None:
+            return
+        self._inputs[tenant_key].pop(assessment_id, None)
+        buckets = self._buckets[tenant_key]
+        for key in self._band_keys(sig):
+            bucket = buckets.get(key)
+            if bucket and assessment_id in bucket:
+                bucket.remove(assessment_id)
+                if not bucket:
+                    del buckets[key]
+
+    def query(self, tenant_key: str, sig: array, threshold: float = DEFAULT_THRESHOLD, limit: int = 5,
+              exclude: Optional[str] = None) -> List[Tuple[str, float]]:
+        """(assessment id, estimated similarity) of the closest stored assessments"""
+        with self._lock:
+            buckets = self._buckets.get(tenant_key)
+            if not buckets:
+                return []
+            # Candidates sharing more bands are likelier to be similar; score only the best
+            hits: Counter = Counter()
+            for key in self._band_keys(sig):
+                bucket = buckets.get(key)
+                if bucket:
+                    hits.update(bucket[-MAX_BUCKET_SCAN:])
+            hits.pop(exclude, None)
+            signatures = self._signatures[tenant_key]
+            scored = [(ref, estimated_similarity(sig, signatures[ref])) for ref, _ in hits.most_common(MAX_SCORED)]
+        scored = [item for item in scored if item[1] >= threshold]
+        scored.sort(key=lambda item: (-item[1], item[0]))
+        return scored[:limit]
+
+    def export(self) -> Dict[str, Any]:
+        """Plain copy of the index, for snapshots; band keys hash ints only, so they stay valid across processes"""
+        with self._lock:
+            return {
+                "signatures": {tenant: dict(sigs) for tenant, sigs in self._signatures.items()},
+                "inputs": {tenant: dict(inputs) for tenant, inputs in self._inputs.items()},
+                "buckets": {tenant: {key: list(ids) for key, ids in buckets.items()}
+                            for tenant, buckets in self._buckets.items()},
+            }
+
+    def adopt(self, data: Dict[str, Any]) -> None:
+        """Replace the index with an export()"""
+        with self._lock:
+            self._signatures.clear()
+            self._signatures.update(data["signatures"])
+            self._inputs.clear()
+            self._inputs.update(data["inputs"])
+            self._buckets.clear()
+            for tenant, buckets in data["buckets"].items():
+                self._buckets[tenant].update(buckets)
+
+    def sample(self, count: int) -> List[Tuple[str, array, Tuple]]:
+        """Up to `count` (assessment ID, signature, inputs) spread over the index, for size estimates"""
+        with self._lock:
+            entries = [(assessment_id, sig, self._inputs[tenant][assessment_id])
+                       for tenant, sigs in self._signatures.items() for assessment_id, sig in sigs.items()]
+        return entries[::max(1, len(entries) // count)][:count] if count > 0 else []
+
+    def same_inputs(self, tenant_key: str, assessment_id: str, input_key: Tuple) -> bool:
+        return self._inputs.get(tenant_key, {}).get(assessment_id, ()) == input_key
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "tenants": len(self._signatures),
+                "assessments": sum(len(sigs) for sigs in self._signatures.values()),
+                "buckets": sum(len(buckets) for buckets in self._buckets.values()),
+            }
@@ -3,16 +3,51 @@
 Simple Judge Dredd API for localhost testing
 """
 
-from fastapi import FastAPI, Depends, HTTPException, status
+from fastapi import FastAPI, Depends, HTTPException, Query, Request, Response, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.exceptions import RequestValidationError
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from pydantic import BaseModel, EmailStr
+from pydantic import BaseModel, EmailStr, Field, TypeAdapter, ValidationError
 from typing import List, Dict, Any, Optional
 import datetime
+import asyncio
+import copy
 import json
+import math
+import os
+import sys
+import threading
+import time
 import jwt
-import bcrypt
 from rules_engine import AIComplianceRulesEngine
+from coalescing import MicroCache
+from concurrency import CRITICAL, HIGH, LOW, ConcurrencyLimiter, ConcurrencyMiddleware, route_classifier
+from compression import CompressionMiddleware
+from decision_table import DecisionTableCache, ruleset_digest, ruleset_hash
+from description_signals import DescriptionAnalyzer, evaluate
+from audit_log import AuditLog, text_digest
+from body_decoding import EngineInputDecoder, validation_errors
+from ids import ID_EPOCH, NODE_LEASE_SECONDS, id_bounds, lease_node, new_id, renew_node_lease
+from memory_budget import MemoryWatchdog, extrapolated_size, sampled_size, worker_budget
+from news_ingestion import NewsIngestor, load_sources
+from password_hashing import available_schemes, calibrate, hash_parameters, needs_rehash, verify_password
+import password_hashing
+from profiling import ProfilingMiddleware, StackSampler
+from projection import FieldTree, Lazy, parse_fields, project
+from provisioning import BulkProvisioner, parse_upload
+from reminders import Outbox, Reminders, SmtpSink, StatePushSink
+from rescoring import JOB_LEASE_SECONDS, Rescorer, RuleDependencyIndex, changed_rules, rule_references
+from similarity import SimilarityIndex, decode_signature, encode_signature, features, signature
+from snapshots import SnapshotStore, code_digest
+from state_backend import MemoryBackend, NearCache, create_backend
+from sensitivity import ENGINE_FIELD_MAP, engine_input_key, expand_variations, run_sensitivity
+from wizard_sessions import TrackingResponses, WizardSessions
+from traffic_capture import CaptureMiddleware, CaptureWriter, Scrubber
+from token_revocation import RefreshTokens, RevocationList, TokenError, session_key
+from tenancy import (DEFAULT_TENANT, InviteError, Organizations, RateLimiter, Tenant, TenantRegistry,
+                     legacy_tenant_key, tenant_key)
 
 app = FastAPI(
     title="Judge Dredd API",
@@ -20,6 +55,36 @@ app = FastAPI(
     version="1.0.0"
 )
 
+# Opt-in sampled, anonymised traffic capture for replay; see traffic_capture.py.
+# Added first so it is innermost: it sees uncompressed bodies and app time only.
+CAPTURE_DIR = os.environ.get("JUDGE_DREDD_CAPTURE_DIR")
+capture_writer = CaptureWriter(CAPTURE_DIR) if CAPTURE_DIR else None
+if capture_writer is not None:
+    capture_key = os.environ.get("JUDGE_DREDD_CAPTURE_KEY")
+    app.add_middleware(
+        CaptureMiddleware,
+        writer=capture_writer,
+        sample_rate=float(os.environ.get("JUDGE_DREDD_CAPTURE_RATE", "0.01")),
+        scrubber=Scrubber(capture_key.encode() if capture_key else None),
+        identify=lambda authorization: capture_identity(authorization),
+    )
+
+# Adaptive concurrency limit with priority classes; see concurrency.py
+ROUTE_PRIORITIES = [
+    # (path prefix, method or None for any, priority); first match wins, default NORMAL
+    ("/health", None, CRITICAL),
+    ("/api/auth/refresh", None, CRITICAL),
+    ("/api/auth/me", None, HIGH),
+    ("/api/admin/users/bulk", None, LOW),
+    ("/api/admin/", None, HIGH),
+    ("/api/templates/dpia/generate", None, LOW),
+    ("/api/templates/fria/generate", None, LOW),
+    ("/api/compliance/what-if", None, LOW),
+    ("/api/compliance/decision-table", None, LOW),
+]
+concurrency_limiter = ConcurrencyLimiter()
+app.add_middleware(ConcurrencyMiddleware, limiter=concurrency_limiter, classify=route_classifier(ROUTE_PRIORITIES))
+
 # Enable CORS for localhost
 app.add_middleware(
     CORSMiddleware,
@@ -29,27 +94,305 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Per-request profiles for admins sending X-Profile; see profiling.py
+app.add_middleware(ProfilingMiddleware, authorize=lambda authorization: is_admin_authorization(authorization))
+
+# Compress large JSON responses and answer conditional GETs with 304
+app.add_middleware(CompressionMiddleware, minimum_size=1024)
+
 # Initialize Rules Engine
-rules_engine = AIComplianceRulesEngine("decision_tree.json")
+DECISION_TREE_PATH = "decision_tree.json"
+RULES_LOAD_ATTEMPTS = 3
+
+def load_ruleset(path: str) -> Dict[str, Any]:
+    """Hash and tree of one read of decision_tree.json"""
+    with open(path, "rb") as f:
+        data = f.read()
+    return {"hash": ruleset_digest(data), "tree": json.loads(data)}
+
+def load_rules(path: str):
+    """
+    (engine, ruleset) from the same version of decision_tree.json. The engine reads the file
+    itself, so the load is repeated if the file changed while the engine was built.
+    """
+    for _ in range(RULES_LOAD_ATTEMPTS):
+        ruleset = load_ruleset(path)
+        engine = AIComplianceRulesEngine(path)
+        if ruleset_hash(path) == ruleset["hash"]:
+            return engine, ruleset
+    raise RuntimeError(f"{path} kept changing while the rules engine was loaded")
+
+# The decision table is built from this engine and labelled with this ruleset's hash, never the file's
+rules_engine, current_ruleset = load_rules(DECISION_TREE_PATH)
+decision_table = DecisionTableCache(rules_engine, current_ruleset["hash"])
 
 # JWT Configuration
 SECRET_KEY = "judge_dredd_ai_secret_key_2025_very_secure"
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
+REFRESH_TOKEN_EXPIRE_DAYS = 14
 
 # Security
 security = HTTPBearer()
+optional_security = HTTPBearer(auto_error=False)
+
+# Micro-cache with request coalescing for hot read endpoints
+micro_cache = MicroCache(ttl=1.0, stale_ttl=5.0)
+
+# Shared state (users, assessments, activity); see state_backend.py for URLs
+STATE_URL = os.environ.get("JUDGE_DREDD_STATE_URL", "memory://")
+state = NearCache(create_backend(STATE_URL))
+
+# The node ID in minted IDs is leased through the state backend, so no two live workers share one; see ids.py
+lease_node(state)
+
+@app.on_event("startup")
+async def renew_node_id_lease():
+    async def renew():
+        while True:
+            await asyncio.sleep(NODE_LEASE_SECONDS / 3)
+            try:
+                renew_node_lease()
+            except Exception as e:
+                print(f"Node ID lease renewal failed: {e}", file=sys.stderr)
+
+    task = asyncio.ensure_future(renew())
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+
+# Append-only audit log of decisions and generated reports; see audit_log.py
+AUDIT_DIR = os.environ.get("JUDGE_DREDD_AUDIT_DIR", "audit_log")
+audit_log = AuditLog(AUDIT_DIR)
+# Decision responses wait until their audit record is fsynced. With JUDGE_DREDD_AUDIT_SYNC=0 they don't, and a
+# crash can lose the records of decisions answered in the last group commit (flush interval plus one fsync).
+AUDIT_SYNC = os.environ.get("JUDGE_DREDD_AUDIT_SYNC", "1") != "0"
+AUDIT_SYNC_TIMEOUT = 5.0
+
+async def audit_durable(ticket: int):
+    """Wait for an audit record to be committed; 503 if the log is not committing"""
+    if AUDIT_SYNC and not await run_in_threadpool(audit_log.flush, ticket, AUDIT_SYNC_TIMEOUT):
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                            detail="The audit log is not accepting records; the decision was not recorded durably")
+
+# Warm restart from the last state snapshot taken with this ruleset; see snapshots.py
+SNAPSHOT_DIR = os.environ.get("JUDGE_DREDD_SNAPSHOT_DIR")
+snapshot_store = None
+if SNAPSHOT_DIR:
+    # This service's modules and the rules engine identify the build that may adopt a snapshot
+    build_digest = code_digest([os.path.dirname(os.path.abspath(__file__)), sys.modules[AIComplianceRulesEngine.__module__].__file__])
+    snapshot_store = SnapshotStore(SNAPSHOT_DIR, build_digest, float(os.environ.get("JUDGE_DREDD_SNAPSHOT_INTERVAL", "300")))
+warm_snapshot = snapshot_store.open(current_ruleset["hash"]) if snapshot_store else None
+
+def warm_section(name: str):
+    """A section of the startup snapshot, or None when starting cold"""
+    return snapshot_store.take(warm_snapshot, name) if snapshot_store else None
+
+warm_table = warm_section("decision_table")
+if warm_table is not None and not decision_table.adopt(warm_table):
+    snapshot_store.reject("decision_table", "built for another ruleset")
+
+# High-risk terms in free-text descriptions; see description_signals.py
+description_analyzer = warm_section("description_analyzer") or DescriptionAnalyzer.from_ruleset(current_ruleset["tree"])
+# The ruleset stored assessments were last scored against, and the one every worker evaluates with
+state.add("rulesets", "scored", current_ruleset)
+state.add("rulesets", "active", current_ruleset)
+RULESET_SYNC_INTERVAL = 30
+
+rule_index = RuleDependencyIndex()
+
+def load_stored_assessment(ref):
+    tenant_name, assessment_id = ref
+    return tenants.get(tenant_name).assessments.get(assessment_id)
+
+def save_stored_assessment(ref, assessment: Dict[str, Any]):
+    tenants.get(ref[0]).store_assessment(assessment)
+    index_stored_assessment(ref[0], assessment)
+    reminders.track(ref[0], assessment)
+    audit_log.append("rescore", ref[1], {
+        "risk_score": assessment["risk_score"],
+        "risk_level": assessment["risk_level"],
+        "decision": assessment["status"],
+        "required_assessments": assessment["required_assessments"],
+        "ai_classification": assessment["ai_classification"],
+        "ruleset_hash": assessment["ruleset_hash"],
+    }, tenant=ref[0])
+
+rescorer = Rescorer(state, rule_index, DECISION_TREE_PATH, load_stored_assessment, save_stored_assessment)
+
+# Near-duplicate detection over each tenant's inventory; see similarity.py
+similarity_index = SimilarityIndex()
+
+def assessment_signature(system_name: str, user_responses: Dict[str, Any]):
+    return signature(features(system_name, user_responses))
+
+def index_stored_assessment(tenant_name: str, assessment: Dict[str, Any]):
+    """Add a stored assessment to the in-process indexes, or re-index an updated one (also for other workers' writes)"""
+    if not assessment.get("user_responses"):
+        return
+    rule_index.add((tenant_name, assessment["id"]), assessment.get("evaluation_reads", ENGINE_FIELD_MAP.values()))
+    encoded = assessment.get("similarity_signature")
+    sig = decode_signature(encoded) if encoded else assessment_signature(assessment["name"], assessment["user_responses"])
+    similarity_index.replace(tenant_name, assessment["id"], sig, engine_input_key(assessment["user_responses"]))
+
+def unindex_assessment(tenant_name: str, assessment_id: str):
+    """Drop a deleted assessment from the in-process indexes"""
+    rule_index.remove((tenant_name, assessment_id))
+    similarity_index.remove(tenant_name, assessment_id)
+
+def rebuild_assessment_indexes():
+    for tenant_name, _ in state.items("tenants"):
+        for assessment in tenants.get(tenant_name).list_assessments():
+            index_stored_assessment(tenant_name, assessment)
+
+def reload_rules_engine():
+    """Swap in the current decision_tree.json for new evaluations"""
+    global rules_engine, current_ruleset, description_analyzer
+    rules_engine, current_ruleset = load_rules(DECISION_TREE_PATH)
+    description_analyzer = DescriptionAnalyzer.from_ruleset(current_ruleset["tree"])
+    wizard_sessions.engine = rules_engine
+    wizard_sessions.analyzer = description_analyzer
+    decision_table.use(rules_engine, current_ruleset["hash"])
+    for tenant in tenants.all():
+        tenant.evaluation_cache.clear()
+
+def sync_ruleset():
+    """Reload decision_tree.json when another worker activated a ruleset this one is not using"""
+    active = state.get("rulesets", "active")
+    if active is None or active["hash"] == current_ruleset["hash"]:
+        return
+    reload_rules_engine()
+    if current_ruleset["hash"] != active["hash"]:
+        print(f"decision_tree.json here ({current_ruleset['hash'][:12]}) differs from the active ruleset "
+              f"({active['hash'][:12]})", file=sys.stderr)
+
+# Server-side assessment wizard sessions
+wizard_sessions = WizardSessions(rules_engine, state, description_analyzer)
+WIZARD_PRUNE_INTERVAL = 3600
+
+@app.on_event("startup")
+async def start_wizard_session_pruning():
+    async def prune():
+        while True:
+            await asyncio.sleep(WIZARD_PRUNE_INTERVAL)
+            try:
+                await run_in_threadpool(wizard_sessions.prune, [key for key, _ in state.items("tenants")])
+            except Exception as e:
+                print(f"Wizard session pruning failed: {e}", file=sys.stderr)
+
+    task = asyncio.ensure_future(prune())
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+
+# Tenancy and rate limiting
+def tenant_store(key: str):
+    state.add("tenants", key, {"created_at": datetime.datetime.now().isoformat()})
+    return state.mapping(f"assessments:{key}")
+
+tenants = TenantRegistry(store_factory=tenant_store)
+
+for tenant_name, entries in (warm_section("evaluation_caches") or {}).items():
+    tenants.get(tenant_name).evaluation_cache.load(entries)
+
+# Tenant -> version stamp of its stored assessments, renewed on every write
+ASSESSMENT_VERSIONS_NAMESPACE = "assessment_versions"
+
+def on_state_change(namespace: str, key: str, local: bool):
+    # Every assessment write stamps a new version of its tenant's inventory; see assessment_fingerprint
+    if local and namespace.startswith("assessments:"):
+        state.set(ASSESSMENT_VERSIONS_NAMESPACE, namespace.split(":", 1)[1], new_id("v_"))
+    # Assessments written by another worker are applied to that tenant's aggregates one at a time
+    if not local and namespace.startswith("assessments:"):
+        tenant_name = namespace.split(":", 1)[1]
+        assessment = state.get(namespace, key)
+        tenants.get(tenant_name).apply_change(key, assessment)
+        if assessment is not None:
+            index_stored_assessment(tenant_name, assessment)
+            reminders.track(tenant_name, assessment)
+        else:
+            unindex_assessment(tenant_name, key)
+            reminders.forget(tenant_name, key)
+    elif not local and namespace == "rulesets" and key == "active":
+        sync_ruleset()
+
+state.on_change(on_state_change)
+
+def rebuild_aggregates():
+    for tenant in tenants.all():
+        tenant.invalidate_metrics()
+
+state.on_resync(rebuild_aggregates)
+
+RATE_LIMITS = {
+    # scope: (group rate/s, group burst, user rate/s, user burst)
+    # Assessments are charged to the caller's tenant and user. Auth calls are charged to the client IP and the
+    # email, never to a tenant: anyone can name any email, so that would let strangers lock an organisation out.
+    "assessment": (20, 40, 5, 10),
+    "auth": (10, 20, 0.5, 5),
+    # A what-if call evaluates up to MAX_COMBINATIONS inputs, so it gets far fewer calls than an assessment
+    "what_if": (1, 5, 0.2, 3),
+}
+rate_limiters = {
+    scope: (RateLimiter(tenant_rate, tenant_burst), RateLimiter(user_rate, user_burst))
+    for scope, (tenant_rate, tenant_burst, user_rate, user_burst) in RATE_LIMITS.items()
+}
 
-# In-memory user database (would be replaced with real database in production)
-users_db = {
-    "demo@judgedredd.ai": {
+# Password hashing calibrated to a latency budget, shared by all workers; see password_hashing.py
+PASSWORD_HASH_SCHEME = os.environ.get("JUDGE_DREDD_PASSWORD_HASH", "bcrypt")
+PASSWORD_HASH_BUDGET_MS = float(os.environ.get("JUDGE_DREDD_PASSWORD_HASH_MS", "250"))
+
+def password_policy() -> Dict[str, Any]:
+    return state.get("settings", "password_policy")
+
+def configured_policy(policy: Optional[Dict[str, Any]]) -> bool:
+    return (policy is not None and policy["scheme"] == PASSWORD_HASH_SCHEME
+            and policy["budget_ms"] == PASSWORD_HASH_BUDGET_MS)
+
+if not configured_policy(password_policy()):
+    # A snapshot from this machine saves calibrating again
+    calibrated = warm_section("password_policy")
+    if calibrated is not None and not configured_policy(calibrated):
+        snapshot_store.reject("password_policy", "calibrated for another scheme or budget")
+        calibrated = None
+    state.set("settings", "password_policy", calibrated or calibrate(PASSWORD_HASH_BUDGET_MS, PASSWORD_HASH_SCHEME))
+
+# User database backed by the shared state backend
+users_db = state.mapping("users")
+
+# Organisations are server-issued IDs; see tenancy.py
+organizations = Organizations(state, lambda: new_id("org_"))
+DEMO_ORGANIZATION_ID = "org_demo"
+organizations.create("Judge Dredd AI", DEMO_ORGANIZATION_ID)
+
+def migrate_legacy_organizations():
+    """Bind users from before organisation IDs to an organisation keyed as their tenant was"""
+    for email, user in list(users_db.items()):
+        if user.get("organization_id"):
+            continue
+        key = legacy_tenant_key(user["organization"])
+        # Those sharing the anonymous tenant get an organisation of their own
+        organization = (organizations.create(user["organization"], key, legacy=True) if key != DEFAULT_TENANT
+                        else organizations.create(user["organization"] or email))
+        users_db[email] = {**user, "organization_id": organization["id"]}
+
+migrate_legacy_organizations()
+
+# Revoked tokens (checked through a per-worker Bloom filter) and rotating refresh tokens; see token_revocation.py
+token_revocations = RevocationList(state)
+refresh_tokens = RefreshTokens(state, token_revocations, REFRESH_TOKEN_EXPIRE_DAYS * 86400)
+state.on_change(token_revocations.on_change)
+state.on_resync(token_revocations.rebuild)
+
+if "demo@judgedredd.ai" not in users_db:
+    users_db.add("demo@judgedredd.ai", {
         "id": "1",
         "email": "demo@judgedredd.ai",
         "first_name": "Demo",
         "last_name": "User",
         "organization": "Judge Dredd AI",
+        "organization_id": DEMO_ORGANIZATION_ID,
         "role": "admin",
-        "hashed_password": bcrypt.hashpw("demo123".encode('utf-8'), bcrypt.gensalt()).decode('utf-8'),
+        "hashed_password": warm_section("demo_password_hash")
+                           or password_hashing.hash_password("demo123", password_policy()),
         "is_active": True,
         "is_email_verified": True,
         "created_at": datetime.datetime.now().isoformat(),
@@ -63,16 +406,33 @@ users_db = {
                 "compliance_updates": True
             }
         }
-    }
-}
+    })
+
+# Reassessment reminders and compliance update notifications; see reminders.py
+SMTP_HOST = os.environ.get("JUDGE_DREDD_SMTP_HOST", "localhost")
+SMTP_PORT = int(os.environ.get("JUDGE_DREDD_SMTP_PORT", "8025"))
+REMINDER_SENDER = os.environ.get("JUDGE_DREDD_REMINDER_SENDER", "noreply@judgedredd.ai")
+reminders = Reminders(state, users_db, Outbox([SmtpSink(SMTP_HOST, SMTP_PORT, REMINDER_SENDER), StatePushSink(state)]))
+
+def rescore_completed(job: Dict[str, Any], changes: List[Dict[str, Any]]):
+    # Only a finished job brings stored assessments up to its ruleset
+    active = state.get("rulesets", "active")
+    if active is not None and active["hash"] == job["ruleset_hash"]:
+        state.set("rulesets", "scored", active)
+    reminders.compliance_updates(changes)
+
+rescorer.on_complete = rescore_completed
+background_tasks = set()
 
 # Authentication Models
 class UserCreate(BaseModel):
     first_name: str
     last_name: str
     email: EmailStr
+    # Name of a new organisation, unless joining one with an invite code from its admin
     organization: str
     password: str
+    invite_code: Optional[str] = None
 
 class UserLogin(BaseModel):
     email: EmailStr
@@ -84,6 +444,7 @@ class UserResponse(BaseModel):
     first_name: str
     last_name: str
     organization: str
+    organization_id: Optional[str] = None
     role: str
     is_email_verified: bool
     created_at: str
@@ -93,21 +454,89 @@ class Token(BaseModel):
     access_token: str
     token_type: str
     user: UserResponse
+    refresh_token: Optional[str] = None
 
-# Authentication Utility Functions
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return bcrypt.checkpw(plain_password.encode('utf-8'), hashed_password.encode('utf-8'))
+class RefreshRequest(BaseModel):
+    refresh_token: str
 
+# Authentication Utility Functions
 def hash_password(password: str) -> str:
-    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+    return password_hashing.hash_password(password, password_policy())
+
+# Emails whose off-policy hash is being replaced
+rehashing = set()
+
+# Attempts at a compare-and-set of a user record (rehash, last login) before giving up until the next login
+USER_UPDATE_ATTEMPTS = 3
+
+def record_login(email: str):
+    """Set last_login with a compare-and-set, so an update made since the login read the user is kept"""
+    login_at = datetime.datetime.now().isoformat()
+    for _ in range(USER_UPDATE_ATTEMPTS):
+        user = users_db.get(email)
+        if user is None or users_db.replace(email, user, {**user, "last_login": login_at}):
+            return
+
+def schedule_rehash(email: str, password: str, old_hash: str):
+    """Replace an off-policy hash after the login response; skipped if the password changed meanwhile"""
+    if email in rehashing:
+        return
+
+    async def rehash():
+        try:
+            new_hash = await run_in_threadpool(hash_password, password)
+            # Compare-and-set, so neither a password change nor another update of the user made meanwhile is lost
+            for _ in range(USER_UPDATE_ATTEMPTS):
+                user = users_db.get(email)
+                if user is None or user["hashed_password"] != old_hash:
+                    break
+                if users_db.replace(email, user, {**user, "hashed_password": new_hash}):
+                    break
+        finally:
+            rehashing.discard(email)
+
+    rehashing.add(email)
+    task = asyncio.ensure_future(rehash())
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+
+def new_user_record(first_name: str, last_name: str, email: str, organization: Dict[str, Any], hashed_password: str,
+                    role: str = "user") -> Dict[str, Any]:
+    return {
+        "id": new_id(),
+        "email": email,
+        "first_name": first_name,
+        "last_name": last_name,
+        "organization": organization["name"],
+        "organization_id": organization["id"],
+        "role": role,
+        "hashed_password": hashed_password,
+        "is_active": True,
+        "is_email_verified": False,  # Would require email verification in production
+        "created_at": datetime.datetime.now().isoformat(),
+        "preferences": {
+            "theme": "dark",
+            "language": "da",
+            "notifications": {
+                "email": True,
+                "push": True,
+                "assessment_reminders": True,
+                "compliance_updates": True
+            }
+        }
+    }
 
-def create_access_token(data: dict, expires_delta: Optional[datetime.timedelta] = None):
+def create_access_token(data: dict, expires_delta: Optional[datetime.timedelta] = None,
+                        session_id: Optional[str] = None):
     to_encode = data.copy()
     if expires_delta:
         expire = datetime.datetime.utcnow() + expires_delta
     else:
         expire = datetime.datetime.utcnow() + datetime.timedelta(minutes=15)
-    to_encode.update({"exp": expire})
+    # jti and sid let the token, or its whole login session, be revoked
+    to_encode.update({"exp": expire, "jti": new_id()})
+    if session_id:
+        to_encode["sid"] = session_id
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
@@ -119,25 +548,89 @@ def authenticate_user(email: str, password: str):
         return False
     return user
 
-def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+def get_user_from_token(token: str):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
     try:
-        payload = jwt.decode(credentials.credentials, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         email: str = payload.get("sub")
         if email is None:
             raise credentials_exception
     except jwt.PyJWTError:
         raise credentials_exception
+    sid = payload.get("sid")
+    if token_revocations.is_revoked(payload.get("jti"), session_key(sid) if sid else None):
+        raise credentials_exception
 
     user = users_db.get(email)
     if user is None:
         raise credentials_exception
     return user
 
+def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    return get_user_from_token(credentials.credentials)
+
+def require_admin(current_user: dict = Depends(get_current_user)):
+    if current_user["role"] != "admin":
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin role required")
+    return current_user
+
+def is_admin_authorization(authorization: str) -> bool:
+    scheme, _, token = authorization.partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        return False
+    try:
+        return get_user_from_token(token)["role"] == "admin"
+    except HTTPException:
+        return False
+
+def capture_identity(authorization: str):
+    """(email, organization) behind a bearer token, for pseudonymising captured traffic"""
+    scheme, _, token = authorization.partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        return None
+    try:
+        user = get_user_from_token(token)
+    except HTTPException:
+        return None
+    return user["email"], user["organization"]
+
+def get_optional_user(credentials: Optional[HTTPAuthorizationCredentials] = Depends(optional_security)):
+    """Authenticated user if a bearer token is supplied, otherwise None"""
+    if credentials is None:
+        return None
+    return get_user_from_token(credentials.credentials)
+
+def get_tenant(current_user: Optional[dict] = Depends(get_optional_user)) -> Tenant:
+    """Tenant of the caller; anonymous callers share the public tenant"""
+    return tenants.get(current_user["organization_id"] if current_user else None)
+
+def client_ip(request: Request) -> str:
+    return request.client.host if request.client else "unknown"
+
+def enforce_rate_limit(scope: str, group_key: str, user_key: str):
+    group_limiter, user_limiter = rate_limiters[scope]
+    wait = user_limiter.check(user_key) or group_limiter.check(group_key)
+    if wait:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many requests",
+            headers={"Retry-After": str(math.ceil(wait))},
+        )
+
+def rate_limited_tenant(request: Request, current_user: Optional[dict] = Depends(get_optional_user)) -> Tenant:
+    """Tenant of the caller, after charging the tenant and user assessment buckets"""
+    tenant = tenants.get(current_user["organization_id"] if current_user else None)
+    if current_user:
+        user_key = current_user["email"]
+    else:
+        user_key = f"ip:{client_ip(request)}"
+    enforce_rate_limit("assessment", tenant.key, user_key)
+    return tenant
+
 # Enhanced Pydantic models
 class QuickCheckRequest(BaseModel):
     description: str
@@ -174,6 +667,64 @@ class DetailedAssessmentRequest(BaseModel):
     decision_type: str
     decision_impact: List[str]
     additional_info: Optional[Dict[str, Any]] = {}
+    # Answer with this stored assessment instead of adding a duplicate to the inventory
+    reuse_assessment_id: Optional[str] = None
+
+class WhatIfRequest(BaseModel):
+    base: DetailedAssessmentRequest
+    variations: Optional[List[Dict[str, Any]]] = []
+    grid: Optional[Dict[str, List[Any]]] = {}
+
+# Validators for individual DetailedAssessmentRequest fields, used by wizard answers
+answer_validators = {
+    field: TypeAdapter(DetailedAssessmentRequest.model_fields[field].annotation)
+    for field in ENGINE_FIELD_MAP
+}
+
+def validate_wizard_answers(answers: Dict[str, Any]) -> Dict[str, Any]:
+    """Validate wizard answers field by field and convert them to rules engine keys"""
+    unknown = sorted(field for field in answers if field not in ENGINE_FIELD_MAP)
+    if unknown:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Unknown assessment fields: {', '.join(unknown)}"
+        )
+    validated = {}
+    for field, value in answers.items():
+        try:
+            validated[ENGINE_FIELD_MAP[field]] = answer_validators[field].validate_python(value)
+        except ValidationError as e:
+            raise HTTPException(
+                status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                detail={"field": field, "errors": json.loads(e.json(include_url=False))}
+            )
+    return validated
+
+def detailed_to_user_responses(request: DetailedAssessmentRequest) -> Dict[str, Any]:
+    """Convert a detailed assessment request to rules engine format"""
+    return {
+        engine_key: getattr(request, field)
+        for field, engine_key in ENGINE_FIELD_MAP.items()
+    }
+
+# Request bodies decoded straight into rules engine inputs in one pass; see body_decoding.py
+quick_check_input = EngineInputDecoder(QuickCheckRequest)
+detailed_input = EngineInputDecoder(DetailedAssessmentRequest, ENGINE_FIELD_MAP)
+
+def split_detailed_input(decoded: Dict[str, Any]):
+    """(system name, assessment id to reuse, user_responses) of a decoded detailed assessment"""
+    system_name = decoded.pop("system_navn")
+    reuse_assessment_id = decoded.pop("reuse_assessment_id")
+    del decoded["additional_info"]
+    return system_name, reuse_assessment_id, decoded
+
+class WizardSessionCreate(BaseModel):
+    system_navn: Optional[str] = "Dit AI System"
+    answers: Optional[Dict[str, Any]] = {}
+
+class WizardAnswer(BaseModel):
+    step: Optional[int] = None
+    answers: Dict[str, Any]
 
 class AssessmentWizardResponse(BaseModel):
     steps: List[Dict[str, Any]]
@@ -194,6 +745,7 @@ mock_assessments = [
         "id": "assess-001",
         "name": "AI Chatbot for Customer Service",
         "date": "19 sep. 2025",
+        "created_at": "2025-09-19T09:00:00",
         "risk_score": 65,
         "status": "BETINGET GO",
         "system_type": "Conversational AI"
@@ -202,6 +754,7 @@ mock_assessments = [
         "id": "assess-002",
         "name": "Document Classification System",
         "date": "18 sep. 2025",
+        "created_at": "2025-09-18T09:00:00",
         "risk_score": 25,
         "status": "GO",
         "system_type": "Document Processing"
@@ -210,12 +763,172 @@ mock_assessments = [
         "id": "assess-003",
         "name": "Automated Hiring System",
         "date": "17 sep. 2025",
+        "created_at": "2025-09-17T09:00:00",
         "risk_score": 85,
         "status": "NO-GO",
         "system_type": "HR Decision Support"
     }
 ]
 
+DANISH_MONTHS = ["jan.", "feb.", "mar.", "apr.", "maj", "jun.", "jul.", "aug.", "sep.", "okt.", "nov.", "dec."]
+
+for assessment in mock_assessments:
+    # Also backfills created_at on copies stored before the mock data had it, so they show in the history
+    stored = tenants.get(DEFAULT_TENANT).assessments.get(assessment["id"])
+    if stored is None or "created_at" not in stored:
+        tenants.get(DEFAULT_TENANT).store_assessment({**(stored or {}), **assessment})
+
+# Activity feed, keyed by time-sortable "ACT-" IDs: recent reads and pruning are key-range scans
+ACTIVITY_PREFIX = "ACT-"
+ACTIVITY_RETENTION_DAYS = 90
+ACTIVITY_WINDOWS_DAYS = (1, 7, 30, ACTIVITY_RETENTION_DAYS)
+ACTIVITY_PRUNE_INTERVAL = 3600
+
+def record_activity(tenant: Tenant, activity: Dict[str, Any]):
+    state.set(f"activity:{tenant.key}", activity["id"], activity)
+
+def recent_activity(tenant: Tenant, count: int) -> List[Dict[str, Any]]:
+    """Up to `count` newest entries, read from the narrowest recent ID range that holds them"""
+    if count <= 0:
+        return []
+    now = datetime.datetime.now(datetime.timezone.utc)
+    # Past now, for IDs minted this millisecond and workers whose clocks run ahead
+    end = now + datetime.timedelta(minutes=5)
+    for days in ACTIVITY_WINDOWS_DAYS:
+        window = state.range(f"activity:{tenant.key}",
+                             *id_bounds(now - datetime.timedelta(days=days), end, ACTIVITY_PREFIX))
+        if len(window) >= count:
+            break
+    return [a for _, a in reversed(window[-count:])]
+
+def prune_activity(tenant_keys: List[str]):
+    """Delete activity older than ACTIVITY_RETENTION_DAYS"""
+    cutoff = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=ACTIVITY_RETENTION_DAYS)
+    low, high = id_bounds(ID_EPOCH, cutoff, ACTIVITY_PREFIX)
+    for key in tenant_keys:
+        for activity_id, _ in state.range(f"activity:{key}", low, high):
+            state.delete(f"activity:{key}", activity_id)
+
+@app.on_event("startup")
+async def start_activity_pruning():
+    async def prune():
+        while True:
+            try:
+                await run_in_threadpool(prune_activity, [key for key, _ in state.items("tenants")])
+            except Exception as e:
+                print(f"Activity pruning failed: {e}", file=sys.stderr)
+            await asyncio.sleep(ACTIVITY_PRUNE_INTERVAL)
+
+    task = asyncio.ensure_future(prune())
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+
+def evaluate_for_tenant(tenant: Tenant, user_responses: Dict[str, Any]):
+    """
+    Evaluate through the tenant's evaluation cache, returning
+    (result, classification, engine input fields the evaluation read)
+    """
+    key = engine_input_key(user_responses)
+    cached = tenant.evaluation_cache.get(key)
+    if cached is None:
+        tracked = TrackingResponses(user_responses)
+        # Terms such as "ansigtsgenkendelse" in the description raise the classification, and with it the result
+        result, classification = evaluate(rules_engine, description_analyzer, tracked)
+        cached = (result, classification, sorted(tracked.reads))
+        tenant.evaluation_cache.set(key, cached)
+    return cached
+
+def find_similar(tenant: Tenant, system_name: str, user_responses: Dict[str, Any], exclude: Optional[str] = None,
+                 sig=None):
+    """(signature, similar stored assessments) for a submission; none in the public tenant, which nobody owns"""
+    if sig is None:
+        sig = assessment_signature(system_name, user_responses)
+    if tenant.key == DEFAULT_TENANT:
+        return sig, []
+    input_key = engine_input_key(user_responses)
+    similar = []
+    for assessment_id, score in similarity_index.query(tenant.key, sig, exclude=exclude):
+        assessment = tenant.assessments.get(assessment_id)
+        if assessment is None:
+            continue
+        similar.append({
+            "assessment_id": assessment_id,
+            "name": assessment["name"],
+            "similarity": round(score, 2),
+            "identical_inputs": similarity_index.same_inputs(tenant.key, assessment_id, input_key),
+            "risk_score": assessment["risk_score"],
+            "status": assessment["status"],
+            "created_at": assessment.get("created_at"),
+            "created_by": assessment.get("created_by"),
+        })
+    return sig, similar
+
+# Free text kept out of the audit log; its digest still shows whether a decision's input changed
+AUDIT_DIGESTED_FIELDS = ("description",)
+
+def audit_decision(tenant: Tenant, subject: Optional[str], user_responses: Dict[str, Any],
+                   assessment_result, ai_classification: Optional[str], current_user: Optional[dict],
+                   reuses: Optional[str] = None) -> int:
+    """Queue an audit record for a rules engine decision and return its ticket (see audit_durable)"""
+    return audit_log.append("decision", subject, {
+        "inputs": {**user_responses, **{
+            field: text_digest(user_responses[field])
+            for field in AUDIT_DIGESTED_FIELDS if isinstance(user_responses.get(field), str)
+        }},
+        "risk_score": assessment_result.risk_score,
+        "risk_level": assessment_result.risk_level,
+        "decision": assessment_result.decision,
+        "required_assessments": assessment_result.required_assessments,
+        "ai_classification": ai_classification,
+        "ruleset_hash": current_ruleset["hash"],
+        **({"reused_assessment_id": reuses} if reuses else {}),
+    }, tenant=tenant.key, actor=current_user["email"] if current_user else None)
+
+def store_assessment(tenant: Tenant, assessment_id: str, system_name: str, user_responses: Dict[str, Any],
+                     assessment_result, ai_classification: str, evaluation_reads: List[str],
+                     current_user: Optional[dict], similarity_signature=None) -> int:
+    """
+    Record a completed assessment in the tenant's inventory and return the ticket of its
+    audit record. Anonymous submissions are only audited: every anonymous caller shares
+    the public tenant, so anything stored there could be read by all of them.
+    """
+    now = datetime.datetime.now()
+    assessment = {
+        "id": assessment_id,
+        "name": system_name,
+        "date": f"{now.day} {DANISH_MONTHS[now.month - 1]} {now.year}",
+        "risk_score": assessment_result.risk_score,
+        "status": assessment_result.decision,
+        "system_type": user_responses["ai_system_type"],
+        "risk_level": assessment_result.risk_level,
+        "ai_classification": ai_classification,
+        "required_assessments": list(assessment_result.required_assessments),
+        "organization": tenant.key,
+        "created_by": current_user["email"] if current_user else None,
+        "created_at": now.isoformat(),
+        "user_responses": user_responses,
+        "evaluation_reads": evaluation_reads,
+        "ruleset_hash": current_ruleset["hash"],
+        "similarity_signature": encode_signature(similarity_signature or assessment_signature(system_name, user_responses)),
+    }
+    if current_user is None:
+        return audit_decision(tenant, assessment_id, user_responses, assessment_result, ai_classification, current_user)
+    tenant.store_assessment(assessment)
+    index_stored_assessment(tenant.key, assessment)
+    reminders.track(tenant.key, assessment)
+    ticket = audit_decision(tenant, assessment_id, user_responses, assessment_result, ai_classification, current_user)
+    record_activity(tenant, {
+        "id": new_id(ACTIVITY_PREFIX),
+        "type": "assessment_completed",
+        "title": f"{system_name} - {assessment_result.decision}",
+        "description": f"Compliance vurdering gennemført med risiko score på {assessment_result.risk_score} point",
+        "timestamp": assessment["created_at"],
+        "userId": f"{current_user['first_name']} {current_user['last_name']}" if current_user else None,
+        "systemId": assessment_id,
+        "riskScore": assessment_result.risk_score,
+    })
+    return ticket
+
 mock_categories = {
     "samlede_termer": 15,
     "juridiske_termer": 4,
@@ -241,29 +954,35 @@ mock_links = [
     }
 ]
 
+# Sparse fieldsets: ?fields=a,b.c keeps only those paths of a response; see projection.py
+def requested_fields(fields: Optional[str] = None) -> Optional[FieldTree]:
+    try:
+        return parse_fields(fields)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
 # Health check
 @app.get("/health")
 async def health_check():
     return {"status": "healthy", "timestamp": datetime.datetime.now().isoformat()}
 
-# Enhanced quick check endpoint with rules engine
-@app.post("/api/compliance/hurtig-tjek", response_model=QuickCheckResponse)
-async def quick_check(request: QuickCheckRequest):
-    # Convert request to rules engine format
-    user_responses = {
-        "description": request.description,
-        "ai_system_type": request.ai_system_type,
-        "branch_sector": request.branch_sector,
-        "handles_personal_data": request.handles_personal_data,
-        "automated_decisions": request.automated_decisions,
-        "role": request.role,
-        "data_types": request.data_types,
-        "decision_type": request.decision_type,
-        "decision_impact": request.decision_impact
-    }
+def audit_report(tenant: Tenant, report: Dict[str, Any], current_user: Optional[dict]):
+    audit_log.append("report_generated", report["report_id"], {
+        "report_type": report["report_type"],
+        "system_name": report["system_name"],
+        "generated_at": report["generated_at"],
+        "ruleset_hash": current_ruleset["hash"],
+    }, tenant=tenant.key, actor=current_user["email"] if current_user else None)
 
+# Enhanced quick check endpoint with rules engine
+@app.post("/api/compliance/hurtig-tjek", response_model=QuickCheckResponse,
+          openapi_extra=quick_check_input.openapi_extra)
+async def quick_check(user_responses: Dict[str, Any] = Depends(quick_check_input),
+                      tenant: Tenant = Depends(rate_limited_tenant),
+                      current_user: Optional[dict] = Depends(get_optional_user)):
     # Use rules engine for assessment
-    assessment_result = rules_engine.evaluate_system(user_responses)
+    assessment_result, ai_classification, _ = evaluate_for_tenant(tenant, user_responses)
+    await audit_durable(audit_decision(tenant, None, user_responses, assessment_result, ai_classification, current_user))
 
     return QuickCheckResponse(
         risk_score=assessment_result.risk_score,
@@ -279,16 +998,26 @@ async def quick_check(request: QuickCheckRequest):
     )
 
 # Assessment endpoints
+# Kept for rescoring, similarity and snapshots, never served
+INTERNAL_ASSESSMENT_FIELDS = ("evaluation_reads", "similarity_signature", "ruleset_hash")
+# Also withheld in the public tenant, which may hold anonymous submissions stored before they were only audited
+PUBLIC_WITHHELD_FIELDS = ("user_responses", "created_by")
+
+def public_assessment(tenant: Tenant, assessment: Dict[str, Any]) -> Dict[str, Any]:
+    withheld = INTERNAL_ASSESSMENT_FIELDS + (PUBLIC_WITHHELD_FIELDS if tenant.key == DEFAULT_TENANT else ())
+    return {key: value for key, value in assessment.items() if key not in withheld}
+
 @app.get("/api/assessments")
-async def get_assessments():
-    return {"assessments": mock_assessments, "total": len(mock_assessments)}
+async def get_assessments(tenant: Tenant = Depends(get_tenant)):
+    assessments = [public_assessment(tenant, assessment) for assessment in tenant.list_assessments()]
+    return {"assessments": assessments, "total": len(assessments)}
 
 @app.get("/api/assessments/{assessment_id}")
-async def get_assessment(assessment_id: str):
-    assessment = next((a for a in mock_assessments if a["id"] == assessment_id), None)
+async def get_assessment(assessment_id: str, tenant: Tenant = Depends(get_tenant)):
+    assessment = tenant.assessments.get(assessment_id)
     if not assessment:
         return {"error": "Assessment not found"}
-    return assessment
+    return public_assessment(tenant, assessment)
 
 # Knowledge base endpoints
 @app.get("/api/videnbase/categories")
@@ -319,132 +1048,133 @@ async def search_knowledge(query: str = ""):
 async def get_relevant_links():
     return {"links": mock_links, "total": len(mock_links)}
 
-# News ticker endpoint with more comprehensive legal news
+# News ticker; feeds are polled in the background (see news_ingestion.py) and the endpoint only reads
+# JSON list of {id, name, url, interval?, type?}; without it the ticker shows the seed items only
+NEWS_SOURCES_FILE = os.environ.get("JUDGE_DREDD_NEWS_SOURCES")
+news_ingestor = NewsIngestor(state, load_sources(NEWS_SOURCES_FILE) if NEWS_SOURCES_FILE else [])
+
+SEED_NEWS = [
+    {
+        "title": "BREAKING: EU AI Office udgiver omfattende retningslinjer for højrisiko AI-systemer i finanssektoren",
+        "source": "Europa-Kommissionen",
+        "type": "ai",
+        "priority": "high",
+        "timestamp": "2025-09-25T14:20:00Z"
+    },
+    {
+        "title": "Datatilsynet: Ny DPIA-skabelon for AI-systemer med persondata - obligatorisk fra 1. januar 2026",
+        "source": "Datatilsynet",
+        "type": "gdpr",
+        "priority": "high",
+        "timestamp": "2025-09-25T14:12:00Z"
+    },
+    {
+        "title": "Højesteret: Historisk afgørelse om AI-bias i ansættelsesprocesser - virksomhed idømt bøde på 2,5 mio. kr.",
+        "source": "Domstolene",
+        "type": "legal",
+        "priority": "high",
+        "timestamp": "2025-09-25T13:38:00Z"
+    },
+    {
+        "title": "OpenAI lancerer ChatGPT Enterprise Compliance Suite med indbygget GDPR og AI Act værktøjer",
+        "source": "TechCrunch",
+        "type": "ai",
+        "priority": "medium",
+        "timestamp": "2025-09-25T13:20:00Z"
+    },
+    {
+        "title": "EDPB vedtager bindende retningslinjer: Alle AI-systemer med automatiserede beslutninger skal have DPIA",
+        "source": "EDPB",
+        "type": "gdpr",
+        "priority": "high",
+        "timestamp": "2025-09-25T12:20:00Z"
+    },
+    {
+        "title": "Microsoft annoncerer Azure AI Compliance Center - automatisk overholdelse af EU AI Act",
+        "source": "Microsoft",
+        "type": "compliance",
+        "priority": "medium",
+        "timestamp": "2025-09-25T11:20:00Z"
+    },
+    {
+        "title": "Ny McKinsey-rapport: 73% stigning i AI-relaterede GDPR-klager i 2025 - compliance-markedet vokser med 340%",
+        "source": "Legal Tech News",
+        "type": "compliance",
+        "priority": "medium",
+        "timestamp": "2025-09-25T10:20:00Z"
+    },
+    {
+        "title": "Tyskland lancerer 'AI-Passport' - national godkendelsesportal for AI-systemer går live",
+        "source": "Bundesregierung",
+        "type": "ai",
+        "priority": "medium",
+        "timestamp": "2025-09-25T09:20:00Z"
+    },
+    {
+        "title": "Google DeepMind offentliggør 'Responsible AI Toolkit' - open source compliance værktøjer",
+        "source": "AI Research",
+        "type": "ai",
+        "priority": "low",
+        "timestamp": "2025-09-25T08:20:00Z"
+    },
+    {
+        "title": "Frankrig skærper AI Act håndhævelse: Første bøder på 35 mio. EUR til tech-giganter",
+        "source": "CNIL",
+        "type": "legal",
+        "priority": "high",
+        "timestamp": "2025-09-25T07:20:00Z"
+    },
+    {
+        "title": "Stanford Law School: Ny analyse af AI Act implementering viser manglende klarhed i 34% af artiklerne",
+        "source": "Stanford AI Law",
+        "type": "legal",
+        "priority": "medium",
+        "timestamp": "2025-09-25T06:20:00Z"
+    },
+    {
+        "title": "Danske virksomheder: 89% mangler stadig AI governance - kun 11% har implementeret fuld compliance",
+        "source": "DI Digital",
+        "type": "compliance",
+        "priority": "medium",
+        "timestamp": "2025-09-25T05:20:00Z"
+    }
+]
+
+@app.on_event("startup")
+async def start_news_ingestion():
+    news_ingestor.seed(SEED_NEWS)
+    if news_ingestor.sources:
+        task = asyncio.ensure_future(news_ingestor.run())
+        background_tasks.add(task)
+        task.add_done_callback(background_tasks.discard)
+
 @app.get("/api/news/live")
-async def get_live_news():
-    live_news = [
-        {
-            "id": "1",
-            "title": "BREAKING: EU AI Office udgiver omfattende retningslinjer for højrisiko AI-systemer i finanssektoren",
-            "source": "Europa-Kommissionen",
-            "time": "Live",
-            "type": "ai",
-            "priority": "high",
-            "timestamp": "2025-09-25T14:20:00Z"
-        },
-        {
-            "id": "2",
-            "title": "Datatilsynet: Ny DPIA-skabelon for AI-systemer med persondata - obligatorisk fra 1. januar 2026",
-            "source": "Datatilsynet",
-            "time": "8 min",
-            "type": "gdpr",
-            "priority": "high",
-            "timestamp": "2025-09-25T14:12:00Z"
-        },
-        {
-            "id": "3",
-            "title": "Højesteret: Historisk afgørelse om AI-bias i ansættelsesprocesser - virksomhed idømt bøde på 2,5 mio. kr.",
-            "source": "Domstolene",
-            "time": "42 min",
-            "type": "legal",
-            "priority": "high",
-            "timestamp": "2025-09-25T13:38:00Z"
-        },
-        {
-            "id": "4",
-            "title": "OpenAI lancerer ChatGPT Enterprise Compliance Suite med indbygget GDPR og AI Act værktøjer",
-            "source": "TechCrunch",
-            "time": "1 t",
-            "type": "ai",
-            "priority": "medium",
-            "timestamp": "2025-09-25T13:20:00Z"
-        },
-        {
-            "id": "5",
-            "title": "EDPB vedtager bindende retningslinjer: Alle AI-systemer med automatiserede beslutninger skal have DPIA",
-            "source": "EDPB",
-            "time": "2 t",
-            "type": "gdpr",
-            "priority": "high",
-            "timestamp": "2025-09-25T12:20:00Z"
-        },
-        {
-            "id": "6",
-            "title": "Microsoft annoncerer Azure AI Compliance Center - automatisk overholdelse af EU AI Act",
-            "source": "Microsoft",
-            "time": "3 t",
-            "type": "compliance",
-            "priority": "medium",
-            "timestamp": "2025-09-25T11:20:00Z"
-        },
-        {
-            "id": "7",
-            "title": "Ny McKinsey-rapport: 73% stigning i AI-relaterede GDPR-klager i 2025 - compliance-markedet vokser med 340%",
-            "source": "Legal Tech News",
-            "time": "4 t",
-            "type": "compliance",
-            "priority": "medium",
-            "timestamp": "2025-09-25T10:20:00Z"
-        },
-        {
-            "id": "8",
-            "title": "Tyskland lancerer 'AI-Passport' - national godkendelsesportal for AI-systemer går live",
-            "source": "Bundesregierung",
-            "time": "5 t",
-            "type": "ai",
-            "priority": "medium",
-            "timestamp": "2025-09-25T09:20:00Z"
-        },
-        {
-            "id": "9",
-            "title": "Google DeepMind offentliggør 'Responsible AI Toolkit' - open source compliance værktøjer",
-            "source": "AI Research",
-            "time": "6 t",
-            "type": "ai",
-            "priority": "low",
-            "timestamp": "2025-09-25T08:20:00Z"
-        },
-        {
-            "id": "10",
-            "title": "Frankrig skærper AI Act håndhævelse: Første bøder på 35 mio. EUR til tech-giganter",
-            "source": "CNIL",
-            "time": "7 t",
-            "type": "legal",
-            "priority": "high",
-            "timestamp": "2025-09-25T07:20:00Z"
-        },
-        {
-            "id": "11",
-            "title": "Stanford Law School: Ny analyse af AI Act implementering viser manglende klarhed i 34% af artiklerne",
-            "source": "Stanford AI Law",
-            "time": "8 t",
-            "type": "legal",
-            "priority": "medium",
-            "timestamp": "2025-09-25T06:20:00Z"
-        },
-        {
-            "id": "12",
-            "title": "Danske virksomheder: 89% mangler stadig AI governance - kun 11% har implementeret fuld compliance",
-            "source": "DI Digital",
-            "time": "9 t",
-            "type": "compliance",
-            "priority": "medium",
-            "timestamp": "2025-09-25T05:20:00Z"
-        }
-    ]
+@micro_cache.coalesce()
+async def get_live_news(limit: int = 50):
+    live_news = news_ingestor.latest(max(1, min(limit, 200)))
     return {"news": live_news, "total": len(live_news), "last_updated": datetime.datetime.now().isoformat()}
 
+@app.get("/api/admin/news/sources")
+async def get_news_sources(current_user: dict = Depends(require_admin)):
+    """Per-feed poll state (validators, backoff, last error) and ingestion counters"""
+    return news_ingestor.stats()
+
 # Enhanced Dashboard Endpoints for v1.0.0
 
 @app.get("/api/dashboard/metrics")
-async def get_live_dashboard_metrics():
+@micro_cache.coalesce()
+async def get_live_dashboard_metrics(tenant: Tenant = Depends(get_tenant),
+                                     fields: Optional[FieldTree] = Depends(requested_fields)):
     """Get real-time dashboard metrics"""
 
+    if tenant.key != DEFAULT_TENANT:
+        return project({**tenant.metrics.summary(), "last_updated": datetime.datetime.now().isoformat()}, fields)
+
     # Calculate dynamic metrics based on current time
     current_hour = datetime.datetime.now().hour
     variance = (current_hour % 24) * 0.05  # Small variance based on time
 
-    return {
+    return project({
         "total_assessments": 127 + int(variance * 20),
         "completed_assessments": 98 + int(variance * 15),
         "pending_assessments": 29 + int(variance * 5),
@@ -454,47 +1184,40 @@ async def get_live_dashboard_metrics():
         "monthly_growth": round(23.5 + (variance * 5), 1),
         "active_users": 45 + int(variance * 8),
         "last_updated": datetime.datetime.now().isoformat()
-    }
+    }, fields)
+
+# Named ranges of the compliance history chart, in days ending today
+HISTORY_RANGES = {"last_7_days": 7, "last_30_days": 30, "last_90_days": 90, "last_year": 365}
 
 @app.get("/api/dashboard/compliance-history")
-async def get_compliance_history(range: str = "last_30_days"):
-    """Get compliance history for specified time range"""
-
-    if range == "last_7_days":
-        data_points = 7
-        base_values = [92, 93, 94, 95, 94, 96, 97]
-    elif range == "last_30_days":
-        data_points = 30
-        base_values = [90 + i * 0.2 + (i % 3) for i in range(30)]
-    elif range == "last_90_days":
-        data_points = 90
-        base_values = [85 + i * 0.1 + (i % 7) * 0.5 for i in range(90)]
-    else:  # last_year
-        data_points = 365
-        base_values = [80 + i * 0.05 + (i % 30) * 0.3 for i in range(365)]
-
-    metrics = []
-    for i, value in enumerate(base_values):
-        date = datetime.datetime.now() - datetime.timedelta(days=data_points - i - 1)
-        metrics.append({
-            "date": date.isoformat(),
-            "compliance_rate": round(min(100, max(80, value)), 1),
-            "assessments_completed": max(0, int(value / 10) + (i % 3)),
-            "risk_score": round(100 - value + (i % 5), 1)
-        })
+@micro_cache.coalesce()
+async def get_compliance_history(time_range: str = Query("last_30_days", alias="range"),
+                                 from_date: Optional[datetime.date] = Query(None, alias="from"),
+                                 to_date: Optional[datetime.date] = Query(None, alias="to"),
+                                 granularity: Optional[str] = None, tenant: Tenant = Depends(get_tenant),
+                                 fields: Optional[FieldTree] = Depends(requested_fields)):
+    """Compliance history from the tenant's daily/weekly/monthly rollups; from/to override range"""
+    today = datetime.date.today()
+    if from_date is None:
+        if time_range not in HISTORY_RANGES:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"range must be one of {', '.join(HISTORY_RANGES)}, or give from/to"
+            )
+        to_date = to_date or today
+        from_date = to_date - datetime.timedelta(days=HISTORY_RANGES[time_range] - 1)
+    else:
+        time_range = "custom"
+    try:
+        history = tenant.rollups.query(from_date, to_date or today, granularity)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
 
-    return {
-        "metrics": metrics,
-        "timeRange": range,
-        "summary": {
-            "average_compliance": round(sum(m["compliance_rate"] for m in metrics) / len(metrics), 1),
-            "trend": "increasing" if metrics[-1]["compliance_rate"] > metrics[0]["compliance_rate"] else "decreasing",
-            "total_assessments": sum(m["assessments_completed"] for m in metrics)
-        }
-    }
+    return project({**history, "timeRange": time_range}, fields)
 
 @app.get("/api/dashboard/system-types")
-async def get_system_type_distribution():
+@micro_cache.coalesce()
+async def get_system_type_distribution(fields: Optional[FieldTree] = Depends(requested_fields)):
     """Get current distribution of AI system types"""
 
     # Add some dynamic variation
@@ -515,16 +1238,35 @@ async def get_system_type_distribution():
     for item in distribution:
         item["percentage"] = round((item["count"] / total) * 100, 1)
 
-    return {
+    return project({
         "distribution": distribution,
         "total_systems": total,
         "last_updated": datetime.datetime.now().isoformat()
-    }
+    }, fields)
 
 @app.get("/api/dashboard/risk-distribution")
-async def get_risk_distribution():
+@micro_cache.coalesce()
+async def get_risk_distribution(tenant: Tenant = Depends(get_tenant),
+                                fields: Optional[FieldTree] = Depends(requested_fields)):
     """Get current risk level distribution"""
 
+    if tenant.key != DEFAULT_TENANT:
+        bands = tenant.metrics.risk_bands
+        total = tenant.metrics.total
+        distribution = [
+            {"level": "Lav Risiko (0-39)", "count": bands["low"], "color": "bg-green-500"},
+            {"level": "Middel Risiko (40-69)", "count": bands["medium"], "color": "bg-yellow-500"},
+            {"level": "Høj Risiko (70-100)", "count": bands["high"], "color": "bg-red-500"}
+        ]
+        for item in distribution:
+            item["percentage"] = round((item["count"] / total) * 100, 1) if total else 0.0
+        return project({
+            "distribution": distribution,
+            "total_systems": total,
+            "risk_summary": {"low_risk": bands["low"], "medium_risk": bands["medium"], "high_risk": bands["high"]},
+            "last_updated": datetime.datetime.now().isoformat()
+        }, fields)
+
     # Add dynamic variation
     current_second = datetime.datetime.now().second
     variance = current_second % 15
@@ -555,7 +1297,7 @@ async def get_risk_distribution():
     for item in distribution:
         item["percentage"] = round((item["count"] / total) * 100, 1)
 
-    return {
+    return project({
         "distribution": distribution,
         "total_systems": total,
         "risk_summary": {
@@ -564,16 +1306,28 @@ async def get_risk_distribution():
             "high_risk": distribution[2]["count"]
         },
         "last_updated": datetime.datetime.now().isoformat()
-    }
+    }, fields)
 
 @app.get("/api/dashboard/activity")
-async def get_recent_activity(limit: int = 10):
+@micro_cache.coalesce()
+async def get_recent_activity(limit: int = 10, tenant: Tenant = Depends(get_tenant),
+                              fields: Optional[FieldTree] = Depends(requested_fields)):
     """Get recent platform activity with live updates"""
 
+    if tenant.key != DEFAULT_TENANT:
+        # One more than asked for tells whether there is more
+        activities = recent_activity(tenant, limit + 1)
+        return project({
+            "activities": activities[:limit],
+            "total": min(limit, len(activities)),
+            "has_more": len(activities) > limit,
+            "last_updated": datetime.datetime.now().isoformat()
+        }, fields)
+
     # Enhanced activity data with more variety
     activity_types = [
         {
-            "id": f"ACT-{datetime.datetime.now().strftime('%H%M%S')}-001",
+            "id": new_id(ACTIVITY_PREFIX),
             "type": "assessment_completed",
             "title": "AI Chatbot System - Compliance Godkendt",
             "description": "Færdig compliance vurdering med lav risiko score på 28 point",
@@ -583,7 +1337,7 @@ async def get_recent_activity(limit: int = 10):
             "riskScore": 28,
         },
         {
-            "id": f"ACT-{datetime.datetime.now().strftime('%H%M%S')}-002",
+            "id": new_id(ACTIVITY_PREFIX),
             "type": "assessment_created",
             "title": "Ny vurdering startet - Predictive Maintenance AI",
             "description": "Avanceret predictive maintenance system til produktion",
@@ -593,7 +1347,7 @@ async def get_recent_activity(limit: int = 10):
             "riskScore": None,
         },
         {
-            "id": f"ACT-{datetime.datetime.now().strftime('%H%M%S')}-003",
+            "id": new_id(ACTIVITY_PREFIX),
             "type": "compliance_updated",
             "title": "EU AI Act Opdatering Implementeret",
             "description": "Automatisk opdatering af compliance krav baseret på nye retningslinjer",
@@ -603,7 +1357,7 @@ async def get_recent_activity(limit: int = 10):
             "riskScore": None,
         },
         {
-            "id": f"ACT-{datetime.datetime.now().strftime('%H%M%S')}-004",
+            "id": new_id(ACTIVITY_PREFIX),
             "type": "quick_check",
             "title": "Hurtig tjek gennemført - Document AI Scanner",
             "description": "Lavrisiko system identificeret, ingen fuld vurdering nødvendig",
@@ -613,7 +1367,7 @@ async def get_recent_activity(limit: int = 10):
             "riskScore": 15,
         },
         {
-            "id": f"ACT-{datetime.datetime.now().strftime('%H%M%S')}-005",
+            "id": new_id(ACTIVITY_PREFIX),
             "type": "assessment_completed",
             "title": "HR Recruitment AI - DPIA Påkrævet",
             "description": "Højrisiko system kræver omfattende databeskyttelsesanalyse",
@@ -623,7 +1377,7 @@ async def get_recent_activity(limit: int = 10):
             "riskScore": 78,
         },
         {
-            "id": f"ACT-{datetime.datetime.now().strftime('%H%M%S')}-006",
+            "id": new_id(ACTIVITY_PREFIX),
             "type": "compliance_updated",
             "title": "Datatilsynet Vejledning Integreret",
             "description": "Ny DPIA skabelon automatisk tilgængelig i systemet",
@@ -633,7 +1387,7 @@ async def get_recent_activity(limit: int = 10):
             "riskScore": None,
         },
         {
-            "id": f"ACT-{datetime.datetime.now().strftime('%H%M%S')}-007",
+            "id": new_id(ACTIVITY_PREFIX),
             "type": "quick_check",
             "title": "Financial Risk AI - Betinget Godkendelse",
             "description": "Middel risiko system kræver yderligere compliance tiltag",
@@ -643,7 +1397,7 @@ async def get_recent_activity(limit: int = 10):
             "riskScore": 55,
         },
         {
-            "id": f"ACT-{datetime.datetime.now().strftime('%H%M%S')}-008",
+            "id": new_id(ACTIVITY_PREFIX),
             "type": "assessment_created",
             "title": "Computer Vision System - Vurdering Påbegyndt",
             "description": "Ansigtsgenkendelses system til adgangskontrol",
@@ -661,42 +1415,50 @@ async def get_recent_activity(limit: int = 10):
     # Return limited results
     limited_activities = activity_types[:limit]
 
-    return {
+    return project({
         "activities": limited_activities,
         "total": len(limited_activities),
         "has_more": len(activity_types) > limit,
         "last_updated": datetime.datetime.now().isoformat()
-    }
+    }, fields)
 
 # Enhanced 7-punkts assessment endpoint with rules engine
-@app.post("/api/compliance/7-punkts-vurdering")
-async def seven_points_assessment(request: Dict[str, Any]):
+SEVEN_POINT_KEY_FIELDS = ("beskrivelse", "ai_system_type", "rolle")
+
+async def seven_point_input(request: Request) -> Optional[Dict[str, Any]]:
+    """Decoded detailed assessment, or None for the basic assessment when a key field is missing"""
+    body = await request.body()
+    try:
+        return detailed_input.decode(body)
+    except ValidationError as e:
+        errors = e.errors(include_url=False)
+        if any(error["type"] == "missing" and error["loc"][0] in SEVEN_POINT_KEY_FIELDS for error in errors):
+            return None
+        raise RequestValidationError(validation_errors(e), body=body)
+
+@app.post("/api/compliance/7-punkts-vurdering", openapi_extra={"requestBody": {
+    "required": True, "content": {"application/json": {"schema": {"type": "object"}}}}})
+async def seven_points_assessment(request: Request, decoded: Optional[Dict[str, Any]] = Depends(seven_point_input),
+                                  tenant: Tenant = Depends(rate_limited_tenant),
+                                  current_user: Optional[dict] = Depends(get_optional_user),
+                                  fields: Optional[FieldTree] = Depends(requested_fields)):
     # Use detailed assessment if available
-    if all(key in request for key in ["beskrivelse", "ai_system_type", "rolle"]):
-        detailed_request = DetailedAssessmentRequest(**request)
-        user_responses = {
-            "description": detailed_request.beskrivelse,
-            "ai_system_type": detailed_request.ai_system_type,
-            "role": detailed_request.rolle,
-            "branch_sector": detailed_request.branch_sector,
-            "handles_personal_data": detailed_request.handles_personal_data,
-            "data_types": detailed_request.data_types,
-            "automated_decisions": detailed_request.automated_decisions,
-            "decision_type": detailed_request.decision_type,
-            "decision_impact": detailed_request.decision_impact
-        }
+    if decoded is not None:
+        system_name, _, user_responses = split_detailed_input(decoded)
 
-        assessment_result = rules_engine.evaluate_system(user_responses)
-        ai_classification = rules_engine._classify_ai_system(user_responses)
+        assessment_result, ai_classification, evaluation_reads = evaluate_for_tenant(tenant, user_responses)
 
-        # Generate wizard steps based on classification
-        wizard_steps = rules_engine.get_assessment_wizard_steps(ai_classification)
+        sig = assessment_signature(system_name, user_responses)
+        vurdering_id = new_id("assessment_")
+        await audit_durable(store_assessment(tenant, vurdering_id, system_name, user_responses,
+                                             assessment_result, ai_classification, evaluation_reads, current_user, sig))
 
-        return {
+        # Wizard steps, the detailed breakdown and similar systems are only built if requested
+        return project({
             "success": True,
             "vurdering_type": "7-punkts struktureret AI-vurdering (Regelbaseret)",
-            "system_navn": request.get("system_navn", detailed_request.system_navn),
-            "vurdering_id": f"assessment_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}",
+            "system_navn": system_name,
+            "vurdering_id": vurdering_id,
             "ai_klassifikation": ai_classification.upper(),
             "samlet_vurdering": {
                 "risikoniveau": assessment_result.risk_level.lower(),
@@ -706,7 +1468,7 @@ async def seven_points_assessment(request: Dict[str, Any]):
                 "kræver_dpia": "DPIA" in assessment_result.required_assessments,
                 "kræver_fria": "FRIA" in assessment_result.required_assessments
             },
-            "detaljeret_vurdering": {
+            "detaljeret_vurdering": Lazy(lambda: {
                 "trin_1_ai_system": {"score": 10 if ai_classification != "unacceptable" else 0, "status": "completed", "titel": "AI-system klassifikation"},
                 "trin_2_persondata": {"score": 8 if assessment_result.assessment_details.get("personal_data") else 10, "status": "completed", "titel": "Persondata behandling"},
                 "trin_3_gdpr": {"score": 9 if "DPIA" in assessment_result.required_assessments else 7, "status": "completed", "titel": "GDPR compliance"},
@@ -714,30 +1476,47 @@ async def seven_points_assessment(request: Dict[str, Any]):
                 "trin_5_training": {"score": 8, "status": "completed", "titel": "Træning og validering"},
                 "trin_6_resources": {"score": 7, "status": "completed", "titel": "Ressourcer og kompetencer"},
                 "trin_7_requirements": {"score": 9, "status": "completed", "titel": "Opfyldelse af krav"}
-            },
-            "handlingsplan": {
+            }),
+            "handlingsplan": Lazy(lambda: {
                 "påkrævede_krav": assessment_result.requirements,
                 "prioriterede_handlinger": assessment_result.next_steps[:3],
                 "anbefalinger": assessment_result.recommendations[:3],
                 "juridiske_referencer": assessment_result.legal_references,
                 "næste_skridt": assessment_result.next_steps[3:] if len(assessment_result.next_steps) > 3 else ["Implementér compliance plan"]
-            },
-            "wizard_steps": wizard_steps,
-            "assessment_details": assessment_result.assessment_details
-        }
+            }),
+            "wizard_steps": Lazy(lambda: rules_engine.get_assessment_wizard_steps(ai_classification)),
+            "assessment_details": assessment_result.assessment_details,
+            "lignende_vurderinger": Lazy(lambda: find_similar(tenant, system_name, user_responses,
+                                                              exclude=vurdering_id, sig=sig)[1])
+        }, fields)
     else:
-        # Fallback to basic assessment
-        return {
+        # Fallback to basic assessment; only this path parses the (already read) body again
+        partial = json.loads(await request.body())
+        return project({
             "success": True,
             "vurdering_type": "7-punkts struktureret AI-vurdering (Basis)",
-            "system_navn": request.get("system_navn", "Dit AI System"),
-            "vurdering_id": f"assessment_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}",
+            "system_navn": partial.get("system_navn", "Dit AI System"),
+            "vurdering_id": new_id("assessment_"),
             "besked": "For en detaljeret vurdering, send venligst alle påkrævede felter",
             "påkrævede_felter": ["system_navn", "beskrivelse", "ai_system_type", "rolle", "branch_sector", "handles_personal_data", "data_types", "automated_decisions", "decision_type", "decision_impact"]
-        }
+        }, fields)
+
+# Precomputed decision table for offline quick checks
+@app.get("/api/compliance/decision-table")
+async def get_decision_table(request: Request):
+    """Download the full quick check decision table for client-side evaluation"""
+    etag = decision_table.etag
+    headers = {"ETag": etag, "Cache-Control": "public, max-age=0, must-revalidate"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    table, body = await run_in_threadpool(decision_table.get)
+    headers["ETag"] = table["etag"]
+    return Response(content=body, media_type="application/json", headers=headers)
 
 # New assessment wizard endpoint
 @app.get("/api/compliance/assessment-wizard/{classification}")
+@micro_cache.coalesce()
 async def get_assessment_wizard(classification: str):
     """Get structured assessment wizard steps"""
     wizard_steps = rules_engine.get_assessment_wizard_steps(classification)
@@ -748,28 +1527,137 @@ async def get_assessment_wizard(classification: str):
         total_steps=len(wizard_steps)
     )
 
-# New detailed assessment endpoint
-@app.post("/api/compliance/detailed-assessment")
-async def detailed_assessment(request: DetailedAssessmentRequest):
-    """Comprehensive AI compliance assessment"""
-    user_responses = {
-        "description": request.beskrivelse,
-        "ai_system_type": request.ai_system_type,
-        "role": request.rolle,
-        "branch_sector": request.branch_sector,
-        "handles_personal_data": request.handles_personal_data,
-        "data_types": request.data_types,
-        "automated_decisions": request.automated_decisions,
-        "decision_type": request.decision_type,
-        "decision_impact": request.decision_impact
+# Server-side wizard sessions with live provisional results
+ENGINE_TO_REQUEST_FIELD = {engine_key: field for field, engine_key in ENGINE_FIELD_MAP.items()}
+
+def wizard_session_response(session: Dict[str, Any], reevaluated: List[str], started: float,
+                            include_steps: bool) -> Dict[str, Any]:
+    response = {
+        "session_id": session["id"],
+        "system_navn": session["system_name"],
+        "ai_klassifikation": session["classification"].upper(),
+        "provisional": session["provisional"],
+        "answered_steps": session["answered_steps"],
+        "missing_fields": [ENGINE_TO_REQUEST_FIELD[key]
+                           for key in wizard_sessions.missing_fields(session, ENGINE_TO_REQUEST_FIELD)],
+        "reevaluated": reevaluated,
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 2),
+        "expires_at": datetime.datetime.fromtimestamp(session["expires_at"]).isoformat()
     }
+    if include_steps:
+        wizard_steps = rules_engine.get_assessment_wizard_steps(session["classification"])
+        response["steps"] = wizard_steps
+        response["total_steps"] = len(wizard_steps)
+    return response
+
+@app.post("/api/compliance/assessment-wizard/sessions")
+async def create_wizard_session(request: WizardSessionCreate, tenant: Tenant = Depends(rate_limited_tenant),
+                                current_user: Optional[dict] = Depends(get_optional_user)):
+    """Start a server-side wizard session"""
+    started = time.perf_counter()
+    answers = validate_wizard_answers(request.answers or {})
+    session = wizard_sessions.create(tenant.key, request.system_navn, answers, session_owner(current_user))
+    return wizard_session_response(session, ["classification", "evaluation"], started, include_steps=True)
+
+def session_owner(current_user: Optional[dict]) -> Optional[str]:
+    return current_user["email"] if current_user else None
+
+@app.get("/api/compliance/assessment-wizard/sessions/{session_id}")
+async def get_wizard_session(session_id: str, tenant: Tenant = Depends(get_tenant),
+                             current_user: Optional[dict] = Depends(get_optional_user)):
+    started = time.perf_counter()
+    session = wizard_sessions.get(tenant.key, session_id, session_owner(current_user))
+    if session is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Wizard session not found")
+    return wizard_session_response(session, [], started, include_steps=True)
+
+@app.post("/api/compliance/assessment-wizard/sessions/{session_id}/answers")
+async def answer_wizard_step(session_id: str, request: WizardAnswer, tenant: Tenant = Depends(rate_limited_tenant),
+                             current_user: Optional[dict] = Depends(get_optional_user)):
+    """Record answers for a step and return the updated provisional result"""
+    started = time.perf_counter()
+    answers = validate_wizard_answers(request.answers)
+    owner = session_owner(current_user)
+    previous = wizard_sessions.get(tenant.key, session_id, owner)
+    session, reevaluated = wizard_sessions.answer(tenant.key, session_id, owner, answers, request.step)
+    if session is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Wizard session not found")
+    classification_changed = previous["classification"] != session["classification"]
+    return wizard_session_response(session, reevaluated, started, include_steps=classification_changed)
+
+@app.post("/api/compliance/assessment-wizard/sessions/{session_id}/complete")
+async def complete_wizard_session(session_id: str, tenant: Tenant = Depends(rate_limited_tenant),
+                                  current_user: Optional[dict] = Depends(get_optional_user)):
+    """Finalise a wizard session into a stored assessment"""
+    session = wizard_sessions.get(tenant.key, session_id, session_owner(current_user))
+    if session is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Wizard session not found")
+    missing = wizard_sessions.missing_fields(session, ENGINE_TO_REQUEST_FIELD)
+    if missing:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail={"message": "Wizard session is incomplete",
+                    "missing_fields": [ENGINE_TO_REQUEST_FIELD[key] for key in missing]}
+        )
 
-    assessment_result = rules_engine.evaluate_system(user_responses)
-    ai_classification = rules_engine._classify_ai_system(user_responses)
+    user_responses = wizard_sessions.responses(session)
+    assessment_result, ai_classification, evaluation_reads = evaluate_for_tenant(tenant, user_responses)
+    vurdering_id = new_id("assessment_")
+    ticket = store_assessment(tenant, vurdering_id, session["system_name"], user_responses,
+                              assessment_result, ai_classification, evaluation_reads, current_user)
+    wizard_sessions.delete(tenant.key, session_id)
+    await audit_durable(ticket)
 
     return {
-        "assessment_id": f"detailed_assessment_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}",
-        "system_name": request.system_navn,
+        "success": True,
+        "vurdering_id": vurdering_id,
+        "system_navn": session["system_name"],
+        "ai_klassifikation": ai_classification.upper(),
+        "samlet_vurdering": {
+            "risikoniveau": assessment_result.risk_level.lower(),
+            "compliance_score": assessment_result.risk_score,
+            "beslutning": assessment_result.decision,
+            "compliance_status": assessment_result.compliance_status,
+            "kræver_dpia": "DPIA" in assessment_result.required_assessments,
+            "kræver_fria": "FRIA" in assessment_result.required_assessments
+        }
+    }
+
+# New detailed assessment endpoint
+@app.post("/api/compliance/detailed-assessment", openapi_extra=detailed_input.openapi_extra)
+async def detailed_assessment(decoded: Dict[str, Any] = Depends(detailed_input),
+                              tenant: Tenant = Depends(rate_limited_tenant),
+                              current_user: Optional[dict] = Depends(get_optional_user),
+                              fields: Optional[FieldTree] = Depends(requested_fields)):
+    """Comprehensive AI compliance assessment"""
+    system_name, reuse_assessment_id, user_responses = split_detailed_input(decoded)
+    if reuse_assessment_id:
+        # The caller confirmed this is an already assessed system: no new inventory entry
+        if current_user is None:
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Log in to reuse an assessment")
+        prior = tenant.assessments.get(reuse_assessment_id)
+        if prior is None or not prior.get("user_responses"):
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Assessment to reuse not found")
+        assessment_id, system_name, user_responses = prior["id"], prior["name"], prior["user_responses"]
+        assessment_result, ai_classification, _ = evaluate_for_tenant(tenant, user_responses)
+        ticket = audit_decision(tenant, assessment_id, user_responses, assessment_result, ai_classification,
+                                current_user, reuses=assessment_id)
+        similar = []
+    else:
+        assessment_result, ai_classification, evaluation_reads = evaluate_for_tenant(tenant, user_responses)
+        sig = assessment_signature(system_name, user_responses)
+
+        assessment_id = new_id("assessment_")
+        ticket = store_assessment(tenant, assessment_id, system_name, user_responses,
+                                  assessment_result, ai_classification, evaluation_reads, current_user, sig)
+        similar = Lazy(lambda: find_similar(tenant, system_name, user_responses, exclude=assessment_id, sig=sig)[1])
+    await audit_durable(ticket)
+
+    return project({
+        "assessment_id": assessment_id,
+        "system_name": system_name,
+        "reused": bool(reuse_assessment_id),
+        "similar_assessments": similar,
         "ai_classification": ai_classification,
         "timestamp": datetime.datetime.now().isoformat(),
         "result": {
@@ -785,13 +1673,61 @@ async def detailed_assessment(request: DetailedAssessmentRequest):
         },
         "assessment_details": assessment_result.assessment_details,
         "wizard_available": True
-    }
+    }, fields)
+
+@app.post("/api/compliance/similar", openapi_extra=detailed_input.openapi_extra)
+async def similar_assessments(decoded: Dict[str, Any] = Depends(detailed_input), tenant: Tenant = Depends(get_tenant)):
+    """Stored assessments that look like the same system, checked before submitting"""
+    system_name, _, user_responses = split_detailed_input(decoded)
+    _, similar = find_similar(tenant, system_name, user_responses)
+    return {"similar_assessments": similar, "total": len(similar)}
+
+@app.get("/api/assessments/{assessment_id}/similar")
+async def get_similar_assessments(assessment_id: str, tenant: Tenant = Depends(get_tenant)):
+    assessment = tenant.assessments.get(assessment_id)
+    if assessment is None or not assessment.get("user_responses"):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Assessment not found")
+    _, similar = find_similar(tenant, assessment["name"], assessment["user_responses"], exclude=assessment_id)
+    return {"similar_assessments": similar, "total": len(similar)}
+
+# What-if sensitivity analysis endpoint
+@app.post("/api/compliance/what-if")
+async def what_if_analysis(request: WhatIfRequest, current_user: dict = Depends(get_current_user)):
+    """Evaluate field variations of a detailed assessment in one call"""
+    enforce_rate_limit("what_if", tenants.get(current_user.get("organization_id")).key, current_user["email"])
+    try:
+        combinations = expand_variations(request.variations, request.grid)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+    def analyse() -> bytes:
+        base_fields = request.base.model_dump()
+        variations = []
+        for changes in combinations:
+            try:
+                variant = DetailedAssessmentRequest(**{**base_fields, **changes})
+            except ValidationError as e:
+                raise HTTPException(
+                    status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                    detail={"changes": changes, "errors": json.loads(e.json(include_url=False))}
+                )
+            variations.append((changes, detailed_to_user_responses(variant)))
+        analysis = run_sensitivity(rules_engine, detailed_to_user_responses(request.base), variations,
+                                   description_analyzer)
+        return json.dumps({
+            "system_name": request.base.system_navn,
+            "timestamp": datetime.datetime.now().isoformat(),
+            **analysis
+        }, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+    # Up to MAX_COMBINATIONS validations and evaluations, and a response to match; keep all of it off the event loop
+    return Response(content=await run_in_threadpool(analyse), media_type="application/json")
 
 # DPIA and FRIA Assessment Templates
 @app.get("/api/templates/dpia")
-async def get_dpia_template():
+async def get_dpia_template(fields: Optional[FieldTree] = Depends(requested_fields)):
     """Get DPIA (Data Protection Impact Assessment) template based on Danish requirements"""
-    return {
+    return project({
         "template_name": "Konsekvensanalyse vedrørende databeskyttelse (DPIA) i AI-projekter",
         "version": "1.0",
         "legal_basis": ["GDPR artikel 35", "AI-forordningens artikel 26.9"],
@@ -945,12 +1881,12 @@ async def get_dpia_template():
                 ]
             }
         }
-    }
+    }, fields)
 
 @app.get("/api/templates/fria")
-async def get_fria_template():
+async def get_fria_template(fields: Optional[FieldTree] = Depends(requested_fields)):
     """Get FRIA (Fundamental Rights Impact Assessment) template based on AI Act requirements"""
-    return {
+    return project({
         "template_name": "Fundamental Rights Impact Assessment (FRIA) i AI-projekter",
         "version": "1.0",
         "legal_basis": ["AI-forordningens artikel 27"],
@@ -1119,14 +2055,15 @@ async def get_fria_template():
                 ]
             }
         }
-    }
+    }, fields)
 
 @app.post("/api/templates/dpia/generate")
-async def generate_dpia_report(assessment_data: Dict[str, Any]):
+async def generate_dpia_report(assessment_data: Dict[str, Any], tenant: Tenant = Depends(get_tenant),
+                               current_user: Optional[dict] = Depends(get_optional_user)):
     """Generate a DPIA report based on assessment data"""
-    assessment_id = assessment_data.get("assessment_id", f"dpia_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}")
+    assessment_id = assessment_data.get("assessment_id", new_id("dpia_"))
 
-    return {
+    report = {
         "report_id": assessment_id,
         "report_type": "DPIA",
         "generated_at": datetime.datetime.now().isoformat(),
@@ -1176,13 +2113,16 @@ async def generate_dpia_report(assessment_data: Dict[str, Any]):
         ],
         "completion_percentage": 10
     }
+    audit_report(tenant, report, current_user)
+    return report
 
 @app.post("/api/templates/fria/generate")
-async def generate_fria_report(assessment_data: Dict[str, Any]):
+async def generate_fria_report(assessment_data: Dict[str, Any], tenant: Tenant = Depends(get_tenant),
+                               current_user: Optional[dict] = Depends(get_optional_user)):
     """Generate a FRIA report based on assessment data"""
-    assessment_id = assessment_data.get("assessment_id", f"fria_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}")
+    assessment_id = assessment_data.get("assessment_id", new_id("fria_"))
 
-    return {
+    report = {
         "report_id": assessment_id,
         "report_type": "FRIA",
         "generated_at": datetime.datetime.now().isoformat(),
@@ -1252,53 +2192,49 @@ async def generate_fria_report(assessment_data: Dict[str, Any]):
         ],
         "completion_percentage": 5
     }
+    audit_report(tenant, report, current_user)
+    return report
 
 # Authentication Endpoints
 
 @app.post("/api/auth/register", response_model=Token)
-async def register_user(user_data: UserCreate):
-    """Register a new user"""
+async def register_user(user_data: UserCreate, request: Request):
+    """Register a new user, in a new organisation or, with an invite code, in the inviting one"""
+    enforce_rate_limit("auth", client_ip(request), str(user_data.email))
+
     # Check if user already exists
-    if user_data.email in users_db:
+    if str(user_data.email) in users_db:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="User with this email already exists"
         )
 
+    # Membership of an existing organisation needs an invite; a typed name only ever founds a new one
+    if user_data.invite_code:
+        try:
+            organization = organizations.redeem(user_data.invite_code, str(user_data.email))
+        except InviteError as e:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    else:
+        organization = organizations.create(user_data.organization)
+
     # Create new user
-    user_id = str(len(users_db) + 1)
-    hashed_password = hash_password(user_data.password)
-
-    new_user = {
-        "id": user_id,
-        "email": str(user_data.email),
-        "first_name": user_data.first_name,
-        "last_name": user_data.last_name,
-        "organization": user_data.organization,
-        "role": "user",  # Default role for new users
-        "hashed_password": hashed_password,
-        "is_active": True,
-        "is_email_verified": False,  # Would require email verification in production
-        "created_at": datetime.datetime.now().isoformat(),
-        "preferences": {
-            "theme": "dark",
-            "language": "da",
-            "notifications": {
-                "email": True,
-                "push": True,
-                "assessment_reminders": True,
-                "compliance_updates": True
-            }
-        }
-    }
+    hashed_password = await run_in_threadpool(hash_password, user_data.password)
+    new_user = new_user_record(user_data.first_name, user_data.last_name, str(user_data.email),
+                               organization, hashed_password)
 
-    # Add to database
-    users_db[str(user_data.email)] = new_user
+    # Add to database; add() is atomic across workers
+    if not users_db.add(str(user_data.email), new_user):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="User with this email already exists"
+        )
 
-    # Create access token
+    # Create access token for a new login session
+    refresh, session_id = refresh_tokens.issue(str(user_data.email))
     access_token_expires = datetime.timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
-        data={"sub": str(user_data.email)}, expires_delta=access_token_expires
+        data={"sub": str(user_data.email)}, expires_delta=access_token_expires, session_id=session_id
     )
 
     # Create user response
@@ -1308,18 +2244,22 @@ async def register_user(user_data: UserCreate):
         first_name=new_user["first_name"],
         last_name=new_user["last_name"],
         organization=new_user["organization"],
+        organization_id=new_user["organization_id"],
         role=new_user["role"],
         is_email_verified=new_user["is_email_verified"],
         created_at=new_user["created_at"],
         preferences=new_user["preferences"]
     )
 
-    return Token(access_token=access_token, token_type="bearer", user=user_response)
+    return Token(access_token=access_token, token_type="bearer", user=user_response, refresh_token=refresh)
 
 @app.post("/api/auth/login", response_model=Token)
-async def login_user(user_credentials: UserLogin):
+async def login_user(user_credentials: UserLogin, request: Request):
     """Login user and return JWT token"""
-    user = authenticate_user(str(user_credentials.email), user_credentials.password)
+    enforce_rate_limit("auth", client_ip(request), str(user_credentials.email))
+
+    # Password hashing is deliberately slow; keep it off the event loop
+    user = await run_in_threadpool(authenticate_user, str(user_credentials.email), user_credentials.password)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -1327,14 +2267,18 @@ async def login_user(user_credentials: UserLogin):
             headers={"WWW-Authenticate": "Bearer"},
         )
 
-    # Create access token
+    # Create access token for a new login session
+    refresh, session_id = refresh_tokens.issue(str(user_credentials.email))
     access_token_expires = datetime.timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
-        data={"sub": str(user_credentials.email)}, expires_delta=access_token_expires
+        data={"sub": str(user_credentials.email)}, expires_delta=access_token_expires, session_id=session_id
     )
 
-    # Update last login
-    users_db[str(user_credentials.email)]["last_login"] = datetime.datetime.now().isoformat()
+    # Update last login (write back so other workers see it)
+    record_login(str(user_credentials.email))
+    # Hashes made under an older policy are replaced now that we have the password
+    if needs_rehash(user["hashed_password"], password_policy()):
+        schedule_rehash(str(user_credentials.email), user_credentials.password, user["hashed_password"])
 
     # Create user response
     user_response = UserResponse(
@@ -1343,13 +2287,14 @@ async def login_user(user_credentials: UserLogin):
         first_name=user["first_name"],
         last_name=user["last_name"],
         organization=user["organization"],
+        organization_id=user.get("organization_id"),
         role=user["role"],
         is_email_verified=user["is_email_verified"],
         created_at=user["created_at"],
         preferences=user["preferences"]
     )
 
-    return Token(access_token=access_token, token_type="bearer", user=user_response)
+    return Token(access_token=access_token, token_type="bearer", user=user_response, refresh_token=refresh)
 
 @app.get("/api/auth/me", response_model=UserResponse)
 async def get_current_user_info(current_user: dict = Depends(get_current_user)):
@@ -1360,6 +2305,7 @@ async def get_current_user_info(current_user: dict = Depends(get_current_user)):
         first_name=current_user["first_name"],
         last_name=current_user["last_name"],
         organization=current_user["organization"],
+        organization_id=current_user.get("organization_id"),
         role=current_user["role"],
         is_email_verified=current_user["is_email_verified"],
         created_at=current_user["created_at"],
@@ -1367,14 +2313,482 @@ async def get_current_user_info(current_user: dict = Depends(get_current_user)):
     )
 
 @app.post("/api/auth/refresh")
-async def refresh_token(current_user: dict = Depends(get_current_user)):
-    """Refresh JWT token"""
+async def refresh_token(request: RefreshRequest, http_request: Request):
+    """Exchange a refresh token for a new access token and a new refresh token; each refresh token works once"""
+    ip = client_ip(http_request)
+    # Every refusal happens before the token is used up, so the client can retry it
+    try:
+        email, session_id = refresh_tokens.lookup(request.refresh_token)
+    except TokenError as e:
+        enforce_rate_limit("auth", ip, f"ip:{ip}")
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail=str(e))
+    enforce_rate_limit("auth", ip, email)
+    user = users_db.get(email)
+    if user is None or not user.get("is_active", True):
+        refresh_tokens.revoke_session(session_id, "user removed or deactivated")
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="User is no longer active")
+    try:
+        email, session_id, refresh = refresh_tokens.rotate(request.refresh_token)
+    except TokenError as e:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail=str(e))
+
     access_token_expires = datetime.timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
-        data={"sub": current_user["email"]}, expires_delta=access_token_expires
+        data={"sub": email}, expires_delta=access_token_expires, session_id=session_id
     )
 
-    return {"access_token": access_token, "token_type": "bearer"}
+    return {"access_token": access_token, "refresh_token": refresh, "token_type": "bearer"}
+
+@app.post("/api/auth/logout", status_code=status.HTTP_204_NO_CONTENT)
+async def logout(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    """Revoke the login session of the access token: its access tokens and its refresh token"""
+    get_user_from_token(credentials.credentials)
+    payload = jwt.decode(credentials.credentials, SECRET_KEY, algorithms=[ALGORITHM])
+    if payload.get("sid"):
+        refresh_tokens.revoke_session(payload["sid"], "logout")
+    elif payload.get("jti"):
+        token_revocations.revoke(payload["jti"], payload["exp"], "logout")
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
+
+# Expired refresh tokens are dropped hourly. The revocation filter is rebuilt more often: that drops expired
+# revocations, resizes the Bloom filter and picks up revocations whose notification never arrived.
+TOKEN_PRUNE_INTERVAL = 3600
+REVOCATION_SYNC_INTERVAL = 300
+
+@app.on_event("startup")
+async def start_token_pruning():
+    async def every(interval: float, job, name: str):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await run_in_threadpool(job)
+            except Exception as e:
+                print(f"{name} failed: {e}", file=sys.stderr)
+
+    for interval, job, name in ((TOKEN_PRUNE_INTERVAL, refresh_tokens.prune, "Refresh token pruning"),
+                                (REVOCATION_SYNC_INTERVAL, token_revocations.rebuild, "Revocation filter rebuild")):
+        task = asyncio.ensure_future(every(interval, job, name))
+        background_tasks.add(task)
+        task.add_done_callback(background_tasks.discard)
+
+# Bulk user provisioning (admin); see provisioning.py
+# Accepted rows carry the admin's organisation ID in `organization`
+user_provisioner = BulkProvisioner(users_db, lambda row, hashed_password: new_user_record(
+    row.first_name, row.last_name, str(row.email), organizations.get(row.organization), hashed_password, row.role),
+    password_policy)
+
+@app.post("/api/admin/users/bulk")
+async def bulk_provision_users(request: Request, atomic: bool = False, current_user: dict = Depends(require_admin)):
+    """Create users in the admin's organisation from a CSV or NDJSON upload, streaming one result line per row"""
+    organization_id = current_user["organization_id"]
+    enforce_rate_limit("auth", client_ip(request), current_user["email"])
+    try:
+        rows = parse_upload(await request.body(), request.headers.get("content-type", ""))
+    except (ValueError, UnicodeDecodeError) as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+    def same_organization(name: str) -> bool:
+        """A row may name the admin's organisation by ID or by name"""
+        return name == organization_id or legacy_tenant_key(name) == legacy_tenant_key(current_user["organization"])
+
+    return StreamingResponse(user_provisioner.provision(rows, organization_id, same_organization, atomic),
+                             media_type="application/x-ndjson")
+
+# Invites into the admin's organisation
+class InviteRequest(BaseModel):
+    expires_in_days: float = 7
+
+@app.post("/api/admin/invites", status_code=status.HTTP_201_CREATED)
+async def create_invite(request: InviteRequest, current_user: dict = Depends(require_admin)):
+    """A single-use code that registers its holder into the admin's organisation"""
+    if not 0 < request.expires_in_days <= 30:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="expires_in_days must be between 0 and 30")
+    return organizations.invite(current_user["organization_id"], current_user["email"], request.expires_in_days * 86400)
+
+# Password hashing policy (admin)
+class PasswordPolicyRequest(BaseModel):
+    budget_ms: float = PASSWORD_HASH_BUDGET_MS
+    scheme: str = PASSWORD_HASH_SCHEME
+
+@app.get("/api/admin/password-policy")
+async def get_password_policy(current_user: dict = Depends(require_admin)):
+    """Current hashing policy and how many stored hashes already follow it"""
+    policy = password_policy()
+    hashes = [user["hashed_password"] for user in users_db.values()]
+    off_policy = sum(1 for hashed in hashes if needs_rehash(hashed, policy))
+    schemes = {}
+    for hashed in hashes:
+        parameters = hash_parameters(hashed)
+        scheme = parameters["scheme"] if parameters else "unknown"
+        schemes[scheme] = schemes.get(scheme, 0) + 1
+    return {
+        "policy": policy,
+        "available_schemes": available_schemes(),
+        "users": len(hashes),
+        "on_policy": len(hashes) - off_policy,
+        "off_policy": off_policy,
+        "by_scheme": schemes,
+    }
+
+@app.post("/api/admin/password-policy/calibrate")
+async def calibrate_password_policy(request: PasswordPolicyRequest, current_user: dict = Depends(require_admin)):
+    """Recalibrate on this machine; off-policy hashes are replaced as their users log in"""
+    if not 50 <= request.budget_ms <= 5000:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="budget_ms must be between 50 and 5000")
+    try:
+        policy = await run_in_threadpool(calibrate, request.budget_ms, request.scheme)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    state.set("settings", "password_policy", policy)
+    return policy
+
+# Ruleset change re-scoring (admin)
+class RescoreRequest(BaseModel):
+    force_all: Optional[bool] = False
+    max_rate: Optional[float] = None
+
+@app.on_event("startup")
+async def resume_rescoring():
+    if not adopt_assessment_state():
+        rebuild_assessment_indexes()
+
+    # Jobs of a worker that died are taken over once their heartbeat is older than the lease
+    async def take_over():
+        while True:
+            try:
+                await run_in_threadpool(rescorer.resume_abandoned)
+            except Exception as e:
+                print(f"Re-score job takeover failed: {e}", file=sys.stderr)
+            await asyncio.sleep(JOB_LEASE_SECONDS)
+
+    task = asyncio.ensure_future(take_over())
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+
+@app.on_event("startup")
+async def start_ruleset_sync():
+    # Notifications can be missed while the backend connection is down
+    async def sync():
+        while True:
+            await asyncio.sleep(RULESET_SYNC_INTERVAL)
+            try:
+                await run_in_threadpool(sync_ruleset)
+            except Exception as e:
+                print(f"Ruleset sync failed: {e}", file=sys.stderr)
+
+    task = asyncio.ensure_future(sync())
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+
+@app.post("/api/admin/rescore", status_code=status.HTTP_202_ACCEPTED)
+async def start_rescore(request: RescoreRequest, current_user: dict = Depends(require_admin)):
+    """Re-score stored assessments affected by a change to decision_tree.json"""
+    scored = state.get("rulesets", "scored")
+    new_hash = ruleset_hash(DECISION_TREE_PATH)
+    if new_hash == scored["hash"] and not request.force_all:
+        return {"message": "Ruleset unchanged since last scoring", "ruleset_hash": new_hash}
+
+    if new_hash != current_ruleset["hash"]:
+        reload_rules_engine()
+    # Every worker reloads on this; see sync_ruleset
+    state.set("rulesets", "active", current_ruleset)
+    running = rescorer.running(current_ruleset["hash"])
+    if running is not None:
+        return running
+    new_tree = current_ruleset["tree"]
+    rules = changed_rules(scored["tree"], new_tree)
+    if request.force_all:
+        rules.add("*")
+    references = rule_references([scored["tree"], new_tree], ENGINE_FIELD_MAP.values())
+    refs = rule_index.affected(rules, references)
+
+    return rescorer.start(refs, rules, current_ruleset["hash"], request.max_rate)
+
+@app.get("/api/admin/rescore/{job_id}")
+async def get_rescore_job(job_id: str, current_user: dict = Depends(require_admin)):
+    job = rescorer.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Re-score job not found")
+    return job
+
+@app.get("/api/admin/rescore/{job_id}/report")
+async def get_rescore_report(job_id: str, decisions_only: bool = False, current_user: dict = Depends(require_admin)):
+    """Diff of stored results changed by the re-score"""
+    report = rescorer.report(job_id)
+    if report is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Re-score job not found")
+    changes = [c for c in report["changes"] if c["decision_changed"]] if decisions_only else report["changes"]
+    return {"job": rescorer.get(job_id), "changes": changes, "total": len(changes)}
+
+@app.post("/api/admin/rescore/{job_id}/pause")
+async def pause_rescore_job(job_id: str, current_user: dict = Depends(require_admin)):
+    job = rescorer.pause(job_id)
+    if job is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Re-score job not found")
+    return job
+
+@app.post("/api/admin/rescore/{job_id}/resume")
+async def resume_rescore_job(job_id: str, current_user: dict = Depends(require_admin)):
+    job = rescorer.resume(job_id)
+    if job is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Re-score job not found")
+    return job
+
+# State snapshots for warm restarts
+def assessment_fingerprint() -> Dict[str, Any]:
+    """Changes whenever stored assessments may have; snapshotted indexes and aggregates must match it"""
+    return dict(state.items(ASSESSMENT_VERSIONS_NAMESPACE))
+
+def export_assessment_state() -> Dict[str, Any]:
+    return {
+        "fingerprint": assessment_fingerprint(),
+        "similarity": similarity_index.export(),
+        "rule_reads": rule_index.export(),
+        "aggregates": {tenant.key: copy.deepcopy(tenant.built_aggregates()) for tenant in tenants.all()},
+    }
+
+def adopt_assessment_state() -> bool:
+    """Take the snapshotted indexes and aggregates if no assessment was stored or re-scored since"""
+    warm = warm_section("assessments")
+    if warm is None:
+        return False
+    if warm["fingerprint"] != assessment_fingerprint():
+        snapshot_store.reject("assessments", "stored assessments changed since the snapshot")
+        return False
+    similarity_index.adopt(warm["similarity"])
+    rule_index.adopt(warm["rule_reads"])
+    for tenant_name, aggregates in warm["aggregates"].items():
+        tenants.get(tenant_name).adopt_aggregates(*aggregates)
+    return True
+
+def export_decision_table():
+    table = decision_table.built()
+    return table if table is not None and table["ruleset_hash"] == current_ruleset["hash"] else None
+
+if snapshot_store is not None:
+    snapshot_store.register("description_analyzer", lambda: description_analyzer)
+    snapshot_store.register("decision_table", export_decision_table)
+    snapshot_store.register("password_policy", password_policy)
+    snapshot_store.register("demo_password_hash", lambda: (users_db.get("demo@judgedredd.ai") or {}).get("hashed_password"))
+    snapshot_store.register("evaluation_caches", lambda: {
+        tenant.key: tenant.evaluation_cache.entries() for tenant in tenants.all() if len(tenant.evaluation_cache)
+    })
+    # The deep copy of every tenant's aggregates is only repeated after an assessment was written
+    snapshot_store.register("assessments", export_assessment_state, version=assessment_fingerprint)
+
+@app.on_event("startup")
+async def start_snapshots():
+    global warm_snapshot
+    if warm_snapshot is not None:
+        warm_snapshot.close()
+        warm_snapshot = None
+    if snapshot_store is not None:
+        task = asyncio.ensure_future(snapshot_store.run(lambda: current_ruleset["hash"]))
+        background_tasks.add(task)
+        task.add_done_callback(background_tasks.discard)
+
+@app.on_event("shutdown")
+def save_snapshot():
+    if snapshot_store is not None:
+        snapshot_store.save(current_ruleset["hash"])
+
+# Reminders and notifications
+@app.on_event("startup")
+async def start_reminders():
+    reminders.load(
+        (tenant_name, assessment)
+        for tenant_name, _ in state.items("tenants")
+        for assessment in tenants.get(tenant_name).list_assessments()
+    )
+    for run in (reminders.scheduler.run, reminders.outbox.run):
+        task = asyncio.ensure_future(run())
+        background_tasks.add(task)
+        task.add_done_callback(background_tasks.discard)
+
+@app.get("/api/notifications")
+async def get_notifications(limit: int = 50, current_user: dict = Depends(get_current_user)):
+    """Push notifications (reassessment reminders, compliance updates) for the current user"""
+    notifications = [n for _, n in reversed(state.items(f"notifications:{current_user['email']}"))][:limit]
+    return {"notifications": notifications, "total": len(notifications)}
+
+@app.get("/api/admin/reminders")
+async def get_reminder_stats(current_user: dict = Depends(require_admin)):
+    return {**reminders.stats(), "dead_letters": list(reminders.outbox.dead_letters)[-20:]}
+
+# Continuous sampling profiler of the event loop thread (admin)
+event_loop_thread_id = None
+continuous_profiler: Optional[StackSampler] = None
+
+@app.on_event("startup")
+async def remember_event_loop_thread():
+    global event_loop_thread_id
+    event_loop_thread_id = threading.get_ident()
+
+class ProfilerStart(BaseModel):
+    interval: Optional[float] = 0.01
+    duration: Optional[float] = None
+
+@app.post("/api/admin/profiler/start")
+async def start_profiler(request: ProfilerStart, current_user: dict = Depends(require_admin)):
+    """Start sampling the event loop thread; replaces the previous report"""
+    global continuous_profiler
+    if continuous_profiler is not None and continuous_profiler.running:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Profiler is already running")
+    if not 0.001 <= request.interval <= 1.0:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="interval must be between 0.001 and 1 second")
+    continuous_profiler = StackSampler(event_loop_thread_id, request.interval).start(request.duration)
+    return continuous_profiler.summary()
+
+@app.post("/api/admin/profiler/stop")
+async def stop_profiler(current_user: dict = Depends(require_admin)):
+    if continuous_profiler is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Profiler has not been started")
+    return continuous_profiler.stop().summary()
+
+@app.get("/api/admin/profiler/report")
+async def get_profiler_report(format: str = "summary", current_user: dict = Depends(require_admin)):
+    """Profile summary, or format=collapsed to download flamegraph input"""
+    if continuous_profiler is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Profiler has not been started")
+    if format == "collapsed":
+        started = datetime.datetime.fromtimestamp(continuous_profiler.started_at).strftime("%Y%m%d-%H%M%S")
+        return Response(
+            content=continuous_profiler.collapsed(),
+            media_type="text/plain",
+            headers={"Content-Disposition": f'attachment; filename="judge-dredd-profile-{started}.collapsed"'},
+        )
+    return continuous_profiler.summary()
+
+# Memory accounting and cache-pressure eviction; see memory_budget.py. The budget is per worker; without one
+# each of the WEB_CONCURRENCY workers (as uvicorn and gunicorn read it) gets an equal share of the cgroup limit.
+MEMORY_BUDGET_MB = os.environ.get("JUDGE_DREDD_MEMORY_BUDGET_MB")
+memory_watchdog = MemoryWatchdog(
+    int(float(MEMORY_BUDGET_MB) * 1024 * 1024) if MEMORY_BUDGET_MB
+    else worker_budget(int(os.environ.get("WEB_CONCURRENCY", "1"))),
+    interval=float(os.environ.get("JUDGE_DREDD_MEMORY_CHECK_INTERVAL", "5")),
+)
+memory_watchdog.register("micro_cache", lambda: sampled_size(micro_cache), micro_cache.evict_fraction)
+memory_watchdog.register("state_near_cache", lambda: sampled_size(state), state.evict_fraction)
+
+def evict_evaluation_caches(fraction: float):
+    for tenant in tenants.all():
+        tenant.evaluation_cache.evict_fraction(fraction)
+
+memory_watchdog.register(
+    "evaluation_caches",
+    lambda: sum(tenant.evaluation_cache.size_bytes for tenant in tenants.all()),
+    evict_evaluation_caches,
+)
+if capture_writer is not None:
+    memory_watchdog.register("capture_queue", lambda: capture_writer.queued_bytes, capture_writer.evict_fraction)
+
+# Reported only: indexes the app relies on, and the data itself when state lives in this process
+memory_watchdog.register("similarity_index", lambda: sampled_size(similarity_index))
+memory_watchdog.register("rule_index", lambda: sampled_size(rule_index))
+memory_watchdog.register("audit_subject_index", lambda: extrapolated_size(*audit_log.sample_index(32)))
+memory_watchdog.register("decision_table", decision_table.size_bytes)
+if isinstance(state.backend, MemoryBackend):
+    memory_watchdog.register("state_memory_backend", lambda: extrapolated_size(*state.backend.sample_entries(32)))
+
+@app.on_event("startup")
+async def start_memory_watchdog():
+    task = asyncio.ensure_future(memory_watchdog.run())
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+
+TRACEMALLOC_GROUPINGS = ("lineno", "filename", "traceback")
+
+class TracemallocStart(BaseModel):
+    frames: int = Field(1, ge=1, le=50)
+
+@app.get("/api/admin/memory")
+async def get_memory_stats(current_user: dict = Depends(require_admin)):
+    """RSS against the budget, estimated cache sizes, the last eviction and tracemalloc status"""
+    return await run_in_threadpool(memory_watchdog.stats)
+
+@app.post("/api/admin/memory/tracemalloc/start")
+async def start_tracemalloc(request: TracemallocStart, current_user: dict = Depends(require_admin)):
+    """Start tracing allocations; slows every allocation until stopped"""
+    memory_watchdog.start_tracing(request.frames)
+    return memory_watchdog.tracing_stats()
+
+@app.post("/api/admin/memory/tracemalloc/stop")
+async def stop_tracemalloc(current_user: dict = Depends(require_admin)):
+    memory_watchdog.stop_tracing()
+    return memory_watchdog.tracing_stats()
+
+@app.post("/api/admin/memory/tracemalloc/baseline")
+async def take_tracemalloc_baseline(current_user: dict = Depends(require_admin)):
+    """Snapshot current allocations for later diffs"""
+    try:
+        await run_in_threadpool(memory_watchdog.take_baseline)
+    except RuntimeError as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+    return memory_watchdog.tracing_stats()
+
+@app.get("/api/admin/memory/tracemalloc/{report}")
+async def get_tracemalloc_report(report: str, limit: int = 20, group_by: str = "lineno",
+                                 current_user: dict = Depends(require_admin)):
+    """top: the largest allocation sites now; diff: the sites that grew most since the baseline"""
+    if report not in ("top", "diff"):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Report must be top or diff")
+    if group_by not in TRACEMALLOC_GROUPINGS:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                            detail=f"group_by must be one of {', '.join(TRACEMALLOC_GROUPINGS)}")
+    compute = memory_watchdog.top if report == "top" else memory_watchdog.diff
+    try:
+        sites = await run_in_threadpool(compute, max(1, min(limit, 200)), group_by)
+    except RuntimeError as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+    return {"report": report, "group_by": group_by, "sites": sites, "tracemalloc": memory_watchdog.tracing_stats()}
+
+# Traffic capture
+@app.on_event("shutdown")
+def close_traffic_capture():
+    if capture_writer is not None:
+        capture_writer.close()
+
+# Audit log (admin)
+@app.on_event("shutdown")
+def close_audit_log():
+    audit_log.close()
+
+@app.get("/api/admin/audit")
+async def get_audit_records(assessment_id: Optional[str] = None, start: Optional[datetime.datetime] = None,
+                            end: Optional[datetime.datetime] = None, limit: int = 100,
+                            current_user: dict = Depends(require_admin)):
+    """Audit records of the admin's organisation, by assessment/report ID or time range"""
+    limit = max(1, min(limit, 1000))
+    tenant_name = tenant_key(current_user["organization_id"])
+    if assessment_id:
+        records = await run_in_threadpool(audit_log.records_for, assessment_id)
+        records = [record for record in records if record["tenant"] == tenant_name][:limit]
+    else:
+        records = await run_in_threadpool(audit_log.range, start, end, limit, tenant_name)
+    return {"records": records, "total": len(records)}
+
+@app.get("/api/admin/audit/verify")
+async def verify_audit_log(current_user: dict = Depends(require_admin)):
+    """Recompute the audit log hash chain"""
+    return {**await run_in_threadpool(audit_log.verify), "stats": audit_log.stats()}
+
+@app.get("/api/admin/concurrency")
+async def get_concurrency_stats(current_user: dict = Depends(require_admin)):
+    """Current adaptive limit, latency estimates and per-priority admission counters"""
+    return concurrency_limiter.stats()
+
+# Cache statistics for operators
+@app.get("/api/admin/cache-stats")
+async def get_cache_stats(current_user: dict = Depends(require_admin)):
+    """Hit, coalesce and eviction counters for the in-process caches"""
+    return {
+        "micro_cache": micro_cache.stats(),
+        "state_near_cache": state.stats(),
+        "evaluation_caches": [tenant.evaluation_cache.stats() for tenant in tenants.all()],
+        "snapshots": snapshot_store.stats() if snapshot_store is not None else None,
+        "token_revocations": {**token_revocations.stats(), "refresh_tokens": refresh_tokens.stats()},
+        "timestamp": datetime.datetime.now().isoformat()
+    }
 
 # Protected endpoint example
 @app.get("/api/auth/protected")
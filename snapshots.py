@@ -0,0 +1,284 @@
+"""
+Versioned binary snapshots of warm in-process state
+
+Without one, a new worker starts cold. It rebuilds the description
+analyzer, the decision table, the assessment indexes and the dashboard
+aggregates, and every evaluation cache starts empty. SnapshotStore
+periodically writes named sections of that state to a single file, and a
+starting process adopts whichever sections are still valid.
+
+File layout (integers little-endian):
+
+    header    magic b"JDSNAP", u16 format version, u16 section count,
+              the 64 hex digits of the ruleset hash and of the build digest
+    table     per section: u16 name length, name, u64 offset, u64 length, u32 crc32
+    payloads  one pickle per section
+
+The file is written under a temporary name, fsynced and renamed over the
+previous snapshot, so a reader sees the old file or the new one and never
+a torn one. Readers memory-map it and check the magic, version, ruleset
+hash and build digest before anything is unpickled. A snapshot of another
+ruleset is ignored, because its cached results would be wrong. So is one
+written by other code (see code_digest), whose pickled classes or cached
+results may not match this build. Each section is checked against its CRC
+and unpickled only when asked for.
+
+Exports run on the event loop, because they copy structures only the loop
+mutates. A section registered with a version function is exported again
+only when its version changed; otherwise the previous export is reused.
+
+Sections are pickles, so the directory must only be writable by the service.
+"""
+
+import asyncio
+import hashlib
+import mmap
+import os
+import pickle
+import struct
+import sys
+import time
+import zlib
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+MAGIC = b"JDSNAP"
+FORMAT_VERSION = 2
+SNAPSHOT_FILE = "state.snap"
+DEFAULT_INTERVAL = 300.0
+
+_HEADER = struct.Struct("<6sHH64s64s")
+_NAME_LENGTH = struct.Struct("<H")
+_ENTRY = struct.Struct("<QQI")
+
+
+class SnapshotError(Exception):
+    pass
+
+
+def code_digest(paths: Iterable[str]) -> str:
+    """sha256 over the Python modules in `paths` (files or directories), in a stable order"""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(os.path.join(path, name) for name in os.listdir(path) if name.endswith(".py"))
+        else:
+            files.append(path)
+    digest = hashlib.sha256()
+    for path in sorted(files, key=os.path.basename):
+        digest.update(os.path.basename(path).encode("utf-8") + b"\0")
+        with open(path, "rb") as f:
+            digest.update(hashlib.sha256(f.read()).digest())
+    return digest.hexdigest()
+
+
+def write_snapshot(path: str, ruleset_digest: str, build_digest: str, payloads: Dict[str, bytes]) -> int:
+    """Atomically replace the snapshot at `path`, returning its size in bytes"""
+    names = [name.encode("utf-8") for name in payloads]
+    offset = _HEADER.size + sum(_NAME_LENGTH.size + len(name) + _ENTRY.size for name in names)
+    parts = [_HEADER.pack(MAGIC, FORMAT_VERSION, len(names), ruleset_digest.encode("ascii"),
+                          build_digest.encode("ascii"))]
+    for name, payload in zip(names, payloads.values()):
+        parts.append(_NAME_LENGTH.pack(len(name)) + name + _ENTRY.pack(offset, len(payload), zlib.crc32(payload)))
+        offset += len(payload)
+    parts.extend(payloads.values())
+
+    directory = os.path.dirname(os.path.abspath(path))
+    temporary = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(temporary, "wb") as f:
+            f.writelines(parts)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, path)
+    except BaseException:
+        if os.path.exists(temporary):
+            os.unlink(temporary)
+        raise
+    dir_fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
+    return offset
+
+
+class Snapshot:
+    """Read-only, memory-mapped snapshot; sections are unpickled on demand"""
+
+    def __init__(self, path: str, ruleset_digest: str, build_digest: str):
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            self.sections = self._read_table(ruleset_digest, build_digest)
+        except SnapshotError:
+            self._map.close()
+            raise
+        except (struct.error, UnicodeDecodeError) as e:
+            self._map.close()
+            raise SnapshotError(f"Corrupt snapshot table: {e}") from e
+        self.path = path
+        self.created_at = os.path.getmtime(path)
+
+    def _read_table(self, ruleset_digest: str, build_digest: str) -> Dict[str, tuple]:
+        magic, version, count = struct.unpack_from("<6sHH", self._map, 0)
+        if magic != MAGIC:
+            raise SnapshotError("Not a snapshot file")
+        if version != FORMAT_VERSION:
+            raise SnapshotError(f"Snapshot format {version}, expected {FORMAT_VERSION}")
+        _, _, _, digest, build = _HEADER.unpack_from(self._map, 0)
+        if digest.decode("ascii") != ruleset_digest:
+            raise SnapshotError("Snapshot was taken with a different ruleset")
+        if build.decode("ascii") != build_digest:
+            raise SnapshotError("Snapshot was written by a different build")
+        sections, position = {}, _HEADER.size
+        for _ in range(count):
+            (length,) = _NAME_LENGTH.unpack_from(self._map, position)
+            position += _NAME_LENGTH.size
+            name = self._map[position:position + length].decode("utf-8")
+            position += length
+            offset, size, crc = _ENTRY.unpack_from(self._map, position)
+            position += _ENTRY.size
+            if offset + size > len(self._map):
+                raise SnapshotError(f"Section {name} is truncated")
+            sections[name] = (offset, size, crc)
+        return sections
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.sections
+
+    def load(self, name: str, default: Any = None) -> Any:
+        entry = self.sections.get(name)
+        if entry is None:
+            return default
+        offset, size, crc = entry
+        view = memoryview(self._map)[offset:offset + size]
+        try:
+            if zlib.crc32(view) != crc:
+                raise SnapshotError(f"Section {name} failed its checksum")
+            return pickle.loads(view)
+        finally:
+            view.release()
+
+    def close(self) -> None:
+        if not self._map.closed:
+            self._map.close()
+
+
+class SnapshotStore:
+    """Periodic snapshots of registered sections, and adoption at startup"""
+
+    def __init__(self, directory: str, build_digest: str, interval: float = DEFAULT_INTERVAL):
+        """`build_digest` identifies the code, e.g. code_digest() of the service's modules"""
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        self.path = os.path.join(directory, SNAPSHOT_FILE)
+        self.build_digest = build_digest
+        self.interval = interval
+        self._exporters: Dict[str, Tuple[Callable[[], Any], Optional[Callable[[], Any]]]] = {}
+        # name -> (version, value) of the last export of versioned sections
+        self._exported: Dict[str, Tuple[Any, Any]] = {}
+        self.adopted: List[str] = []
+        self.rejected: Optional[str] = None
+        self.last_written: Optional[float] = None
+        self.last_size = 0
+        self.last_write_seconds = 0.0
+        self.counters = {"written": 0, "failed": 0, "skipped_sections": 0, "reused_sections": 0}
+
+    def register(self, name: str, export: Callable[[], Any], version: Optional[Callable[[], Any]] = None) -> None:
+        """
+        `export` runs on the event loop and returns a copy safe to pickle elsewhere, or None to skip.
+        With `version`, the previous export is reused while version() returns the same value.
+        """
+        self._exporters[name] = (export, version)
+
+    def open(self, ruleset_digest: str) -> Optional[Snapshot]:
+        """The current snapshot if it matches this ruleset, else None with the reason kept in `rejected`"""
+        try:
+            return Snapshot(self.path, ruleset_digest, self.build_digest)
+        except FileNotFoundError:
+            return None
+        except (SnapshotError, ValueError, OSError) as e:
+            self.rejected = str(e)
+            return None
+
+    def take(self, snapshot: Optional[Snapshot], name: str) -> Any:
+        """A section of `snapshot`, or None if there is no snapshot or the section is missing or unreadable"""
+        if snapshot is None or name not in snapshot:
+            return None
+        try:
+            value = snapshot.load(name)
+        except (SnapshotError, pickle.UnpicklingError, EOFError, AttributeError, ImportError) as e:
+            self.rejected = f"{name}: {e}"
+            return None
+        self.adopted.append(name)
+        return value
+
+    def reject(self, name: str, reason: str) -> None:
+        """Record that a section returned by take() turned out to be stale"""
+        if name in self.adopted:
+            self.adopted.remove(name)
+        self.rejected = f"{name}: {reason}"
+
+    def collect(self) -> Dict[str, Any]:
+        sections = {}
+        for name, (export, version) in self._exporters.items():
+            if version is None:
+                value = export()
+            else:
+                current = version()
+                exported = self._exported.get(name)
+                if exported is not None and exported[0] == current:
+                    value = exported[1]
+                    self.counters["reused_sections"] += 1
+                else:
+                    value = export()
+                    self._exported[name] = (current, value)
+            if value is not None:
+                sections[name] = value
+        return sections
+
+    def write(self, ruleset_digest: str, sections: Dict[str, Any]) -> int:
+        """Pickle and write collected sections; a section that cannot be pickled is left out"""
+        started = time.perf_counter()
+        payloads = {}
+        for name, value in sections.items():
+            try:
+                payloads[name] = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+            except (pickle.PicklingError, TypeError, AttributeError) as e:
+                self.counters["skipped_sections"] += 1
+                print(f"Snapshot section {name} skipped: {e}", file=sys.stderr)
+        try:
+            size = write_snapshot(self.path, ruleset_digest, self.build_digest, payloads)
+        except OSError:
+            self.counters["failed"] += 1
+            raise
+        self.counters["written"] += 1
+        self.last_written = time.time()
+        self.last_size = size
+        self.last_write_seconds = time.perf_counter() - started
+        return size
+
+    def save(self, ruleset_digest: str) -> int:
+        return self.write(ruleset_digest, self.collect())
+
+    async def run(self, ruleset_digest: Callable[[], str]) -> None:
+        """Snapshot every `interval` seconds; exports run here, pickling and I/O in a thread"""
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await loop.run_in_executor(None, self.write, ruleset_digest(), self.collect())
+            except Exception as e:
+                print(f"Snapshot failed: {e}", file=sys.stderr)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "path": self.path,
+            "build_digest": self.build_digest,
+            "interval": self.interval,
+            "adopted": self.adopted,
+            "rejected": self.rejected,
+            "last_written": self.last_written,
+            "last_size_bytes": self.last_size,
+            "last_write_seconds": round(self.last_write_seconds, 4),
+            **self.counters,
+        }
@@ -0,0 +1,678 @@
+"""
+Shared state backends for multi-worker and multi-node deployments
+
+Users, assessments and activity live in a StateBackend instead of module
+globals. Values are JSON documents grouped by namespace. Every write
+publishes an invalidation so that each worker's NearCache drops stale
+entries written elsewhere.
+
+Notifications can be lost, e.g. while a Redis subscriber reconnects.
+Callbacks registered with on_resync() run after such a gap, so caches and
+anything else kept current by notifications can reload.
+
+Backends are selected by URL:
+    memory://                     process-local (single worker)
+    sqlite:///state.db            SQLite in WAL mode, shared by local workers
+    redis://host:port/db          any Redis-compatible server
+"""
+
+import asyncio
+import bisect
+import json
+import socket
+import sqlite3
+import sys
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import urlparse
+
+Subscriber = Callable[[str, str, bool], None]
+
+NEAR_CACHE_MAX_ENTRIES = 20000
+# Upper bound on staleness when a change notification from another worker is lost
+NEAR_CACHE_TTL = 60.0
+
+
+class StateBackend:
+    """Namespaced JSON document store with change notifications"""
+
+    def __init__(self):
+        self.origin = uuid.uuid4().hex
+        self._subscribers: List[Subscriber] = []
+        self._resync_callbacks: List[Callable[[], None]] = []
+
+    def get(self, namespace: str, key: str) -> Optional[Any]:
+        raise NotImplementedError
+
+    def set(self, namespace: str, key: str, value: Any) -> None:
+        raise NotImplementedError
+
+    def add(self, namespace: str, key: str, value: Any) -> bool:
+        """Insert only if the key is absent; returns False if it already existed"""
+        raise NotImplementedError
+
+    def replace(self, namespace: str, key: str, expected: Any, value: Any) -> bool:
+        """Compare-and-set: write only if the stored value still equals `expected`; returns False otherwise"""
+        raise NotImplementedError
+
+    def delete(self, namespace: str, key: str) -> None:
+        raise NotImplementedError
+
+    def items(self, namespace: str) -> List[Tuple[str, Any]]:
+        """All entries of a namespace ordered by key"""
+        raise NotImplementedError
+
+    def range(self, namespace: str, low: str, high: str) -> List[Tuple[str, Any]]:
+        """Entries with low <= key < high, ordered by key"""
+        return [(key, value) for key, value in self.items(namespace) if low <= key < high]
+
+    def count(self, namespace: str) -> int:
+        return len(self.items(namespace))
+
+    def subscribe(self, callback: Subscriber) -> None:
+        """callback(namespace, key, local) is called after every change"""
+        self._subscribers.append(callback)
+
+    def _notify(self, namespace: str, key: str, local: bool) -> None:
+        for callback in self._subscribers:
+            callback(namespace, key, local)
+
+    def on_resync(self, callback: Callable[[], None]) -> None:
+        """callback() is called after change notifications may have been missed"""
+        self._resync_callbacks.append(callback)
+
+    def _resync(self) -> None:
+        for callback in self._resync_callbacks:
+            try:
+                callback()
+            except Exception as e:
+                print(f"Resync after missed notifications failed: {e}", file=sys.stderr)
+
+    def close(self) -> None:
+        pass
+
+
+class MemoryBackend(StateBackend):
+    def __init__(self):
+        super().__init__()
+        self._data: Dict[str, Dict[str, str]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, namespace, key):
+        raw = self._data.get(namespace, {}).get(key)
+        return None if raw is None else json.loads(raw)
+
+    def set(self, namespace, key, value):
+        with self._lock:
+            self._data.setdefault(namespace, {})[key] = json.dumps(value)
+        self._notify(namespace, key, True)
+
+    def add(self, namespace, key, value):
+        with self._lock:
+            bucket = self._data.setdefault(namespace, {})
+            if key in bucket:
+                return False
+            bucket[key] = json.dumps(value)
+        self._notify(namespace, key, True)
+        return True
+
+    def sample_entries(self, count: int) -> Tuple[List[Tuple[str, str]], int]:
+        """Up to `count` stored (key, JSON) pairs spread over all namespaces, and the number stored, for size estimates"""
+        with self._lock:
+            entries = [entry for bucket in self._data.values() for entry in bucket.items()]
+        return (entries[::max(1, len(entries) // count)][:count] if count > 0 else []), len(entries)
+
+    def replace(self, namespace, key, expected, value):
+        with self._lock:
+            bucket = self._data.setdefault(namespace, {})
+            if key not in bucket or json.loads(bucket[key]) != expected:
+                return False
+            bucket[key] = json.dumps(value)
+        self._notify(namespace, key, True)
+        return True
+
+    def delete(self, namespace, key):
+        with self._lock:
+            self._data.get(namespace, {}).pop(key, None)
+        self._notify(namespace, key, True)
+
+    def items(self, namespace):
+        bucket = dict(self._data.get(namespace, {}))
+        return [(key, json.loads(bucket[key])) for key in sorted(bucket)]
+
+    def range(self, namespace, low, high):
+        bucket = dict(self._data.get(namespace, {}))
+        keys = sorted(bucket)
+        selected = keys[bisect.bisect_left(keys, low):bisect.bisect_left(keys, high)]
+        return [(key, json.loads(bucket[key])) for key in selected]
+
+    def count(self, namespace):
+        return len(self._data.get(namespace, {}))
+
+
+class SQLiteBackend(StateBackend):
+    """
+    SQLite in WAL mode. Every write also appends to a change log; a poller
+    thread uses PRAGMA data_version to notice commits from other processes
+    and replays their change log entries as invalidations.
+    """
+
+    # Change log entries kept for slower workers to catch up on
+    CHANGE_LOG_RETENTION = 100000
+
+    def __init__(self, path: str, poll_interval: float = 0.05):
+        super().__init__()
+        self.path = path
+        self.poll_interval = poll_interval
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS kv (namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, "
+            "PRIMARY KEY (namespace, key)) WITHOUT ROWID"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS changes (seq INTEGER PRIMARY KEY AUTOINCREMENT, "
+            "namespace TEXT NOT NULL, key TEXT NOT NULL, origin TEXT NOT NULL)"
+        )
+        conn.commit()
+        self._last_seq = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM changes").fetchone()[0]
+        self._stop = threading.Event()
+        self._poller = threading.Thread(target=self._poll, name="state-backend-poller", daemon=True)
+        self._poller.start()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _write(self, sql: str, params: tuple, namespace: str, key: str) -> int:
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            changed = conn.execute(sql, params).rowcount
+            if changed:
+                conn.execute("INSERT INTO changes (namespace, key, origin) VALUES (?, ?, ?)",
+                             (namespace, key, self.origin))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        if changed:
+            self._notify(namespace, key, True)
+        return changed
+
+    def get(self, namespace, key):
+        row = self._conn().execute("SELECT value FROM kv WHERE namespace = ? AND key = ?", (namespace, key)).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def set(self, namespace, key, value):
+        self._write("INSERT OR REPLACE INTO kv (namespace, key, value) VALUES (?, ?, ?)",
+                    (namespace, key, json.dumps(value)), namespace, key)
+
+    def add(self, namespace, key, value):
+        return bool(self._write("INSERT OR IGNORE INTO kv (namespace, key, value) VALUES (?, ?, ?)",
+                                (namespace, key, json.dumps(value)), namespace, key))
+
+    def replace(self, namespace, key, expected, value):
+        # Values are stored as json.dumps output, so equal documents have equal text
+        return bool(self._write("UPDATE kv SET value = ? WHERE namespace = ? AND key = ? AND value = ?",
+                                (json.dumps(value), namespace, key, json.dumps(expected)), namespace, key))
+
+    def delete(self, namespace, key):
+        self._write("DELETE FROM kv WHERE namespace = ? AND key = ?", (namespace, key), namespace, key)
+
+    def items(self, namespace):
+        rows = self._conn().execute("SELECT key, value FROM kv WHERE namespace = ? ORDER BY key", (namespace,))
+        return [(key, json.loads(value)) for key, value in rows]
+
+    def range(self, namespace, low, high):
+        # Served by the (namespace, key) primary key, which is the table's clustered index
+        rows = self._conn().execute(
+            "SELECT key, value FROM kv WHERE namespace = ? AND key >= ? AND key < ? ORDER BY key",
+            (namespace, low, high))
+        return [(key, json.loads(value)) for key, value in rows]
+
+    def count(self, namespace):
+        return self._conn().execute("SELECT COUNT(*) FROM kv WHERE namespace = ?", (namespace,)).fetchone()[0]
+
+    def _poll(self) -> None:
+        conn = self._conn()
+        data_version = None
+        pruned_at = self._last_seq
+        while not self._stop.wait(self.poll_interval):
+            version = conn.execute("PRAGMA data_version").fetchone()[0]
+            if version == data_version:
+                continue
+            data_version = version
+            rows = conn.execute("SELECT seq, namespace, key, origin FROM changes WHERE seq > ? ORDER BY seq",
+                                (self._last_seq,)).fetchall()
+            for seq, namespace, key, origin in rows:
+                self._last_seq = seq
+                if origin != self.origin:
+                    self._notify(namespace, key, False)
+            if self._last_seq - pruned_at > self.CHANGE_LOG_RETENTION:
+                pruned_at = self._last_seq
+                conn.execute("DELETE FROM changes WHERE seq <= ?", (pruned_at - self.CHANGE_LOG_RETENTION,))
+
+    def close(self):
+        self._stop.set()
+
+
+class RespClient:
+    """Minimal RESP2 client, enough for the hash and pub/sub commands used here"""
+
+    def __init__(self, host: str, port: int, db: int = 0):
+        self._sock = socket.create_connection((host, port))
+        self._reader = self._sock.makefile("rb")
+        self._lock = threading.Lock()
+        if db:
+            self.command("SELECT", db)
+
+    def send(self, *args) -> None:
+        parts = [f"*{len(args)}\r\n".encode()]
+        for arg in args:
+            data = arg if isinstance(arg, bytes) else str(arg).encode("utf-8")
+            parts.append(b"$%d\r\n%s\r\n" % (len(data), data))
+        self._sock.sendall(b"".join(parts))
+
+    def read_reply(self) -> Any:
+        line = self._reader.readline()
+        if not line:
+            raise ConnectionError("RESP connection closed")
+        prefix, payload = line[:1], line[1:-2]
+        if prefix == b"+":
+            return payload.decode()
+        if prefix == b"-":
+            raise RuntimeError(payload.decode())
+        if prefix == b":":
+            return int(payload)
+        if prefix == b"$":
+            length = int(payload)
+            if length < 0:
+                return None
+            data = self._reader.read(length + 2)[:-2]
+            return data.decode("utf-8")
+        if prefix == b"*":
+            length = int(payload)
+            return None if length < 0 else [self.read_reply() for _ in range(length)]
+        raise RuntimeError(f"Unexpected RESP reply: {line!r}")
+
+    def command(self, *args) -> Any:
+        with self._lock:
+            self.send(*args)
+            return self.read_reply()
+
+    def close(self) -> None:
+        self._sock.close()
+
+
+class RedisBackend(StateBackend):
+    """Each namespace is a hash; invalidations go out on a pub/sub channel"""
+
+    CHANNEL = "judge-dredd:invalidate"
+    # HSET only if the field still holds the expected JSON text
+    REPLACE_SCRIPT = ("if redis.call('HGET', KEYS[1], ARGV[1]) == ARGV[2] then "
+                      "redis.call('HSET', KEYS[1], ARGV[1], ARGV[3]) return 1 end return 0")
+
+    # Seconds between attempts to reconnect the subscriber, doubling up to the maximum
+    RECONNECT_DELAY = 0.5
+    MAX_RECONNECT_DELAY = 30.0
+
+    def __init__(self, host: str = "localhost", port: int = 6379, db: int = 0, prefix: str = "judge-dredd"):
+        super().__init__()
+        self.prefix = prefix
+        self._address = (host, port, db)
+        self._closed = False
+        self._client = RespClient(host, port, db)
+        self._subscriber = self._subscribe()
+        threading.Thread(target=self._listen, name="state-backend-subscriber", daemon=True).start()
+
+    def _subscribe(self) -> RespClient:
+        subscriber = RespClient(*self._address)
+        subscriber.command("SUBSCRIBE", self.CHANNEL)
+        return subscriber
+
+    def _hash(self, namespace: str) -> str:
+        return f"{self.prefix}:{namespace}"
+
+    def _publish(self, namespace: str, key: str) -> None:
+        self._client.command("PUBLISH", self.CHANNEL, json.dumps([self.origin, namespace, key]))
+        self._notify(namespace, key, True)
+
+    def get(self, namespace, key):
+        raw = self._client.command("HGET", self._hash(namespace), key)
+        return None if raw is None else json.loads(raw)
+
+    def set(self, namespace, key, value):
+        self._client.command("HSET", self._hash(namespace), key, json.dumps(value))
+        self._publish(namespace, key)
+
+    def add(self, namespace, key, value):
+        added = self._client.command("HSETNX", self._hash(namespace), key, json.dumps(value))
+        if added:
+            self._publish(namespace, key)
+        return bool(added)
+
+    def replace(self, namespace, key, expected, value):
+        replaced = self._client.command("EVAL", self.REPLACE_SCRIPT, 1, self._hash(namespace), key,
+                                        json.dumps(expected), json.dumps(value))
+        if replaced:
+            self._publish(namespace, key)
+        return bool(replaced)
+
+    def delete(self, namespace, key):
+        self._client.command("HDEL", self._hash(namespace), key)
+        self._publish(namespace, key)
+
+    def items(self, namespace):
+        flat = self._client.command("HGETALL", self._hash(namespace)) or []
+        pairs = dict(zip(flat[::2], flat[1::2]))
+        return [(key, json.loads(pairs[key])) for key in sorted(pairs)]
+
+    def count(self, namespace):
+        return self._client.command("HLEN", self._hash(namespace))
+
+    def _reconnect(self) -> bool:
+        """Subscribe again after the connection dropped; False once closed"""
+        delay = self.RECONNECT_DELAY
+        while not self._closed:
+            try:
+                self._subscriber = self._subscribe()
+            except (ConnectionError, OSError) as e:
+                print(f"State backend subscriber reconnect failed: {e}", file=sys.stderr)
+                time.sleep(delay)
+                delay = min(delay * 2, self.MAX_RECONNECT_DELAY)
+                continue
+            # Whatever was published while disconnected is gone
+            self._resync()
+            return True
+        return False
+
+    def _listen(self) -> None:
+        while True:
+            try:
+                message = self._subscriber.read_reply()
+            except (ConnectionError, OSError):
+                if self._closed or not self._reconnect():
+                    return
+                continue
+            if isinstance(message, list) and message[0] == "message":
+                origin, namespace, key = json.loads(message[2])
+                if origin != self.origin:
+                    self._notify(namespace, key, False)
+
+    def close(self):
+        self._closed = True
+        self._client.close()
+        self._subscriber.close()
+
+
+class NearCache:
+    """
+    Process-local read-through cache in front of a backend. Entries are
+    dropped when the backend reports a change, local or remote.
+
+    A read that raced an invalidation is not cached: every invalidation
+    bumps a generation counter, and a value read from the backend is only
+    kept if the counter did not move meanwhile. Entries also expire after
+    `ttl` seconds, which bounds staleness if a notification from another
+    worker is lost, and the least recently used are dropped beyond
+    `max_entries`. Entries are kept JSON-encoded, so every read returns a
+    fresh copy that callers may mutate.
+    """
+
+    def __init__(self, backend: StateBackend, max_entries: int = NEAR_CACHE_MAX_ENTRIES,
+                 ttl: float = NEAR_CACHE_TTL):
+        self.backend = backend
+        self.max_entries = max_entries
+        self.ttl = ttl
+        # (namespace, key) -> (expires at, JSON)
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[float, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._listeners: List[Subscriber] = []
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        backend.subscribe(self._invalidate)
+        backend.on_resync(self.clear)
+
+    def _invalidate(self, namespace: str, key: str, local: bool) -> None:
+        with self._lock:
+            self._generation += 1
+            self._entries.pop((namespace, key), None)
+        for listener in self._listeners:
+            listener(namespace, key, local)
+
+    def on_change(self, listener: Subscriber) -> None:
+        self._listeners.append(listener)
+
+    def on_resync(self, callback: Callable[[], None]) -> None:
+        """callback() runs after change notifications may have been missed (this cache is already cleared)"""
+        self.backend.on_resync(callback)
+
+    def get(self, namespace: str, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get((namespace, key))
+            if entry is not None and entry[0] > time.monotonic():
+                self._entries.move_to_end((namespace, key))
+                self.hits += 1
+                return json.loads(entry[1])
+            generation = self._generation
+            self.misses += 1
+        value = self.backend.get(namespace, key)
+        if value is not None:
+            encoded = json.dumps(value)
+            with self._lock:
+                if self._generation == generation:
+                    self._entries[(namespace, key)] = (time.monotonic() + self.ttl, encoded)
+                    self._entries.move_to_end((namespace, key))
+                    while len(self._entries) > self.max_entries:
+                        self._entries.popitem(last=False)
+                        self.evictions += 1
+        return value
+
+    # Writes are not cached here: the write's own notification would race the store, so the next read fills it
+    def set(self, namespace: str, key: str, value: Any) -> None:
+        self.backend.set(namespace, key, value)
+
+    def add(self, namespace: str, key: str, value: Any) -> bool:
+        return self.backend.add(namespace, key, value)
+
+    def replace(self, namespace: str, key: str, expected: Any, value: Any) -> bool:
+        return self.backend.replace(namespace, key, expected, value)
+
+    def delete(self, namespace: str, key: str) -> None:
+        self.backend.delete(namespace, key)
+
+    def items(self, namespace: str) -> List[Tuple[str, Any]]:
+        return self.backend.items(namespace)
+
+    def range(self, namespace: str, low: str, high: str) -> List[Tuple[str, Any]]:
+        return self.backend.range(namespace, low, high)
+
+    def count(self, namespace: str) -> int:
+        return self.backend.count(namespace)
+
+    def mapping(self, namespace: str) -> "StateMapping":
+        return StateMapping(self, namespace)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def evict_fraction(self, fraction: float) -> int:
+        """Drop the least recently used share of entries, returning how many were removed"""
+        with self._lock:
+            count = int(len(self._entries) * fraction)
+            for _ in range(count):
+                self._entries.popitem(last=False)
+            self.evictions += count
+        return count
+
+    def sample(self, count: int) -> List[Any]:
+        """Up to `count` cached values spread over the cache, for size estimates"""
+        with self._lock:
+            encoded = [raw for _, raw in self._entries.values()]
+        return [json.loads(raw) for raw in encoded[::max(1, len(encoded) // count)][:count]] if count > 0 else []
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": type(self.backend).__name__, "entries": len(self._entries), "max_entries": self.max_entries,
+                "ttl": self.ttl, "hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+
+class StateMapping(MutableMapping):
+    """
+    Dict-like view of one namespace. Values are copies: mutate and assign
+    back (mapping[key] = value) for the change to reach other workers.
+    """
+
+    def __init__(self, state: NearCache, namespace: str):
+        self.state = state
+        self.namespace = namespace
+
+    def __getitem__(self, key: str) -> Any:
+        value = self.state.get(self.namespace, key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def get(self, key: str, default: Any = None) -> Any:
+        value = self.state.get(self.namespace, key)
+        return default if value is None else value
+
+    def __contains__(self, key: object) -> bool:
+        return isinstance(key, str) and self.state.get(self.namespace, key) is not None
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        self.state.set(self.namespace, key, value)
+
+    def add(self, key: str, value: Any) -> bool:
+        return self.state.add(self.namespace, key, value)
+
+    def replace(self, key: str, expected: Any, value: Any) -> bool:
+        return self.state.replace(self.namespace, key, expected, value)
+
+    def __delitem__(self, key: str) -> None:
+        self.state.delete(self.namespace, key)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter([key for key, _ in self.state.items(self.namespace)])
+
+    def __len__(self) -> int:
+        return self.state.count(self.namespace)
+
+    def values(self) -> List[Any]:
+        return [value for _, value in self.state.items(self.namespace)]
+
+
+def create_backend(url: str) -> StateBackend:
+    parsed = urlparse(url)
+    if parsed.scheme in ("", "memory"):
+        return MemoryBackend()
+    if parsed.scheme == "sqlite":
+        # sqlite:///relative.db or sqlite:////absolute/path.db
+        return SQLiteBackend(url[len("sqlite:///"):])
+    if parsed.scheme == "redis":
+        db = int(parsed.path.lstrip("/") or 0)
+        return RedisBackend(parsed.hostname or "localhost", parsed.port or 6379, db)
+    raise ValueError(f"Unsupported state backend URL: {url}")
+
+
+async def _serve_resp(host: str, port: int) -> None:
+    """Local stand-in for a Redis-compatible server (hashes, pub/sub and RedisBackend's own script only)"""
+    hashes: Dict[str, Dict[str, str]] = {}
+    channels: Dict[str, List[asyncio.StreamWriter]] = {}
+
+    def encode(value: Any) -> bytes:
+        if value is None:
+            return b"$-1\r\n"
+        if isinstance(value, int):
+            return b":%d\r\n" % value
+        if isinstance(value, list):
+            return b"*%d\r\n" % len(value) + b"".join(encode(v) for v in value)
+        data = str(value).encode("utf-8")
+        return b"$%d\r\n%s\r\n" % (len(data), data)
+
+    async def read_command(reader: asyncio.StreamReader) -> Optional[List[str]]:
+        line = await reader.readline()
+        if not line:
+            return None
+        args = []
+        for _ in range(int(line[1:-2])):
+            length = int((await reader.readline())[1:-2])
+            args.append((await reader.readexactly(length + 2))[:-2].decode("utf-8"))
+        return args
+
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        while True:
+            args = await read_command(reader)
+            if args is None:
+                break
+            name, rest = args[0].upper(), args[1:]
+            if name in ("PING", "SELECT"):
+                reply = b"+PONG\r\n" if name == "PING" else b"+OK\r\n"
+            elif name == "HGET":
+                reply = encode(hashes.get(rest[0], {}).get(rest[1]))
+            elif name == "HSET":
+                bucket = hashes.setdefault(rest[0], {})
+                created = rest[1] not in bucket
+                bucket[rest[1]] = rest[2]
+                reply = encode(int(created))
+            elif name == "HSETNX":
+                bucket = hashes.setdefault(rest[0], {})
+                created = rest[1] not in bucket
+                bucket.setdefault(rest[1], rest[2])
+                reply = encode(int(created))
+            elif name == "EVAL" and rest[0] == RedisBackend.REPLACE_SCRIPT:
+                bucket = hashes.get(rest[2], {})
+                replaced = bucket.get(rest[3]) == rest[4]
+                if replaced:
+                    bucket[rest[3]] = rest[5]
+                reply = encode(int(replaced))
+            elif name == "HDEL":
+                reply = encode(int(hashes.get(rest[0], {}).pop(rest[1], None) is not None))
+            elif name == "HGETALL":
+                reply = encode([item for pair in hashes.get(rest[0], {}).items() for item in pair])
+            elif name == "HLEN":
+                reply = encode(len(hashes.get(rest[0], {})))
+            elif name == "PUBLISH":
+                subscribers = channels.get(rest[0], [])
+                for subscriber in subscribers:
+                    subscriber.write(encode(["message", rest[0], rest[1]]))
+                reply = encode(len(subscribers))
+            elif name == "SUBSCRIBE":
+                channels.setdefault(rest[0], []).append(writer)
+                reply = encode(["subscribe", rest[0], 1])
+            else:
+                reply = f"-ERR unknown command '{name}'\r\n".encode()
+            writer.write(reply)
+            await writer.drain()
+        for subscribers in channels.values():
+            if writer in subscribers:
+                subscribers.remove(writer)
+        writer.close()
+
+    server = await asyncio.start_server(handle, host, port)
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == "__main__":
+    # python state_backend.py serve-resp [port]
+    if sys.argv[1:2] == ["serve-resp"]:
+        port = int(sys.argv[2]) if len(sys.argv) > 2 else 6379
+        print(f"RESP stand-in listening on 127.0.0.1:{port}")
+        asyncio.run(_serve_resp("127.0.0.1", port))
@@ -0,0 +1,367 @@
+"""
+Per-organisation tenancy: partitioned stores, bounded caches and rate limits
+
+Tenants are keyed by server-issued organisation IDs, never by the
+organisation name a user types in. Registering without an invite creates
+a new organisation; joining an existing one takes an invite code issued
+by one of its admins. The key "public" is reserved for anonymous callers.
+"""
+
+import secrets
+import sys
+import threading
+import time
+from collections import Counter, OrderedDict
+from collections.abc import MutableMapping
+from typing import Any, Callable, Dict, Hashable, Iterable, List, Optional, Tuple
+
+from timeseries import ComplianceRollups
+
+DEFAULT_TENANT = "public"
+
+# Default per-tenant evaluation cache budget
+TENANT_CACHE_BUDGET_BYTES = 8 * 1024 * 1024
+
+
+ORGANIZATIONS_NAMESPACE = "organizations"
+INVITES_NAMESPACE = "organization_invites"
+USED_INVITES_NAMESPACE = "organization_invites_used"
+INVITE_TTL_SECONDS = 7 * 86400
+
+
+def tenant_key(organization_id: Optional[str]) -> str:
+    """Tenant key of a server-issued organisation ID; None is the anonymous tenant"""
+    return organization_id or DEFAULT_TENANT
+
+
+def legacy_tenant_key(organization: Optional[str]) -> str:
+    """The key once derived from a self-declared organisation name, for migrating old users"""
+    key = " ".join((organization or "").split()).casefold()
+    return key or DEFAULT_TENANT
+
+
+class InviteError(Exception):
+    pass
+
+
+class Organizations:
+    """Organisations and their invite codes, kept in the shared state backend"""
+
+    def __init__(self, state, new_id: Callable[[], str]):
+        self.state = state
+        self.new_id = new_id
+
+    def create(self, name: str, organization_id: Optional[str] = None, **extra: Any) -> Dict[str, Any]:
+        organization_id = organization_id or self.new_id()
+        if organization_id == DEFAULT_TENANT:
+            raise ValueError(f"{DEFAULT_TENANT!r} is reserved for anonymous callers")
+        record = {"id": organization_id, "name": " ".join(name.split()),
+                  "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"), **extra}
+        if not self.state.add(ORGANIZATIONS_NAMESPACE, organization_id, record):
+            return self.state.get(ORGANIZATIONS_NAMESPACE, organization_id)
+        return record
+
+    def get(self, organization_id: str) -> Optional[Dict[str, Any]]:
+        return self.state.get(ORGANIZATIONS_NAMESPACE, organization_id)
+
+    def invite(self, organization_id: str, created_by: str, ttl_seconds: float = INVITE_TTL_SECONDS) -> Dict[str, Any]:
+        """A single-use invite code for joining the organisation"""
+        invite = {"code": secrets.token_urlsafe(24), "organization_id": organization_id,
+                  "created_by": created_by, "expires_at": time.time() + ttl_seconds}
+        self.state.set(INVITES_NAMESPACE, invite["code"], invite)
+        return invite
+
+    def redeem(self, code: str, email: str) -> Dict[str, Any]:
+        """The organisation an invite code admits to; the code is used up, atomically across workers"""
+        invite = self.state.get(INVITES_NAMESPACE, code)
+        if invite is None or invite["expires_at"] <= time.time():
+            raise InviteError("Invalid or expired invite code")
+        if not self.state.add(USED_INVITES_NAMESPACE, code, {"email": email, "used_at": time.time()}):
+            raise InviteError("Invite code has already been used")
+        self.state.delete(INVITES_NAMESPACE, code)
+        return self.get(invite["organization_id"])
+
+
+def estimate_size(obj: Any, _depth: int = 0) -> int:
+    """Rough deep size of plain Python data, used for cache budgets"""
+    size = sys.getsizeof(obj)
+    if _depth > 6:
+        return size
+    if isinstance(obj, dict):
+        size += sum(estimate_size(k, _depth + 1) + estimate_size(v, _depth + 1) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(estimate_size(v, _depth + 1) for v in obj)
+    elif hasattr(obj, "__dict__"):
+        size += estimate_size(vars(obj), _depth + 1)
+    return size
+
+
+class LRUCache:
+    """Least-recently-used cache bounded by an estimated byte budget"""
+
+    def __init__(self, max_bytes: int, name: str = "cache"):
+        self.name = name
+        self.max_bytes = max_bytes
+        self._data: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._sizes: Dict[Hashable, int] = {}
+        self._lock = threading.Lock()
+        self.size_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key: Hashable, value: Any, size: Optional[int] = None) -> None:
+        size = estimate_size(value) if size is None else size
+        with self._lock:
+            if key in self._data:
+                self.size_bytes -= self._sizes[key]
+            self._data[key] = value
+            self._data.move_to_end(key)
+            self._sizes[key] = size
+            self.size_bytes += size
+            self._evict_to(self.max_bytes)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            if key not in self._data:
+                return default
+            self.size_bytes -= self._sizes.pop(key)
+            return self._data.pop(key)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self._sizes.clear()
+            self.size_bytes = 0
+
+    def evict_fraction(self, fraction: float) -> int:
+        """Drop the least recently used share of the cache, returning bytes freed"""
+        with self._lock:
+            before = self.size_bytes
+            self._evict_to(int(self.size_bytes * (1 - fraction)))
+            return before - self.size_bytes
+
+    def entries(self) -> List[Tuple[Hashable, Any, int]]:
+        """(key, value, size) from least to most recently used"""
+        with self._lock:
+            return [(key, value, self._sizes[key]) for key, value in self._data.items()]
+
+    def load(self, entries: Iterable[Tuple[Hashable, Any, int]]) -> None:
+        """Insert entries in order, as returned by entries()"""
+        for key, value, size in entries:
+            self.set(key, value, size)
+
+    def _evict_to(self, target_bytes: int) -> None:
+        while self._data and self.size_bytes > target_bytes:
+            key, _ = self._data.popitem(last=False)
+            self.size_bytes -= self._sizes.pop(key)
+            self.evictions += 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "entries": len(self._data),
+            "size_bytes": self.size_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+class TokenBucket:
+    """Classic token bucket; take() returns 0 when allowed, else seconds to wait"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def take(self, amount: float = 1.0) -> float:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= amount:
+            self.tokens -= amount
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+
+class RateLimiter:
+    """Keyed token buckets with a bounded number of tracked keys"""
+
+    def __init__(self, rate: float, capacity: float, max_keys: int = 10000):
+        self.rate = rate
+        self.capacity = capacity
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[Hashable, TokenBucket]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.rejected = 0
+
+    def check(self, key: Hashable, amount: float = 1.0) -> float:
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = TokenBucket(self.rate, self.capacity)
+                if len(self._buckets) > self.max_keys:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+            wait = bucket.take(amount)
+            if wait:
+                self.rejected += 1
+            return wait
+
+
+class TenantMetrics:
+    """Dashboard aggregates maintained incrementally as assessments are stored"""
+
+    def __init__(self):
+        self.total = 0
+        self.risk_sum = 0
+        self.decisions: Counter = Counter()
+        self.risk_bands: Counter = Counter()
+        self.system_types: Counter = Counter()
+
+    def add(self, assessment: Dict[str, Any], sign: int = 1) -> None:
+        score = assessment.get("risk_score") or 0
+        self.total += sign
+        self.risk_sum += sign * score
+        self.decisions[assessment.get("status")] += sign
+        self.risk_bands["high" if score >= 70 else "medium" if score >= 40 else "low"] += sign
+        self.system_types[assessment.get("system_type")] += sign
+
+    def summary(self) -> Dict[str, Any]:
+        approved = self.decisions["GO"] + self.decisions["BETINGET GO"]
+        return {
+            "total_assessments": self.total,
+            "completed_assessments": self.total,
+            "pending_assessments": 0,
+            "average_risk_score": round(self.risk_sum / self.total, 1) if self.total else 0,
+            "high_risk_systems": self.risk_bands["high"],
+            "compliance_rate": round(approved / self.total * 100, 1) if self.total else 0,
+        }
+
+
+# The assessment fields the aggregates count
+COUNTED_FIELDS = ("created_at", "status", "risk_score", "system_type")
+
+
+def counted(assessment: Dict[str, Any]) -> Dict[str, Any]:
+    return {field: assessment.get(field) for field in COUNTED_FIELDS}
+
+
+class Tenant:
+    """
+    Everything scoped to one organisation. The aggregates (metrics and rollups) are
+    built with one scan of the assessments and then kept up to date one write at a
+    time, also for writes by other workers (apply_change). For that the tenant keeps
+    the counted fields of every assessment, so it can take back what a record
+    contributed once the record itself has changed in the store.
+    """
+
+    def __init__(self, key: str, cache_budget_bytes: int, assessments: Optional[MutableMapping] = None):
+        self.key = key
+        self.assessments = OrderedDict() if assessments is None else assessments
+        self.evaluation_cache = LRUCache(cache_budget_bytes, name=f"evaluations:{key}")
+        self._metrics: Optional[TenantMetrics] = None
+        self._rollups: Optional[ComplianceRollups] = None
+        self._counted: Optional[Dict[str, Dict[str, Any]]] = None
+        self._aggregates_lock = threading.RLock()
+
+    def _aggregates(self) -> Tuple[TenantMetrics, ComplianceRollups, Dict[str, Dict[str, Any]]]:
+        with self._aggregates_lock:
+            if self._metrics is None or self._rollups is None or self._counted is None:
+                metrics, rollups, contributions = TenantMetrics(), ComplianceRollups(), {}
+                for assessment in self.assessments.values():
+                    contribution = contributions[assessment["id"]] = counted(assessment)
+                    metrics.add(contribution)
+                    rollups.add(contribution)
+                self._metrics, self._rollups, self._counted = metrics, rollups, contributions
+            return self._metrics, self._rollups, self._counted
+
+    @property
+    def metrics(self) -> TenantMetrics:
+        return self._aggregates()[0]
+
+    @property
+    def rollups(self) -> ComplianceRollups:
+        return self._aggregates()[1]
+
+    def _apply(self, assessment_id: str, assessment: Optional[Dict[str, Any]]) -> None:
+        metrics, rollups, contributions = self._aggregates()
+        previous = contributions.pop(assessment_id, None)
+        if previous is not None:
+            metrics.add(previous, sign=-1)
+            rollups.add(previous, sign=-1)
+        if assessment is not None:
+            contribution = contributions[assessment_id] = counted(assessment)
+            metrics.add(contribution)
+            rollups.add(contribution)
+
+    def apply_change(self, assessment_id: str, assessment: Optional[Dict[str, Any]]) -> None:
+        """Another worker stored (or, with None, deleted) an assessment of this tenant"""
+        with self._aggregates_lock:
+            if self._metrics is not None:  # nothing to update before the first build
+                self._apply(assessment_id, assessment)
+
+    def invalidate_metrics(self) -> None:
+        """Rebuild the aggregates on next use; for when another worker's changes may have been missed"""
+        with self._aggregates_lock:
+            self._metrics = self._rollups = self._counted = None
+
+    def built_aggregates(self) -> Tuple[Optional[TenantMetrics], Optional[ComplianceRollups],
+                                        Optional[Dict[str, Dict[str, Any]]]]:
+        """(metrics, rollups, counted fields) as far as they have been built, without building them"""
+        with self._aggregates_lock:
+            return self._metrics, self._rollups, self._counted
+
+    def adopt_aggregates(self, metrics: Optional[TenantMetrics], rollups: Optional[ComplianceRollups],
+                         contributions: Optional[Dict[str, Dict[str, Any]]]) -> None:
+        with self._aggregates_lock:
+            self._metrics, self._rollups, self._counted = metrics, rollups, contributions
+
+    def store_assessment(self, assessment: Dict[str, Any]) -> None:
+        with self._aggregates_lock:
+            self._aggregates()
+            self.assessments[assessment["id"]] = assessment
+            self._apply(assessment["id"], assessment)
+
+    def list_assessments(self) -> List[Dict[str, Any]]:
+        return list(self.assessments.values())
+
+
+class TenantRegistry:
+    def __init__(self, cache_budget_bytes: int = TENANT_CACHE_BUDGET_BYTES,
+                 store_factory: Optional[Callable[[str], MutableMapping]] = None):
+        self.cache_budget_bytes = cache_budget_bytes
+        self.store_factory = store_factory
+        self._tenants: Dict[str, Tenant] = {}
+        self._lock = threading.Lock()
+
+    def get(self, organization_id: Optional[str]) -> Tenant:
+        key = tenant_key(organization_id)
+        tenant = self._tenants.get(key)
+        if tenant is None:
+            with self._lock:
+                tenant = self._tenants.get(key)
+                if tenant is None:
+                    store = self.store_factory(key) if self.store_factory else None
+                    tenant = self._tenants[key] = Tenant(key, self.cache_budget_bytes, store)
+        return tenant
+
+    def all(self) -> List[Tenant]:
+        return list(self._tenants.values())
@@ -0,0 +1,75 @@
+"""
+Tests for refresh token rotation through the API
+
+simple-api.py needs the rules engine and decision_tree.json, so run this from a
+directory that has both:
+
+    python -m pytest -q test_auth_refresh.py
+"""
+
+import importlib.util
+import os
+
+import pytest
+
+pytest.importorskip("rules_engine")
+from fastapi.testclient import TestClient  # noqa: E402
+
+from tenancy import RateLimiter  # noqa: E402
+
+DEMO_USER = {"email": "demo@judgedredd.ai", "password": "demo123"}
+
+
+@pytest.fixture(scope="module")
+def api(tmp_path_factory):
+    os.environ["JUDGE_DREDD_AUDIT_DIR"] = str(tmp_path_factory.mktemp("audit_log"))
+    os.environ["JUDGE_DREDD_STATE_URL"] = "memory://"
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "simple-api.py")
+    spec = importlib.util.spec_from_file_location("simple_api", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture(scope="module")
+def client(api):
+    # One client for the module: startup tasks are bound to its event loop
+    with TestClient(api.app) as client:
+        yield client
+
+
+def reset_auth_limits(api):
+    tenant_limiter, user_limiter = api.rate_limiters["auth"]
+    api.rate_limiters["auth"] = (RateLimiter(tenant_limiter.rate, tenant_limiter.capacity),
+                                 RateLimiter(user_limiter.rate, user_limiter.capacity))
+
+
+def test_refresh_token_works_once(api, client):
+    reset_auth_limits(api)
+    refresh = client.post("/api/auth/login", json=DEMO_USER).json()["refresh_token"]
+    first = client.post("/api/auth/refresh", json={"refresh_token": refresh})
+    assert first.status_code == 200
+    reused = client.post("/api/auth/refresh", json={"refresh_token": refresh})
+    assert reused.status_code == 401
+    # Reuse revokes the session, so the token handed out by the first refresh is dead too
+    assert client.post("/api/auth/refresh", json={"refresh_token": first.json()["refresh_token"]}).status_code == 401
+
+
+def test_rate_limited_refresh_can_be_retried(api, client):
+    reset_auth_limits(api)
+    refresh = client.post("/api/auth/login", json=DEMO_USER).json()["refresh_token"]
+    for _ in range(20):
+        response = client.post("/api/auth/refresh", json={"refresh_token": refresh})
+        if response.status_code == 429:
+            break
+        assert response.status_code == 200
+        refresh = response.json()["refresh_token"]
+    else:
+        pytest.fail("the auth rate limit never applied")
+    assert "Retry-After" in response.headers
+
+    # The refused token was not used up: once the limit allows it, the same token still works
+    reset_auth_limits(api)
+    retried = client.post("/api/auth/refresh", json={"refresh_token": refresh})
+    assert retried.status_code == 200
+    assert client.post("/api/auth/refresh", json={"refresh_token": retried.json()["refresh_token"]}).status_code == 200
@@ -0,0 +1,172 @@
+"""
+Tests for news_ingestion.py, against feeds served by httpx.MockTransport
+
+    python -m pytest -q test_news_ingestion.py
+"""
+
+import asyncio
+import json
+import time
+
+import httpx
+import pytest
+
+from news_ingestion import ITEMS_NAMESPACE, MAX_FEED_BYTES, NewsIngestor, item_key, parse_feed
+from state_backend import NearCache, create_backend
+
+RSS = b"""<?xml version="1.0" encoding="utf-8"?>
+<rss version="2.0"><channel><title>Datatilsynet</title>
+<item><title>Datatilsynet udsender ny vejledning om DPIA</title><link>http://feeds.test/1</link>
+<pubDate>Mon, 13 Oct 2025 09:00:00 GMT</pubDate><description>Vejledningen er obligatorisk.</description></item>
+</channel></rss>"""
+
+ATOM = b"""<?xml version="1.0" encoding="utf-8"?>
+<feed xmlns="http://www.w3.org/2005/Atom"><title>EDPB</title>
+<entry><title>EDPB adopts guidelines on AI models</title><link href="http://feeds.test/2"/>
+<updated>2025-10-13T10:00:00Z</updated></entry>
+<entry><title>Datatilsynet  udsender ny vejledning om DPIA</title><link href="http://feeds.test/1"/>
+<updated>2025-10-13T10:00:00Z</updated></entry>
+</feed>"""
+
+ETAG = '"rss-1"'
+
+
+async def endless_feed():
+    """A chunked body with no Content-Length that never ends"""
+    yield b'<?xml version="1.0"?><rss version="2.0"><channel>'
+    while True:
+        yield b"<item><title>" + b"x" * 65536 + b"</title></item>"
+
+
+def feed_server(requests):
+    """A MockTransport serving /rss (with an ETag), /atom, /bad-json, /busy, /broken-xml, /huge and /endless"""
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        path = request.url.path
+        if path == "/rss":
+            if request.headers.get("if-none-match") == ETAG:
+                return httpx.Response(304)
+            return httpx.Response(200, content=RSS, headers={"content-type": "application/rss+xml", "etag": ETAG})
+        if path == "/atom":
+            return httpx.Response(200, content=ATOM, headers={"content-type": "application/atom+xml"})
+        if path == "/bad-json":
+            return httpx.Response(200, json={"items": [{"title": 5}]})
+        if path == "/busy":
+            return httpx.Response(503, headers={"retry-after": "7200"})
+        if path == "/broken-xml":
+            return httpx.Response(200, content=b"<rss><channel>", headers={"content-type": "application/rss+xml"})
+        if path == "/huge":
+            return httpx.Response(200, content=b" " * (MAX_FEED_BYTES + 1), headers={"content-type": "application/rss+xml"})
+        if path == "/endless":
+            return httpx.Response(200, content=endless_feed(), headers={"content-type": "application/rss+xml"})
+        return httpx.Response(404)
+    return httpx.MockTransport(handler)
+
+
+def source(name: str) -> dict:
+    return {"id": name, "name": name.upper(), "url": f"http://feeds.test/{name}", "interval": 60}
+
+
+@pytest.fixture
+def requests():
+    return []
+
+
+@pytest.fixture
+def ingestor(requests):
+    sources = [source(name) for name in ("rss", "atom", "bad-json", "busy", "broken-xml")]
+    return NewsIngestor(NearCache(create_backend("memory://")), sources, transport=feed_server(requests))
+
+
+def poll(ingestor: NewsIngestor, name: str) -> dict:
+    async def run():
+        async with ingestor.client() as client:
+            return await ingestor.poll(client, next(s for s in ingestor.sources if s["id"] == name))
+    return asyncio.run(run())
+
+
+def poll_due(ingestor: NewsIngestor) -> int:
+    async def run():
+        async with ingestor.client() as client:
+            return await ingestor.poll_due(client)
+    return asyncio.run(run())
+
+
+def test_parse_feed_reads_rss_atom_and_json():
+    assert [entry["title"] for entry in parse_feed(RSS)] == ["Datatilsynet udsender ny vejledning om DPIA"]
+    atom = parse_feed(ATOM)
+    assert atom[0]["url"] == "http://feeds.test/2"
+    assert atom[0]["published"].isoformat() == "2025-10-13T10:00:00+00:00"
+    document = {"items": [{"title": "AI Office code of practice", "external_url": "http://feeds.test/3"}, {"title": ""}]}
+    assert parse_feed(json.dumps(document).encode(), "application/feed+json") == [{
+        "title": "AI Office code of practice", "url": "http://feeds.test/3", "summary": "", "published": None,
+    }]
+
+
+def test_parse_feed_keeps_only_http_links():
+    document = {"items": [{"title": "a", "url": "javascript:alert(1)"}, {"title": "b", "url": "/relative"},
+                          {"title": "c", "url": "HTTPS://feeds.test/c"}, {"title": "d", "url": "data:text/html,x"}]}
+    assert [entry["url"] for entry in parse_feed(json.dumps(document).encode(), "application/json")] == [
+        None, None, "HTTPS://feeds.test/c", None]
+
+
+@pytest.mark.parametrize("document", [{"items": [{"title": 5}]}, {"items": {"title": "x"}}, {"items": ["x"]}, []])
+def test_parse_feed_rejects_malformed_json(document):
+    with pytest.raises(ValueError):
+        parse_feed(json.dumps(document).encode(), "application/json")
+
+
+def test_poll_stores_items_and_sends_conditional_requests(ingestor, requests):
+    first = poll(ingestor, "rss")
+    assert first["last_status"] == 200 and first["stored"] == 1 and first["etag"] == ETAG
+    second = poll(ingestor, "rss")
+    assert requests[-1].headers["if-none-match"] == ETAG
+    assert second["last_status"] == 304 and second["stored"] == 0
+    assert ingestor.counters["not_modified"] == 1
+
+
+def test_syndicated_items_are_stored_once(ingestor):
+    poll(ingestor, "rss")
+    polled = poll(ingestor, "atom")
+    assert polled["stored"] == 1
+    assert ingestor.counters["duplicates"] == 1
+    assert ingestor.state.count(ITEMS_NAMESPACE) == 2
+    item = ingestor.state.get(ITEMS_NAMESPACE, item_key("Datatilsynet udsender ny vejledning om DPIA"))
+    assert item["source"] == "RSS" and item["type"] == "gdpr" and item["priority"] == "high"
+
+
+@pytest.mark.parametrize("name", ["bad-json", "broken-xml"])
+def test_malformed_feed_is_recorded_with_backoff(ingestor, name):
+    before = time.time()
+    polled = poll(ingestor, name)
+    assert polled["failures"] == 1 and polled["last_error"]
+    # interval * 2 ** failures, less the jitter
+    assert polled["next_poll"] >= before + 0.8 * 120
+    again = poll(ingestor, name)
+    assert again["failures"] == 2 and again["next_poll"] >= before + 0.8 * 240
+
+
+@pytest.mark.parametrize("name", ["huge", "endless"])
+def test_oversized_feed_is_aborted(requests, name):
+    ingestor = NewsIngestor(NearCache(create_backend("memory://")), [source(name)], transport=feed_server(requests))
+    polled = poll(ingestor, name)
+    assert polled["failures"] == 1 and "larger than" in polled["last_error"]
+    assert ingestor.state.count(ITEMS_NAMESPACE) == 0
+
+
+def test_retry_after_is_honoured(ingestor):
+    before = time.time()
+    polled = poll(ingestor, "busy")
+    assert polled["last_status"] == 503 and polled["failures"] == 1
+    assert polled["next_poll"] >= before + 7200
+
+
+def test_one_failing_feed_does_not_stop_the_others(ingestor):
+    assert poll_due(ingestor) == 5
+    stats = ingestor.stats()
+    assert stats["items"] == 2
+    assert {name for name, polled in stats["sources"].items() if polled["failures"]} == {"bad-json", "busy", "broken-xml"}
+    # Only the healthy feeds are due again
+    for name in ("rss", "atom"):
+        ingestor.state.set("news_sources", name, {**stats["sources"][name], "next_poll": 0.0})
+    assert poll_due(ingestor) == 2
@@ -0,0 +1,144 @@
+"""
+Daily, weekly and monthly rollups of stored assessments
+
+Each assessment adds to one row per granularity: the day it was created,
+the Monday of its week and the first of its month. Rows hold the count,
+the number of approved decisions and the risk score sum, so rollups are
+kept up to date on every write (a re-scored assessment is subtracted and
+added again) and never rebuilt from the raw assessments. A query picks the
+coarsest granularity that still gives a useful chart for its span, so it
+reads at most a few hundred rows however many assessments exist. A week or
+month only partly inside the range is summed from its day rows instead, so
+the first and last points count only assessments between from and to.
+"""
+
+import bisect
+import datetime
+from typing import Any, Dict, List, Optional
+
+GRANULARITIES = ("day", "week", "month")
+
+# Longest span, in days, served at each granularity when none is requested
+AUTO_GRANULARITY_DAYS = (("day", 92), ("week", 731), ("month", None))
+
+# Upper bound on rows in one response
+MAX_POINTS = 400
+
+APPROVED_DECISIONS = ("GO", "BETINGET GO")
+
+
+def bucket_start(day: datetime.date, granularity: str) -> datetime.date:
+    if granularity == "day":
+        return day
+    if granularity == "week":
+        return day - datetime.timedelta(days=day.weekday())
+    return day.replace(day=1)
+
+
+def next_bucket(start: datetime.date, granularity: str) -> datetime.date:
+    if granularity == "day":
+        return start + datetime.timedelta(days=1)
+    if granularity == "week":
+        return start + datetime.timedelta(days=7)
+    return (start.replace(day=28) + datetime.timedelta(days=4)).replace(day=1)
+
+
+def choose_granularity(start: datetime.date, end: datetime.date) -> str:
+    span = (end - start).days + 1
+    for granularity, max_days in AUTO_GRANULARITY_DAYS:
+        if max_days is None or span <= max_days:
+            return granularity
+    return GRANULARITIES[-1]
+
+
+class ComplianceRollups:
+    """Rollup rows per granularity: bucket start -> [assessments, approved, risk score sum]"""
+
+    def __init__(self):
+        self._rows: Dict[str, Dict[datetime.date, List[float]]] = {g: {} for g in GRANULARITIES}
+        # Sorted bucket starts per granularity, for range lookups
+        self._keys: Dict[str, List[datetime.date]] = {g: [] for g in GRANULARITIES}
+
+    def add(self, assessment: Dict[str, Any], sign: int = 1) -> None:
+        created_at = assessment.get("created_at")
+        if not created_at:
+            return
+        day = datetime.datetime.fromisoformat(created_at).date()
+        approved = 1 if assessment.get("status") in APPROVED_DECISIONS else 0
+        score = assessment.get("risk_score") or 0
+        for granularity in GRANULARITIES:
+            rows, keys = self._rows[granularity], self._keys[granularity]
+            key = bucket_start(day, granularity)
+            row = rows.get(key)
+            if row is None:
+                row = rows[key] = [0, 0, 0]
+                bisect.insort(keys, key)
+            row[0] += sign
+            row[1] += sign * approved
+            row[2] += sign * score
+            if row[0] <= 0:
+                del rows[key]
+                del keys[bisect.bisect_left(keys, key)]
+
+    def query(self, start: datetime.date, end: datetime.date, granularity: Optional[str] = None) -> Dict[str, Any]:
+        """One point per bucket from start to end inclusive; buckets without assessments have no rates"""
+        granularity = granularity or choose_granularity(start, end)
+        if granularity not in GRANULARITIES:
+            raise ValueError(f"granularity must be one of {', '.join(GRANULARITIES)}")
+        if end < start:
+            raise ValueError("from must not be after to")
+
+        rows = self._rows[granularity]
+        points: List[Dict[str, Any]] = []
+        totals = [0, 0, 0]
+        bucket = bucket_start(start, granularity)
+        while bucket <= end:
+            if len(points) >= MAX_POINTS:
+                raise ValueError(f"Range has more than {MAX_POINTS} {granularity} points; use a coarser granularity")
+            last_day = next_bucket(bucket, granularity) - datetime.timedelta(days=1)
+            # Points are clipped to the range; a partly covered bucket is dated from its first day inside it
+            clipped_start, clipped_end = max(bucket, start), min(last_day, end)
+            if (clipped_start, clipped_end) == (bucket, last_day):
+                row = rows.get(bucket)
+            else:
+                row = self._sum_days(clipped_start, clipped_end)
+            points.append(self._point(clipped_start, row))
+            if row:
+                totals = [total + value for total, value in zip(totals, row)]
+            bucket = next_bucket(bucket, granularity)
+
+        count, approved, score_sum = totals
+        rates = [point["compliance_rate"] for point in points if point["compliance_rate"] is not None]
+        return {
+            "granularity": granularity,
+            "from": start.isoformat(),
+            "to": end.isoformat(),
+            "metrics": points,
+            "summary": {
+                "average_compliance": round(approved / count * 100, 1) if count else None,
+                "trend": ("increasing" if rates[-1] > rates[0] else "decreasing" if rates[-1] < rates[0] else "stable")
+                         if len(rates) > 1 else "stable",
+                "total_assessments": count,
+                "average_risk_score": round(score_sum / count, 1) if count else None,
+            },
+        }
+
+    def _sum_days(self, start: datetime.date, end: datetime.date) -> Optional[List[float]]:
+        rows, keys = self._rows["day"], self._keys["day"]
+        days = keys[bisect.bisect_left(keys, start):bisect.bisect_right(keys, end)]
+        if not days:
+            return None
+        return [sum(rows[day][i] for day in days) for i in range(3)]
+
+    @staticmethod
+    def _point(bucket: datetime.date, row: Optional[List[float]]) -> Dict[str, Any]:
+        count = row[0] if row else 0
+        return {
+            "date": bucket.isoformat(),
+            "compliance_rate": round(row[1] / count * 100, 1) if count else None,
+            "assessments_completed": count,
+            "risk_score": round(row[2] / count, 1) if count else None,
+        }
+
+    def stats(self) -> Dict[str, int]:
+        return {granularity: len(rows) for granularity, rows in self._rows.items()}
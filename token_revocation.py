@@ -0,0 +1,233 @@
+"""
+Access token revocation and rotating refresh tokens
+
+Every access token carries a token ID (jti) and the ID of the login
+session it belongs to (sid). Revoking either writes an entry to the shared
+state backend, which keeps the exact list until the revoked tokens would
+have expired anyway. Each worker mirrors the list's keys into a Bloom
+filter and keeps it current from state change notifications. An
+authenticated request checks the filter in process. A miss, the normal
+case, proves the token is not revoked. Only a hit (a revoked token or a
+rare false positive) reads the exact entry. The filter is rebuilt from
+the exact list periodically and whenever the backend may have missed
+notifications. Keys revoked while a rebuild scans the list are added to
+the new filter as well, so none is lost in the swap.
+
+Refresh tokens are opaque random strings, stored by their SHA-256 hash.
+Each use rotates the token: the old one is marked used, with an atomic
+add so two workers cannot both accept it, and a new one is issued for the
+same session. A used refresh token presented again has leaked, so the
+whole session is revoked, together with the access tokens issued to it.
+"""
+
+import hashlib
+import math
+import secrets
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+REVOKED_NAMESPACE = "revoked_tokens"
+REFRESH_NAMESPACE = "refresh_tokens"
+USED_REFRESH_NAMESPACE = "refresh_tokens_used"
+
+DEFAULT_CAPACITY = 100000
+DEFAULT_ERROR_RATE = 0.001
+
+
+class TokenError(Exception):
+    pass
+
+
+class TokenReuseError(TokenError):
+    pass
+
+
+def session_key(session_id: str) -> str:
+    return f"session:{session_id}"
+
+
+class BloomFilter:
+    """Bit array with k positions per item from double hashing one blake2b digest"""
+
+    def __init__(self, capacity: int, error_rate: float = DEFAULT_ERROR_RATE):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.size = max(64, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self._bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _probe(self, item: str):
+        digest = hashlib.blake2b(item.encode("utf-8"), digest_size=16).digest()
+        return int.from_bytes(digest[:8], "little"), int.from_bytes(digest[8:], "little") | 1
+
+    def add(self, item: str) -> None:
+        first, step = self._probe(item)
+        for i in range(self.hashes):
+            position = (first + i * step) % self.size
+            self._bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item: str) -> bool:
+        # Stops at the first clear bit, which for most absent items is the first probe
+        first, step = self._probe(item)
+        bits, size = self._bits, self.size
+        for i in range(self.hashes):
+            position = (first + i * step) % size
+            if not bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+
+class RevocationList:
+    def __init__(self, state, capacity: int = DEFAULT_CAPACITY, error_rate: float = DEFAULT_ERROR_RATE):
+        self.state = state
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self._lock = threading.Lock()
+        self._rebuild_lock = threading.Lock()
+        # Keys remembered while a rebuild runs, for the filter it is building
+        self._remembered_during_rebuild: Optional[list] = None
+        self.counters = {"checks": 0, "filter_hits": 0, "false_positives": 0, "revoked": 0, "rebuilds": 0}
+        self._filter = BloomFilter(capacity, error_rate)
+        self.rebuild()
+
+    def rebuild(self) -> int:
+        """Reload the filter from the exact list, dropping expired entries; returns entries kept"""
+        with self._rebuild_lock:
+            with self._lock:
+                self._remembered_during_rebuild = []
+            try:
+                now = time.time()
+                keys = []
+                for key, entry in self.state.items(REVOKED_NAMESPACE):
+                    if entry["expires_at"] <= now:
+                        self.state.delete(REVOKED_NAMESPACE, key)
+                    else:
+                        keys.append(key)
+                # Room to double before the false positive rate climbs
+                bloom = BloomFilter(max(self.capacity, 2 * len(keys)), self.error_rate)
+                for key in keys:
+                    bloom.add(key)
+                with self._lock:
+                    # Revocations since the scan started may be missing from it
+                    for key in self._remembered_during_rebuild:
+                        bloom.add(key)
+                    self._filter = bloom
+            finally:
+                with self._lock:
+                    self._remembered_during_rebuild = None
+        self.counters["rebuilds"] += 1
+        return len(keys)
+
+    def revoke(self, key: str, expires_at: float, reason: str) -> None:
+        self.state.set(REVOKED_NAMESPACE, key, {"expires_at": expires_at, "reason": reason, "revoked_at": time.time()})
+        self._remember(key)
+        self.counters["revoked"] += 1
+
+    def _remember(self, key: str) -> None:
+        with self._lock:
+            self._filter.add(key)
+            if self._remembered_during_rebuild is not None:
+                self._remembered_during_rebuild.append(key)
+            full = self._filter.count > self._filter.capacity
+        if full and not self._rebuild_lock.locked():
+            self.rebuild()
+
+    def on_change(self, namespace: str, key: str, local: bool) -> None:
+        """State change listener: revocations by other workers reach this worker's filter"""
+        if namespace == REVOKED_NAMESPACE and not local and self.state.get(namespace, key) is not None:
+            self._remember(key)
+
+    def is_revoked(self, *keys: Optional[str]) -> bool:
+        self.counters["checks"] += 1
+        bloom = self._filter
+        for key in keys:
+            if key is None or key not in bloom:
+                continue
+            self.counters["filter_hits"] += 1
+            entry = self.state.get(REVOKED_NAMESPACE, key)
+            if entry is not None and entry["expires_at"] > time.time():
+                return True
+            self.counters["false_positives"] += 1
+        return False
+
+    def stats(self) -> Dict[str, Any]:
+        bloom = self._filter
+        return {
+            "filter_entries": bloom.count,
+            "filter_capacity": bloom.capacity,
+            "filter_bytes": len(bloom._bits),
+            "hash_functions": bloom.hashes,
+            **self.counters,
+        }
+
+
+class RefreshTokens:
+    def __init__(self, state, revocations: RevocationList, ttl_seconds: float):
+        self.state = state
+        self.revocations = revocations
+        self.ttl_seconds = ttl_seconds
+        self.counters = {"issued": 0, "rotated": 0, "reuse_detected": 0}
+
+    @staticmethod
+    def _digest(token: str) -> str:
+        return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+    def issue(self, email: str, session_id: Optional[str] = None) -> Tuple[str, str]:
+        """(refresh token, session ID); a new session unless one is given"""
+        session_id = session_id or secrets.token_urlsafe(12)
+        token = secrets.token_urlsafe(32)
+        now = time.time()
+        self.state.set(REFRESH_NAMESPACE, self._digest(token), {
+            "email": email, "session": session_id, "issued_at": now, "expires_at": now + self.ttl_seconds,
+        })
+        self.counters["issued"] += 1
+        return token, session_id
+
+    def _valid_record(self, digest: str) -> Dict[str, Any]:
+        record = self.state.get(REFRESH_NAMESPACE, digest)
+        if record is None or record["expires_at"] <= time.time():
+            raise TokenError("Invalid or expired refresh token")
+        if self.revocations.is_revoked(session_key(record["session"])):
+            raise TokenError("Session has been revoked")
+        return record
+
+    def lookup(self, token: str) -> Tuple[str, str]:
+        """(email, session ID) of a valid refresh token, without using it up"""
+        record = self._valid_record(self._digest(token))
+        return record["email"], record["session"]
+
+    def rotate(self, token: str) -> Tuple[str, str, str]:
+        """
+        (email, session ID, new refresh token) for a valid refresh token, which is used up.
+        Anything that can still refuse the request must run before this: a refused client
+        retries with the same token, which then counts as reuse.
+        """
+        digest = self._digest(token)
+        record = self._valid_record(digest)
+        if not self.state.add(USED_REFRESH_NAMESPACE, digest, {"used_at": time.time(), "expires_at": record["expires_at"]}):
+            self.counters["reuse_detected"] += 1
+            self.revoke_session(record["session"], "refresh token reuse")
+            raise TokenReuseError("Refresh token was already used; the session has been revoked")
+        new_token, _ = self.issue(record["email"], record["session"])
+        self.counters["rotated"] += 1
+        return record["email"], record["session"], new_token
+
+    def revoke_session(self, session_id: str, reason: str) -> None:
+        """Revoke every token of a session; newer tokens than now + ttl cannot exist"""
+        self.revocations.revoke(session_key(session_id), time.time() + self.ttl_seconds, reason)
+
+    def prune(self) -> int:
+        """Delete expired refresh token records, returning how many"""
+        now, removed = time.time(), 0
+        for namespace in (REFRESH_NAMESPACE, USED_REFRESH_NAMESPACE):
+            for key, record in self.state.items(namespace):
+                if record["expires_at"] <= now:
+                    self.state.delete(namespace, key)
+                    removed += 1
+        return removed
+
+    def stats(self) -> Dict[str, Any]:
+        return dict(self.counters)
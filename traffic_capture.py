@@ -0,0 +1,561 @@
+"""
+Production traffic capture and in-process replay
+
+CaptureMiddleware (opt-in) samples API requests into rotating NDJSON files.
+Request bodies and query strings are scrubbed by allowlist before anything
+is written: only the values of known enum, flag and range fields
+(KEPT_FIELDS) are kept as sent. Everything else is replaced:
+    emails, organisations  keyed-hash pseudonyms, so one user or tenant keeps
+                           one identity throughout a capture
+    passwords              REPLAY_PASSWORD
+    tokens, invite codes   a fixed placeholder
+    names                  fixed placeholders
+    any other text         hash-seeded filler text of the same length, so
+                           text scanning costs stay realistic (system names,
+                           descriptions, additional_info, search queries)
+    Authorization          not stored; the pseudonymous user is recorded
+Numbers and booleans are kept. Each record also holds the response status,
+the server time and a digest of the response with volatile fields (ids,
+tokens, timestamps) removed. A response cut off at max_body_bytes gets no
+digest, since it would never match a replay.
+
+The replay tool loads a build's ASGI app in-process, registers the captured
+pseudonymous users and sends the captured requests at their original
+spacing, scaled by --speed, or back to back with --speed 0. `compare` takes
+the results of two builds and reports latency percentiles and response
+mismatches per route:
+
+    python traffic_capture.py replay old/simple-api.py captures/*.ndjson --out old.ndjson
+    python traffic_capture.py replay new/simple-api.py captures/*.ndjson --out new.ndjson
+    python traffic_capture.py compare old.ndjson new.ndjson
+"""
+
+import argparse
+import asyncio
+import functools
+import glob
+import gzip
+import hashlib
+import hmac
+import importlib.util
+import json
+import os
+import queue
+import random
+import re
+import sys
+import threading
+import time
+import urllib.parse
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+REPLAY_PASSWORD = "replay-password-1"
+
+# Body and query fields whose values are kept when they look like an enum value, date or number
+KEPT_FIELDS = frozenset({
+    "ai_system_type", "rolle", "role", "branch_sector", "handles_personal_data", "data_types",
+    "automated_decisions", "decision_type", "decision_impact", "step", "reuse_assessment_id",
+    "range", "from", "to", "granularity", "limit", "fields", "atomic", "decisions_only", "format",
+})
+_KEPT_VALUE = re.compile(r"^[\w.:,+-]{0,64}$")
+
+# Body and query fields scrubbed in a field-specific way; any other text becomes filler
+PII_FIELDS = {
+    "email": "email",
+    "password": "password",
+    "current_password": "password",
+    "new_password": "password",
+    "first_name": "name",
+    "last_name": "name",
+    "phone": "name",
+    "organization": "organization",
+    "refresh_token": "secret",
+    "access_token": "secret",
+    "token": "secret",
+    "invite_code": "secret",
+}
+
+# Response fields left out of the comparison digest
+VOLATILE_KEYS = {"timestamp", "last_updated", "created_at", "generated_at", "updated_at", "date",
+                 "access_token", "refresh_token", "expires_at", "started_at", "heartbeat"}
+
+# Request headers kept in captures
+CAPTURED_HEADERS = (b"content-type", b"accept", b"accept-encoding", b"if-none-match")
+
+_FILLER_WORDS = ("systemet", "data", "behandler", "modellen", "brugere", "sager", "vurdering", "kommunen",
+                 "løsningen", "understøtter", "analyse", "proces", "medarbejdere", "borgere", "drift")
+_ID_SEGMENT = re.compile(r"^(?:[0-9a-f-]{16,}|[A-Za-z_]*[0-9A-Z]{10,}|\d+)$")
+
+
+class Scrubber:
+    def __init__(self, key: Optional[bytes] = None):
+        self.key = key or os.urandom(32)
+
+    def _digest(self, value: str) -> str:
+        return hmac.new(self.key, value.encode("utf-8"), hashlib.sha256).hexdigest()
+
+    def pseudonym(self, kind: str, value: Any) -> Any:
+        if not isinstance(value, str):
+            return value
+        if kind == "email":
+            return f"user-{self._digest(value.casefold())[:16]}@example.com"
+        if kind == "password":
+            return REPLAY_PASSWORD
+        if kind == "name":
+            return "Replay"
+        if kind == "secret":
+            return "[redacted]"
+        if kind == "organization":
+            return f"org-{self._digest(' '.join(value.split()).casefold())[:12]}"
+        # Free text: deterministic filler of the same length
+        rng = random.Random(self._digest(value))
+        words = []
+        length = 0
+        while length < len(value):
+            word = rng.choice(_FILLER_WORDS)
+            words.append(word)
+            length += len(word) + 1
+        return " ".join(words)[:len(value)]
+
+    def scrub(self, value: Any, field: Optional[str] = None) -> Any:
+        """`value` of `field` with everything not known to be safe pseudonymised"""
+        if isinstance(value, dict):
+            return {key: self.scrub(item, key) for key, item in value.items()}
+        if isinstance(value, list):
+            return [self.scrub(item, field) for item in value]
+        if field in PII_FIELDS:
+            return self.pseudonym(PII_FIELDS[field], value)
+        if isinstance(value, str) and not (field in KEPT_FIELDS and _KEPT_VALUE.match(value)):
+            return self.pseudonym("text", value)
+        return value
+
+    def scrub_query(self, query: str) -> str:
+        return urllib.parse.urlencode([(key, self.scrub(value, key))
+                                       for key, value in urllib.parse.parse_qsl(query, keep_blank_values=True)])
+
+
+def _strip_volatile(value: Any) -> Any:
+    if isinstance(value, dict):
+        return {key: _strip_volatile(item) for key, item in value.items()
+                if key not in VOLATILE_KEYS and key != "id" and not key.endswith("_id")}
+    if isinstance(value, list):
+        return [_strip_volatile(item) for item in value]
+    return value
+
+
+def response_digest(body: bytes, content_type: str) -> str:
+    """Digest of a response body; JSON is compared without volatile fields"""
+    if content_type.startswith("application/json") and body:
+        try:
+            body = json.dumps(_strip_volatile(json.loads(body)), sort_keys=True, ensure_ascii=False).encode("utf-8")
+        except ValueError:
+            pass
+    return hashlib.sha256(body).hexdigest()[:32]
+
+
+def route_of(path: str) -> str:
+    """Path with id-like segments folded, for per-route statistics"""
+    return "/".join("{id}" if _ID_SEGMENT.match(segment) else segment for segment in path.split("/"))
+
+
+class CaptureWriter:
+    """Appends records from a background thread to capture-<pid>-<time>.ndjson files, rotating by size"""
+
+    def __init__(self, directory: str, max_bytes: int = 64 * 1024 * 1024, max_files: int = 8, max_queue: int = 10000):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_files = max_files
+        self.max_queue = max_queue
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        # Bodies held by queued records, so memory_budget.py can see and shed the backlog
+        self.queued_bytes = 0
+        self._queued_lock = threading.Lock()
+        self._queue: "queue.SimpleQueue[Optional[Tuple[Callable[[], Dict[str, Any]], int]]]" = queue.SimpleQueue()
+        self._file = None
+        self._size = 0
+        os.makedirs(directory, exist_ok=True)
+        self._thread = threading.Thread(target=self._run, name="traffic-capture", daemon=True)
+        self._thread.start()
+
+    def write(self, record: Callable[[], Dict[str, Any]], size: int = 0) -> None:
+        """
+        Queue a record of about `size` bytes; `record` is called on the writer thread,
+        so scrubbing stays off the event loop
+        """
+        if self._queue.qsize() >= self.max_queue:
+            self.dropped += 1  # never let a slow disk hold up requests
+            return
+        with self._queued_lock:
+            self.queued_bytes += size
+        self._queue.put((record, size))
+
+    def _take(self, block: bool = True) -> Optional[Tuple[Callable[[], Dict[str, Any]], int]]:
+        item = self._queue.get(block)
+        if item is not None:
+            with self._queued_lock:
+                self.queued_bytes -= item[1]
+        return item
+
+    def evict_fraction(self, fraction: float) -> int:
+        """Drop the oldest share of queued records under memory pressure, returning how many were dropped"""
+        count = 0
+        for _ in range(int(self._queue.qsize() * fraction)):
+            try:
+                item = self._take(block=False)
+            except queue.Empty:
+                break
+            if item is None:  # close() is waiting for the writer to see this
+                self._queue.put(None)
+                break
+            count += 1
+        self.dropped += count
+        return count
+
+    def _rotate(self) -> None:
+        if self._file is not None:
+            self._file.close()
+        name = f"capture-{os.getpid()}-{time.strftime('%Y%m%d-%H%M%S')}-{time.time_ns() % 1000000:06d}.ndjson"
+        self._file = open(os.path.join(self.directory, name), "a", encoding="utf-8")
+        self._size = 0
+        for old in sorted(glob.glob(os.path.join(self.directory, "capture-*.ndjson")), key=os.path.getmtime)[:-self.max_files]:
+            os.remove(old)
+
+    def _run(self) -> None:
+        while True:
+            item = self._take()
+            if item is None:
+                break
+            record = item[0]
+            # One bad record or a full disk must not stop the thread for the rest of the process
+            try:
+                line = json.dumps(record(), ensure_ascii=False) + "\n"
+                if self._file is None or self._size >= self.max_bytes:
+                    self._rotate()
+                self._file.write(line)
+                self._size += len(line.encode("utf-8"))
+                self.written += 1
+                if self._queue.empty():
+                    self._file.flush()
+            except Exception as e:
+                self.failed += 1
+                print(f"Traffic capture record failed: {e}", file=sys.stderr)
+        if self._file is not None:
+            self._file.close()
+
+    def close(self) -> None:
+        self._queue.put(None)
+        self._thread.join()
+
+    def stats(self) -> Dict[str, Any]:
+        return {"directory": self.directory, "written": self.written, "dropped": self.dropped,
+                "failed": self.failed, "queued": self._queue.qsize(), "queued_bytes": self.queued_bytes}
+
+
+class CaptureMiddleware:
+    """Samples requests under `include` prefixes; `identify(authorization)` returns (email, organization) or None"""
+
+    def __init__(self, app, writer: CaptureWriter, sample_rate: float, scrubber: Scrubber,
+                 identify: Callable[[str], Optional[Tuple[str, str]]],
+                 include: Tuple[str, ...] = ("/api/",), exclude: Tuple[str, ...] = ("/api/admin/",),
+                 max_body_bytes: int = 256 * 1024):
+        self.app = app
+        self.writer = writer
+        self.sample_rate = sample_rate
+        self.scrubber = scrubber
+        self.identify = identify
+        self.include = include
+        self.exclude = exclude
+        self.max_body_bytes = max_body_bytes
+
+    async def __call__(self, scope, receive, send):
+        if (scope["type"] != "http" or random.random() >= self.sample_rate
+                or not scope["path"].startswith(self.include) or scope["path"].startswith(self.exclude)):
+            await self.app(scope, receive, send)
+            return
+
+        request_body = bytearray()
+        response_body = bytearray()
+        response = {"status": 500, "content_type": "", "truncated": False}
+
+        async def capture_receive():
+            message = await receive()
+            if message["type"] == "http.request" and len(request_body) <= self.max_body_bytes:
+                request_body.extend(message.get("body", b""))
+            return message
+
+        async def capture_send(message):
+            if message["type"] == "http.response.start":
+                response["status"] = message["status"]
+                for key, value in message.get("headers", []):
+                    if key == b"content-type":
+                        response["content_type"] = value.decode("latin-1")
+            elif message["type"] == "http.response.body" and not response["truncated"]:
+                chunk = message.get("body", b"")
+                if len(response_body) + len(chunk) > self.max_body_bytes:
+                    response["truncated"] = True
+                else:
+                    response_body.extend(chunk)
+            await send(message)
+
+        wall_started = time.time()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, capture_receive, capture_send)
+        finally:
+            duration_ms = (time.perf_counter() - started) * 1000
+            identity = None
+            for key, value in scope["headers"]:
+                if key == b"authorization":
+                    identity = self.identify(value.decode("latin-1"))
+            self.writer.write(functools.partial(self._record, scope, identity, bytes(request_body),
+                                                bytes(response_body), response, wall_started, duration_ms),
+                              len(request_body) + len(response_body))
+
+    def _record(self, scope, identity: Optional[Tuple[str, str]], request_body: bytes, response_body: bytes,
+                response: Dict[str, Any], wall_started: float, duration_ms: float) -> Dict[str, Any]:
+        headers = {key.decode("latin-1"): value.decode("latin-1")
+                   for key, value in scope["headers"] if key in CAPTURED_HEADERS}
+        user = None
+        if identity is not None:
+            user = {"email": self.scrubber.pseudonym("email", identity[0]),
+                    "organization": self.scrubber.pseudonym("organization", identity[1])}
+        body: Any = None
+        if request_body:
+            try:
+                body = {"json": self.scrubber.scrub(json.loads(request_body))}
+            except ValueError:
+                body = {"omitted_bytes": len(request_body)}  # non-JSON bodies may hold anything
+        return {
+            "ts": round(wall_started, 6),
+            "method": scope["method"],
+            "path": scope["path"],
+            "query": self.scrubber.scrub_query(scope.get("query_string", b"").decode("latin-1")),
+            "headers": headers,
+            "user": user,
+            "body": body,
+            "status": response["status"],
+            "duration_ms": round(duration_ms, 3),
+            "digest": None if response["truncated"] else response_digest(response_body, response["content_type"]),
+        }
+
+
+# Replay
+
+def load_capture(paths: Iterable[str]) -> List[Dict[str, Any]]:
+    records = []
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            records.extend(json.loads(line) for line in f if line.strip())
+    records.sort(key=lambda record: record["ts"])
+    return records
+
+
+def load_app(path: str):
+    """Import the ASGI `app` of a build from its entry file (the build's directory goes first on sys.path)"""
+    path = os.path.abspath(path)
+    sys.path.insert(0, os.path.dirname(path))
+    spec = importlib.util.spec_from_file_location("replay_target", path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules["replay_target"] = module
+    spec.loader.exec_module(module)
+    return module.app
+
+
+class AsgiDriver:
+    """Minimal in-process ASGI client: lifespan plus one-shot HTTP requests"""
+
+    def __init__(self, app):
+        self.app = app
+        self._lifespan_in: "asyncio.Queue[Dict[str, Any]]" = asyncio.Queue()
+        self._lifespan_out: "asyncio.Queue[Dict[str, Any]]" = asyncio.Queue()
+        self._lifespan_task: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        scope = {"type": "lifespan", "asgi": {"version": "3.0"}, "state": {}}
+        self._lifespan_task = asyncio.ensure_future(self.app(scope, self._lifespan_in.get, self._lifespan_out.put))
+        await self._lifespan_in.put({"type": "lifespan.startup"})
+        message = await self._lifespan_out.get()
+        if message["type"] != "lifespan.startup.complete":
+            raise RuntimeError(f"Application startup failed: {message.get('message')}")
+
+    async def stop(self) -> None:
+        await self._lifespan_in.put({"type": "lifespan.shutdown"})
+        await self._lifespan_out.get()
+        await self._lifespan_task
+
+    async def request(self, method: str, path: str, query: str = "", headers: Optional[Dict[str, str]] = None,
+                      body: bytes = b"") -> Tuple[int, Dict[str, str], bytes]:
+        headers = dict(headers or {})
+        headers.setdefault("host", "replay")
+        headers["content-length"] = str(len(body))
+        scope = {
+            "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": method,
+            "scheme": "http", "path": path, "raw_path": path.encode("utf-8"), "root_path": "",
+            "query_string": query.encode("latin-1"), "client": ("127.0.0.1", 0), "server": ("replay", 80),
+            "headers": [(key.lower().encode("latin-1"), value.encode("latin-1")) for key, value in headers.items()],
+        }
+        done = asyncio.Event()
+        sent = False
+        response = {"status": 500, "headers": {}, "body": bytearray()}
+
+        async def receive():
+            nonlocal sent
+            if not sent:
+                sent = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            await done.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            if message["type"] == "http.response.start":
+                response["status"] = message["status"]
+                response["headers"] = {k.decode("latin-1"): v.decode("latin-1") for k, v in message.get("headers", [])}
+            elif message["type"] == "http.response.body":
+                response["body"].extend(message.get("body", b""))
+
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            done.set()
+        return response["status"], response["headers"], bytes(response["body"])
+
+
+async def _login(driver: AsgiDriver, user: Dict[str, str]) -> Optional[str]:
+    """Register (if needed) and log in a pseudonymous user, waiting out auth rate limits"""
+    register = json.dumps({"first_name": "Replay", "last_name": "Replay", "email": user["email"],
+                           "organization": user["organization"], "password": REPLAY_PASSWORD}).encode()
+    login = json.dumps({"email": user["email"], "password": REPLAY_PASSWORD}).encode()
+    for path, body in (("/api/auth/register", register), ("/api/auth/login", login)):
+        for _ in range(30):
+            status, headers, response = await driver.request("POST", path, headers={"content-type": "application/json"},
+                                                             body=body)
+            if status != 429:
+                break
+            await asyncio.sleep(float(headers.get("retry-after", 1)))
+        if path.endswith("login") and status == 200:
+            return json.loads(response)["access_token"]
+    return None
+
+
+async def replay(app, records: List[Dict[str, Any]], speed: float = 1.0) -> List[Dict[str, Any]]:
+    """Send captured requests to `app`; speed 0 sends them one after another as fast as possible"""
+    driver = AsgiDriver(app)
+    await driver.start()
+    try:
+        tokens: Dict[str, Optional[str]] = {}
+        for record in records:
+            user = record.get("user")
+            if user and user["email"] not in tokens:
+                tokens[user["email"]] = await _login(driver, user)
+
+        results: List[Optional[Dict[str, Any]]] = [None] * len(records)
+
+        async def send_one(index: int, record: Dict[str, Any]) -> None:
+            headers = dict(record["headers"])
+            if "gzip" in headers.get("accept-encoding", ""):
+                # Still pay for compression, but in a format the digest can always decode
+                headers["accept-encoding"] = "gzip"
+            else:
+                headers.pop("accept-encoding", None)
+            token = tokens.get(record["user"]["email"]) if record.get("user") else None
+            if token:
+                headers["authorization"] = f"Bearer {token}"
+            body = record.get("body") or {}
+            payload = json.dumps(body["json"], ensure_ascii=False).encode("utf-8") if "json" in body else b""
+            started = time.perf_counter()
+            status, response_headers, response = await driver.request(record["method"], record["path"],
+                                                                       record["query"], headers, payload)
+            latency_ms = (time.perf_counter() - started) * 1000
+            if response_headers.get("content-encoding") == "gzip":
+                response = gzip.decompress(response)
+            results[index] = {
+                "seq": index,
+                "route": f"{record['method']} {route_of(record['path'])}",
+                "status": status,
+                "latency_ms": round(latency_ms, 3),
+                "digest": response_digest(response, response_headers.get("content-type", "")),
+                "captured_status": record["status"],
+                "captured_digest": record["digest"],
+            }
+
+        if speed <= 0:
+            for index, record in enumerate(records):
+                await send_one(index, record)
+        else:
+            origin, started = records[0]["ts"] if records else 0, time.perf_counter()
+            tasks = []
+            for index, record in enumerate(records):
+                delay = (record["ts"] - origin) / speed - (time.perf_counter() - started)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                tasks.append(asyncio.ensure_future(send_one(index, record)))
+            await asyncio.gather(*tasks)
+        return results
+    finally:
+        await driver.stop()
+
+
+def _percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))] if ordered else 0.0
+
+
+def compare(baseline: List[Dict[str, Any]], candidate: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Per-route latency percentiles of both runs, and requests whose status or response differ"""
+    routes: Dict[str, Dict[str, Any]] = {}
+    for a, b in zip(baseline, candidate):
+        route = routes.setdefault(a["route"], {"requests": 0, "baseline": [], "candidate": [],
+                                               "status_mismatches": 0, "response_mismatches": 0})
+        route["requests"] += 1
+        route["baseline"].append(a["latency_ms"])
+        route["candidate"].append(b["latency_ms"])
+        if a["status"] != b["status"]:
+            route["status_mismatches"] += 1
+        elif a["digest"] != b["digest"]:
+            route["response_mismatches"] += 1
+    report = {}
+    for name, route in sorted(routes.items()):
+        summary = {"requests": route["requests"], "status_mismatches": route["status_mismatches"],
+                   "response_mismatches": route["response_mismatches"]}
+        for q in (0.5, 0.9, 0.99):
+            a, b = _percentile(route["baseline"], q), _percentile(route["candidate"], q)
+            summary[f"p{int(q * 100)}_ms"] = [round(a, 2), round(b, 2), f"{(b - a) / a * 100:+.1f}%" if a else None]
+        report[name] = summary
+    return report
+
+
+def _write_results(path: str, results: List[Dict[str, Any]]) -> None:
+    with open(path, "w", encoding="utf-8") as f:
+        for result in results:
+            f.write(json.dumps(result) + "\n")
+
+
+def _read_results(path: str) -> List[Dict[str, Any]]:
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    commands = parser.add_subparsers(dest="command", required=True)
+    run = commands.add_parser("replay", help="replay captures against a build")
+    run.add_argument("app", help="entry file of the build, e.g. simple-api.py")
+    run.add_argument("captures", nargs="+")
+    run.add_argument("--speed", type=float, default=1.0, help="rate multiplier; 0 sends back to back")
+    run.add_argument("--out", default="replay-results.ndjson")
+    diff = commands.add_parser("compare", help="compare the results of two replays")
+    diff.add_argument("baseline")
+    diff.add_argument("candidate")
+    args = parser.parse_args()
+
+    if args.command == "replay":
+        records = load_capture(args.captures)
+        results = asyncio.run(replay(load_app(args.app), records, args.speed))
+        _write_results(args.out, results)
+        changed = sum(r["status"] != r["captured_status"] for r in results)
+        print(f"{len(results)} requests replayed, {changed} with a different status than captured -> {args.out}")
+    else:
+        report = compare(_read_results(args.baseline), _read_results(args.candidate))
+        print(json.dumps(report, indent=2, ensure_ascii=False))
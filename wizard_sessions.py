@@ -0,0 +1,199 @@
+"""
+Server-side assessment wizard sessions with incremental re-evaluation
+
+Each answered step updates the session's answers. The rules engine is run
+on a dict that records which inputs it reads, so after a change only the
+stages (classification, full evaluation) whose recorded inputs include a
+changed field are run again. Unanswered fields use provisional defaults.
+Both stages escalate on description signals like a stored assessment does
+(see description_signals.evaluate), so reading the description is recorded.
+
+Session IDs are random, not time-sortable, so they cannot be guessed. A
+session belongs to the user who started it. For anonymous sessions, the
+ID itself is the only credential.
+"""
+
+import datetime
+import secrets
+import time
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from description_signals import classify, evaluate
+
+# Provisional engine inputs for questions the user has not answered yet
+PROVISIONAL_DEFAULTS = {
+    "description": "",
+    "ai_system_type": "other",
+    "role": "deployer",
+    "branch_sector": "other",
+    "handles_personal_data": False,
+    "data_types": [],
+    "automated_decisions": False,
+    "decision_type": "monitoring",
+    "decision_impact": [],
+}
+
+SESSION_TTL_SECONDS = 24 * 60 * 60
+
+
+class TrackingResponses(dict):
+    """dict that records which keys the rules engine reads"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.reads: Set[str] = set()
+
+    def __getitem__(self, key):
+        self.reads.add(key)
+        return super().__getitem__(key)
+
+    def get(self, key, default=None):
+        self.reads.add(key)
+        return super().get(key, default)
+
+    def __contains__(self, key):
+        self.reads.add(key)
+        return super().__contains__(key)
+
+    def _read_all(self):
+        self.reads.update(super().keys())
+
+    def keys(self):
+        self._read_all()
+        return super().keys()
+
+    def values(self):
+        self._read_all()
+        return super().values()
+
+    def items(self):
+        self._read_all()
+        return super().items()
+
+    def __iter__(self):
+        self._read_all()
+        return super().__iter__()
+
+    def copy(self):
+        self._read_all()
+        return dict(super().items())
+
+
+def summarize_result(result, classification: str) -> Dict[str, Any]:
+    return {
+        "risk_score": result.risk_score,
+        "risk_level": result.risk_level,
+        "decision": result.decision,
+        "compliance_status": result.compliance_status,
+        "required_assessments": list(result.required_assessments),
+        "ai_classification": classification,
+        "kræver_dpia": "DPIA" in result.required_assessments,
+        "kræver_fria": "FRIA" in result.required_assessments,
+    }
+
+
+class WizardSessions:
+    def __init__(self, engine, state, analyzer=None, ttl_seconds: int = SESSION_TTL_SECONDS):
+        self.engine = engine
+        self.analyzer = analyzer
+        self.state = state
+        self.ttl_seconds = ttl_seconds
+
+    @staticmethod
+    def _namespace(tenant_key: str) -> str:
+        return f"wizard_sessions:{tenant_key}"
+
+    def responses(self, session: Dict[str, Any]) -> Dict[str, Any]:
+        return {**PROVISIONAL_DEFAULTS, **session["answers"]}
+
+    def _run(self, session: Dict[str, Any], changed: Optional[Set[str]]) -> List[str]:
+        """Re-run the stages whose recorded inputs intersect `changed` (all if None)"""
+        rerun = []
+        responses = self.responses(session)
+
+        if changed is None or changed & set(session["classification_reads"]):
+            tracked = TrackingResponses(responses)
+            session["classification"] = classify(self.engine, self.analyzer, tracked)[1]
+            session["classification_reads"] = sorted(tracked.reads)
+            rerun.append("classification")
+
+        if changed is None or changed & set(session["evaluation_reads"]):
+            tracked = TrackingResponses(responses)
+            result, classification = evaluate(self.engine, self.analyzer, tracked)
+            session["classification"] = classification
+            session["evaluation_reads"] = sorted(tracked.reads)
+            session["provisional"] = summarize_result(result, session["classification"])
+            session["evaluations"] += 1
+            rerun.append("evaluation")
+        elif "classification" in rerun:
+            session["provisional"] = {**session["provisional"], "ai_classification": session["classification"]}
+
+        return rerun
+
+    def create(self, tenant_key: str, system_name: str, answers: Dict[str, Any],
+               created_by: Optional[str] = None) -> Dict[str, Any]:
+        now = datetime.datetime.now().isoformat()
+        session = {
+            "id": "wizard_" + secrets.token_urlsafe(24),
+            "system_name": system_name,
+            "created_by": created_by,
+            "answers": dict(answers),
+            "answered_steps": [],
+            "classification": None,
+            "classification_reads": [],
+            "evaluation_reads": [],
+            "provisional": {},
+            "evaluations": 0,
+            "created_at": now,
+            "updated_at": now,
+            "expires_at": time.time() + self.ttl_seconds,
+        }
+        self._run(session, None)
+        self.state.set(self._namespace(tenant_key), session["id"], session)
+        return session
+
+    def get(self, tenant_key: str, session_id: str, owner: Optional[str]) -> Optional[Dict[str, Any]]:
+        """The session if it exists, has not expired and was started by `owner` (None: anonymously)"""
+        session = self.state.get(self._namespace(tenant_key), session_id)
+        if session is None:
+            return None
+        if session["expires_at"] < time.time():
+            self.delete(tenant_key, session_id)
+            return None
+        if session["created_by"] != owner:
+            return None
+        return session
+
+    def answer(self, tenant_key: str, session_id: str, owner: Optional[str], answers: Dict[str, Any],
+               step: Optional[int] = None) -> Tuple[Optional[Dict[str, Any]], List[str]]:
+        session = self.get(tenant_key, session_id, owner)
+        if session is None:
+            return None, []
+        session = dict(session)
+
+        changed = {key for key, value in answers.items() if session["answers"].get(key) != value}
+        session["answers"] = {**session["answers"], **answers}
+        if step is not None and step not in session["answered_steps"]:
+            session["answered_steps"] = sorted(session["answered_steps"] + [step])
+
+        rerun = self._run(session, changed) if changed else []
+        session["updated_at"] = datetime.datetime.now().isoformat()
+        session["expires_at"] = time.time() + self.ttl_seconds
+        self.state.set(self._namespace(tenant_key), session_id, session)
+        return session, rerun
+
+    def delete(self, tenant_key: str, session_id: str) -> None:
+        self.state.delete(self._namespace(tenant_key), session_id)
+
+    def prune(self, tenant_keys: Iterable[str]) -> int:
+        """Delete the expired sessions of these tenants, returning how many"""
+        now, removed = time.time(), 0
+        for tenant_key in tenant_keys:
+            for session_id, session in self.state.items(self._namespace(tenant_key)):
+                if session["expires_at"] < now:
+                    self.delete(tenant_key, session_id)
+                    removed += 1
+        return removed
+
+    def missing_fields(self, session: Dict[str, Any], required: Iterable[str]) -> List[str]:
+        return [field for field in required if field not in session["answers"]]